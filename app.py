@@ -1,138 +1,502 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, make_response, render_template, request
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import os
+import queue
 import sqlite3
+import threading
 import time
-import numpy as np
-from collections import defaultdict
+from contextlib import contextmanager
+import deal_worker
+import metrics
+import setup_database
+
+try:
+    import brotli  # Optional: `pip install brotli` to serve br to clients that accept it
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
 # --- Configuration ---
-DB_FILE = "wow_auctions.db"
+REGIONS = setup_database.REGIONS  # Served regions, each from its own database; /api/deals merges them by default
 MIN_PRICE_RATIO = 3.0
 MIN_GOLD_PRICE = 1000
 MAX_REALISTIC_GOLD_PRICE = 3000000
 MIN_REALM_COUNT = 5
 PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+# Run deal_worker.py in a thread of the app; set APP_DEAL_WORKER=0 when it runs as its own process
+RUN_DEAL_WORKER = os.getenv("APP_DEAL_WORKER", "1") != "0"
+DB_POOL_SIZE = int(os.getenv("APP_DB_POOL_SIZE", "8"))  # Idle read-only connections kept open per region
+# Load realm names and the first deal pages in the background at startup; /ready answers 503 until done
+WARM_UP = os.getenv("APP_WARM_UP", "1") != "0"
+# /api/deals ETags come from each region's deal versions, re-read from the database at most this often
+DEAL_VERSION_CHECK_SECONDS = float(os.getenv("APP_DEAL_VERSION_CHECK_SECONDS", "2"))
+COMPRESS_MIN_BYTES = 1024  # Smaller responses aren't worth compressing
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain"}
+INDEX_CACHE_CONTROL = "public, max-age=300"  # The page is static; deals are fetched by its script
 # ----------------------
 
+COPPER_PER_GOLD = 10000
+
+# Deals are precomputed by deal_worker.py into each region's deal_candidates table; requests only
+# filter and page it. (region, time the deals were computed, filter) -> matching deal count
+_deal_totals = {}
+_deal_totals_lock = threading.Lock()
+
+# Per region, connected_realm_id -> name, reloaded when update_realms_cache.py bumps realms_version
+_realm_names = {region: {"version": None, "names": {}} for region in REGIONS}
+
+# Region -> (monotonic time checked, the scan_metadata values its deal responses depend on)
+_deal_versions = {}
+_deal_versions_lock = threading.Lock()
+
+# ETag -> serialized /api/deals body, so clients without a cached copy don't re-run the query either
+_deal_responses = {}
+_deal_responses_lock = threading.Lock()
+
+# Set once warm_up() has finished, see /ready
+_ready = threading.Event()
+_warm_up_seconds = None
+_started = False  # See start_background_tasks()
+_started_lock = threading.Lock()
+
+# Served on /metrics, next to the scanner's last sweep summary
+METRICS = metrics.Registry()
+API_DEALS_SECONDS = METRICS.histogram(
+    "wow_api_deals_request_seconds", "Latency of /api/deals requests, by sort key.")
+API_DEALS_REQUESTS = METRICS.counter(
+    "wow_api_deals_requests_total", "Requests to /api/deals, by sort key.")
+API_DEALS_NOT_MODIFIED = METRICS.counter(
+    "wow_api_deals_not_modified_total", "Requests to /api/deals answered with 304 Not Modified.")
+
+# /api/deals sort keys and the deal_candidates column each one orders by, highest first:
+# unit price ratio, gold made by flipping every unit below the sell price, and listings across all realms
+SORT_COLUMNS = {"ratio": "ratio", "profit": "profit", "liquidity": "liquidity"}
+
+class ConnectionPool:
+    """Read-only connections to one database, opened on demand and reused by later requests.
+
+    Connections keep the reader pragmas of setup_database.connect, so their page cache and memory
+    map stay warm between requests. Up to `size` idle ones are kept; a returned connection's read
+    transaction is ended, and one that raised an error is closed instead of being reused.
+    """
+
+    def __init__(self, db_file, size=DB_POOL_SIZE):
+        self.db_file = db_file
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            # Handed from thread to thread, but only ever used by one at a time
+            conn = setup_database.connect(self.db_file, read_only=True, check_same_thread=False)
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.rollback()
+        except BaseException:
+            conn.close()
+            raise
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+_connection_pools = {region: ConnectionPool(setup_database.db_file_for_region(region)) for region in REGIONS}
+
 def format_price(price_in_copper):
-    if not isinstance(price_in_copper, (int, float, np.integer)):
+    if not isinstance(price_in_copper, (int, float)):
         return "N/A"
     gold = int(price_in_copper / 10000)
     silver = int((price_in_copper % 10000) / 100)
     copper = int(price_in_copper % 100)
     return f"{gold}g {silver}s {copper}c"
 
-def get_deals_page(page=1, page_size=25):
-    offset = (page - 1) * page_size
-    start_time = time.time()
-
+def get_metadata_version(conn, key):
+    """Returns a version counter from scan_metadata, e.g. the one the scanner bumps after every sweep."""
     try:
-        conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
-        cursor = conn.cursor()
-        raw_prices_query = """
-            SELECT item_id, connected_realm_id, MIN(buyout_price)
-            FROM auctions
-            WHERE buyout_price IS NOT NULL
-            GROUP BY item_id, connected_realm_id;
-        """
-        cursor.execute(raw_prices_query)
-        all_realm_min_prices = cursor.fetchall()
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-        return []
-    finally:
-        if 'conn' in locals():
-            conn.close()
+        row = conn.execute("SELECT value FROM scan_metadata WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        return 0
+    return row[0] if row else 0
+
+def region_connection(region):
+    """A pooled read-only connection to a region's database, for use in a `with` block."""
+    return _connection_pools[region].connection()
 
-    item_data = defaultdict(list)
-    for item_id, realm_id, price in all_realm_min_prices:
-        item_data[item_id].append((price, realm_id))
+def get_deal_freshness(conn):
+    """Which snapshot the region's deal candidates were computed from, when it was taken and when they were computed."""
+    values = dict(conn.execute("""
+        SELECT key, value FROM scan_metadata
+        WHERE key IN ('snapshot_version', 'deals_snapshot_version', 'deals_snapshot_at', 'deals_computed_at',
+                      'deals_compute_seconds', 'deals_item_count')
+    """).fetchall())
+    return {
+        "snapshotVersion": values.get('deals_snapshot_version'),
+        "latestSnapshotVersion": values.get('snapshot_version', 0),
+        "snapshotAt": values.get('deals_snapshot_at'),
+        "computedAt": values.get('deals_computed_at'),
+        "computeSeconds": values.get('deals_compute_seconds'),
+        "itemCount": values.get('deals_item_count', 0),
+    }
 
-    deals = []
-    for item_id, price_realm_tuples in item_data.items():
-        if len(price_realm_tuples) < MIN_REALM_COUNT:
-            continue
+def count_deals(conn, key, where_sql, params):
+    """Number of deal candidates matching a filter, cached per (region, time the deals were computed, filter) `key`."""
+    with _deal_totals_lock:
+        if key in _deal_totals:
+            return _deal_totals[key]
+    total = conn.execute(f"SELECT COUNT(*) FROM deal_candidates WHERE {where_sql}", params).fetchone()[0]
+    with _deal_totals_lock:
+        if len(_deal_totals) > 1024:
+            _deal_totals.clear()
+        _deal_totals[key] = total
+    return total
 
-        prices_array = np.array([p for p, _ in price_realm_tuples])
-        q1 = np.percentile(prices_array, 25)
-        q3 = np.percentile(prices_array, 75)
-        iqr = q3 - q1
-        outlier_threshold = q3 + (1.5 * iqr)
+def get_realm_names(conn, region):
+    """Returns the region's in-memory realm id -> name map, reloading it only after the realm cache was updated."""
+    cached = _realm_names[region]
+    version = get_metadata_version(conn, 'realms_version')
+    if cached["version"] != version:
+        names = dict(conn.execute("SELECT connected_realm_id, name FROM realms").fetchall())
+        cached.update(version=version, names=names)
+    return cached["names"]
 
-        realistic_data = [t for t in price_realm_tuples if t[0] <= outlier_threshold]
-        if realistic_data:
-            median_price = np.median([t[0] for t in realistic_data])
-            mad = np.median(np.abs([t[0] - median_price for t in realistic_data])) or 1
-            mad_threshold = 5 * mad
-            realistic_data = [
-                t for t in realistic_data
-                if abs(t[0] - median_price) <= mad_threshold
-            ]
+def get_deal_versions(region):
+    """The scan_metadata values a region's /api/deals responses depend on (the snapshot and deal
+    versions, when the deals were computed and the realm names version), or None if unreadable.
+
+    They are read at most every DEAL_VERSION_CHECK_SECONDS, so conditional requests arriving in
+    between are answered without touching the database.
+    """
+    now = time.monotonic()
+    with _deal_versions_lock:
+        cached = _deal_versions.get(region)
+    if cached and now - cached[0] < DEAL_VERSION_CHECK_SECONDS:
+        return cached[1]
+    try:
+        with region_connection(region) as conn:
+            versions = sorted(conn.execute("""
+                SELECT key, value FROM scan_metadata
+                WHERE key IN ('snapshot_version', 'deals_snapshot_version', 'deals_computed_at', 'realms_version')
+            """).fetchall())
+    except sqlite3.Error:
+        versions = None
+    with _deal_versions_lock:
+        _deal_versions[region] = (now, versions)
+    return versions
 
-        if len(realistic_data) < MIN_REALM_COUNT:
-            continue
+def deals_etag(regions, args):
+    """ETag of an /api/deals response: the deal versions of its regions plus every query parameter."""
+    key = json.dumps([[[region, get_deal_versions(region)] for region in regions], sorted(args.items(multi=True))])
+    return hashlib.sha1(key.encode()).hexdigest()
 
-        realistic_data.sort(key=lambda x: x[0])
-        min_price, min_realm = realistic_data[0]
-        max_price, max_realm = realistic_data[-1]
+def parse_regions(value):
+    """Regions selected by the `region` query parameter: one or more (comma-separated), or all by default."""
+    if not value or value == "all":
+        return list(REGIONS)
+    regions = [region.strip().lower() for region in value.split(",") if region.strip()]
+    unknown = [region for region in regions if region not in REGIONS]
+    if unknown:
+        raise ValueError(f"region must be 'all' or one of {', '.join(REGIONS)}")
+    return [region for region in REGIONS if region in regions]
 
-        if min_price < (MIN_GOLD_PRICE * 10000) or max_price > (MAX_REALISTIC_GOLD_PRICE * 10000):
-            continue
+def parse_id_list(value):
+    return [int(part) for part in value.split(",") if part.strip()] if value else []
 
-        ratio = max_price / min_price
-        if ratio < MIN_PRICE_RATIO:
-            continue
+def parse_deal_filters(args):
+    """Reads the /api/deals thresholds and filters from query parameters. Raises ValueError on bad input."""
+    filters = {
+        "min_ratio": float(args.get("min_ratio") or MIN_PRICE_RATIO),
+        "min_gold": float(args.get("min_gold") or MIN_GOLD_PRICE),
+        "max_gold": float(args.get("max_gold") or MAX_REALISTIC_GOLD_PRICE),
+        "min_realms": int(args.get("min_realms") or MIN_REALM_COUNT),
+        "quality": (args.get("quality") or "").upper() or None,
+        "realms": parse_id_list(args.get("realms")),
+        "exclude_realms": parse_id_list(args.get("exclude_realms")),
+    }
+    if any(value != value for value in (filters["min_ratio"], filters["min_gold"], filters["max_gold"])):
+        raise ValueError("thresholds must be numbers")
+    return filters
 
-        deals.append((item_id, ratio, min_price, min_realm, max_price, max_realm))
+def deal_filter_sql(filters):
+    """WHERE clause and parameters selecting the deals that pass `filters`, as deal_engine.deal_mask would."""
+    clauses = ["realm_count >= ?", "kept_count >= ?", "min_price >= ?", "max_price <= ?", "ratio >= ?"]
+    params = [
+        filters["min_realms"], filters["min_realms"],
+        filters["min_gold"] * COPPER_PER_GOLD, filters["max_gold"] * COPPER_PER_GOLD,
+        filters["min_ratio"],
+    ]
+    if filters["quality"]:
+        clauses.append("quality = ?")
+        params.append(filters["quality"])
+    if filters["realms"]:
+        # Deals to buy on or sell to one of these realms
+        placeholders = ",".join("?" * len(filters["realms"]))
+        clauses.append(f"(min_realm IN ({placeholders}) OR max_realm IN ({placeholders}))")
+        params.extend(filters["realms"] * 2)
+    if filters["exclude_realms"]:
+        placeholders = ",".join("?" * len(filters["exclude_realms"]))
+        clauses.append(f"min_realm NOT IN ({placeholders}) AND max_realm NOT IN ({placeholders})")
+        params.extend(filters["exclude_realms"] * 2)
+    return " AND ".join(clauses), params
 
-    deals.sort(key=lambda x: x[1], reverse=True)
-    selected_deals = deals[offset:offset + page_size]
+def encode_cursor(sort, sort_value, region, first_seen):
+    return base64.urlsafe_b64encode(json.dumps([sort, sort_value, region, first_seen]).encode()).decode()
 
+def decode_cursor(cursor, sort):
+    """Returns the (sort value, region, first_seen) keyset position of a cursor. Raises ValueError if it's invalid."""
     try:
-        conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
-        cursor = conn.cursor()
-        final_results = []
-        for item_id, ratio, min_price, min_realm, max_price, max_realm in selected_deals:
-            cursor.execute("SELECT name, icon_url FROM items WHERE item_id = ?", (item_id,))
-            item_row = cursor.fetchone()
-            item_name, icon_url = item_row if item_row else ("Unknown", "")
-
-            cursor.execute("SELECT name FROM realms WHERE connected_realm_id = ?", (min_realm,))
-            min_realm_name_row = cursor.fetchone()
-            min_realm_name = min_realm_name_row[0] if min_realm_name_row else str(min_realm)
-
-            cursor.execute("SELECT name FROM realms WHERE connected_realm_id = ?", (max_realm,))
-            max_realm_name_row = cursor.fetchone()
-            max_realm_name = max_realm_name_row[0] if max_realm_name_row else str(max_realm)
-
-            final_results.append({
-                "itemId": item_id,
-                "itemName": item_name,
-                "itemIcon": icon_url,
-                "minPrice": format_price(min_price),
-                "maxPrice": format_price(max_price),
-                "minRealm": min_realm_name,
-                "maxRealm": max_realm_name,
-                "ratio": f"{ratio:.2f}x"
-            })
-        return final_results
-    finally:
-        if 'conn' in locals():
-            conn.close()
+        cursor_sort, sort_value, region, first_seen = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if cursor_sort != sort:
+        raise ValueError("cursor belongs to a different sort order")
+    return sort_value, region, first_seen
+
+def keyset_sql(column, region, position):
+    """SQL condition selecting a region's deals that come after the cursor `position` in the merged order.
+
+    Deals are ordered by the sort column (highest first), then by region name, then by first_seen.
+    """
+    sort_value, cursor_region, first_seen = position
+    if region < cursor_region:
+        return f"{column} < ?", [sort_value]
+    if region > cursor_region:
+        return f"{column} <= ?", [sort_value]
+    return f"({column} < ? OR ({column} = ? AND first_seen > ?))", [sort_value, sort_value, first_seen]
+
+def get_deals_page(filters, sort="ratio", cursor=None, page_size=PAGE_SIZE, regions=None):
+    """Returns one page of deals matching `filters`, best first by `sort`, starting after `cursor`.
+
+    Only reads the deal candidates deal_worker.py precomputed. With several `regions` (default:
+    all served ones) they are merged: each region only returns its best page_size + 1 deals past
+    the cursor, and those are merged in Python. The response holds the deals, the total number of
+    matching deals, the cursor of the next page (None on the last page) and, per region, how fresh
+    its deals are. Raises ValueError for an unknown sort key or a bad cursor.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    column = SORT_COLUMNS[sort]
+    regions = regions or REGIONS
+    response = {"deals": [], "total": 0, "nextCursor": None, "sort": sort, "regions": list(regions), "freshness": {}}
+    position = decode_cursor(cursor, sort) if cursor else None
+
+    where_sql, params = deal_filter_sql(filters)
+    candidates = []
+    realm_names = {}
+    for region in regions:
+        try:
+            with region_connection(region) as conn:
+                # One read transaction, so the count, the page and the freshness come from the same write of the worker
+                conn.execute("BEGIN")
+                freshness = get_deal_freshness(conn)
+                response["freshness"][region] = freshness
+                if freshness["snapshotVersion"] is None:
+                    continue  # The worker hasn't scored this region yet
+                # Keyed by when the deals were computed: a forced recompute keeps the snapshot version
+                response["total"] += count_deals(conn, (region, freshness["computedAt"], where_sql, tuple(params)),
+                                                 where_sql, params)
+                page_sql, page_params = where_sql, list(params)
+                if position:
+                    keyset, keyset_params = keyset_sql(column, region, position)
+                    page_sql += f" AND {keyset}"
+                    page_params += keyset_params
+                rows = conn.execute(f"""
+                    SELECT item_id, item_name, icon_url, ratio, min_price, min_realm, max_price, max_realm,
+                           profit, liquidity, kept_count, depth, first_seen, {column}
+                    FROM deal_candidates WHERE {page_sql}
+                    ORDER BY {column} DESC, first_seen
+                    LIMIT ?
+                """, page_params + [page_size + 1]).fetchall()
+                candidates.extend((region, row) for row in rows)
+                realm_names[region] = get_realm_names(conn, region)
+        except sqlite3.Error as e:
+            print(f"Database error ({region}): {e}")
+
+    candidates.sort(key=lambda candidate: (-candidate[1][-1], candidate[0], candidate[1][-2]))
+    if len(candidates) > page_size:
+        candidates = candidates[:page_size]
+        region, row = candidates[-1]
+        response["nextCursor"] = encode_cursor(sort, row[-1], region, row[-2])
+
+    for region, (item_id, item_name, icon_url, ratio, min_price, min_realm, max_price, max_realm,
+                 profit, liquidity, kept_count, depth, _, _) in candidates:
+        names = realm_names.get(region, {})
+        response["deals"].append({
+            "region": region,
+            "itemId": item_id,
+            "itemName": item_name,
+            "itemIcon": icon_url,
+            "minPrice": format_price(min_price),
+            "maxPrice": format_price(max_price),
+            "minRealm": names.get(min_realm, str(min_realm)),
+            "maxRealm": names.get(max_realm, str(max_realm)),
+            "minRealmId": min_realm,
+            "maxRealmId": max_realm,
+            "ratio": f"{ratio:.2f}x",
+            "profit": format_price(profit),
+            "liquidity": liquidity,
+            "realmCount": kept_count,
+            "depth": depth,
+        })
+    return response
+
+def warm_up():
+    """Gets every region ready to serve before /ready reports the app as ready.
+
+    Opens each region's first pooled connection, loads its realm names and fetches the first page
+    of deals in every sort order (item names and icons come with the deal candidates). That fills
+    the deal count cache and pulls the index and table pages a request reads into SQLite's cache,
+    so the first requests after a restart aren't slower than later ones.
+    """
+    global _warm_up_seconds
+    start = time.perf_counter()
+    app.jinja_env.get_template('index.html')
+    for region in REGIONS:
+        try:
+            with region_connection(region) as conn:
+                get_realm_names(conn, region)
+        except sqlite3.Error as e:
+            print(f"Could not warm up {region}: {e}")
+    filters = parse_deal_filters({})
+    for sort in SORT_COLUMNS:
+        get_deals_page(filters, sort)
+    _warm_up_seconds = time.perf_counter() - start
+    _ready.set()
+    print(f"Warmed up {len(REGIONS)} regions in {_warm_up_seconds:.2f}s, ready to serve.")
+
+@app.route('/ready')
+def ready():
+    """Readiness probe for load balancers: 503 until the startup warm-up has finished, then 200."""
+    if not _ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True, "warmUpSeconds": _warm_up_seconds})
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    response = make_response(render_template('index.html', regions=REGIONS))
+    response.headers['Cache-Control'] = INDEX_CACHE_CONTROL
+    response.add_etag(weak=True)  # Weak: the same page is also served compressed
+    return response.make_conditional(request)
 
 @app.route('/api/deals')
 def get_deals():
+    """Query parameters: region (one or more, comma-separated, or all), min_ratio, min_gold, max_gold,
+    min_realms, quality, realms and exclude_realms (comma-separated connected realm ids), sort (ratio,
+    profit or liquidity), limit and cursor.
+
+    Responses carry an ETag that only changes with a new deal snapshot or realm names, and a
+    matching If-None-Match is answered with 304 without running the query.
+    """
+    sort = request.args.get('sort', 'ratio')
+    sort_label = sort if sort in SORT_COLUMNS else "invalid"  # Keeps metric label values bounded
+    with API_DEALS_SECONDS.time(sort=sort_label):
+        try:
+            filters = parse_deal_filters(request.args)
+            regions = parse_regions(request.args.get('region'))
+            page_size = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            etag = deals_etag(regions, request.args)
+            if request.if_none_match.contains_weak(etag):
+                API_DEALS_NOT_MODIFIED.inc()
+                response = Response(status=304)
+            else:
+                with _deal_responses_lock:
+                    body = _deal_responses.get(etag)
+                if body is None:
+                    deals = get_deals_page(filters, sort, request.args.get('cursor'), page_size, regions)
+                    body = jsonify(deals).get_data()
+                    with _deal_responses_lock:
+                        if len(_deal_responses) > 256:
+                            _deal_responses.clear()
+                        _deal_responses[etag] = body
+                response = Response(body, mimetype="application/json")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    API_DEALS_REQUESTS.inc(sort=sort_label)
+    response.set_etag(etag, weak=True)
+    # Caches may keep the response but must check it's still current, which is cheap
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compresses larger text responses with brotli (when installed) or gzip, if the client accepts either."""
+    if (response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def load_deal_freshness(region):
+    try:
+        with region_connection(region) as conn:
+            return get_deal_freshness(conn)
+    except sqlite3.Error as e:
+        print(f"Could not load deal status ({region}): {e}")
+        return None
+
+def load_sweep_metrics(region):
+    """Returns the summary of the scanner's last sweep of a region, or None before the first instrumented sweep."""
     try:
-        page = int(request.args.get('page', 1))
-    except ValueError:
-        page = 1
-    deals = get_deals_page(page)
-    return jsonify(deals)
+        with region_connection(region) as conn:
+            row = conn.execute("SELECT value FROM scan_metadata WHERE key = 'last_sweep_metrics'").fetchone()
+        return json.loads(row[0]) if row else None
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Could not load scanner metrics ({region}): {e}")
+        return None
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of the app's own metrics, the deal worker's status and the scanner's
+    last sweep of every region."""
+    deals = {region: load_deal_freshness(region) for region in REGIONS}
+    sweeps = {region: load_sweep_metrics(region) for region in REGIONS}
+    body = (METRICS.render() + metrics.deal_metrics_registry(deals).render()
+            + metrics.sweep_metrics_registry(sweeps).render())
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+def start_background_tasks():
+    """Starts the deal worker thread (APP_DEAL_WORKER) and the warm-up (APP_WARM_UP), once per process.
+
+    Nothing starts on import, so deal scoring processes and the debugger's reloader, which import
+    this module too, don't run workers of their own. `python app.py` calls it at startup; under a
+    WSGI server it runs on the first request unless the server calls it when a worker starts.
+    """
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    if RUN_DEAL_WORKER:
+        deal_worker.start_thread(REGIONS)
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        _ready.set()
+
+@app.before_request
+def ensure_background_tasks():
+    if not _started:
+        start_background_tasks()
 
 if __name__ == '__main__':
+    # The reloader runs the server in a child process (WERKZEUG_RUN_MAIN); the parent only watches files
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_tasks()
     app.run(debug=True)
\ No newline at end of file
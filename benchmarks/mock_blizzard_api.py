@@ -0,0 +1,354 @@
+"""Local stand-in for the Blizzard game data API, serving generated auction dumps.
+
+Serves the OAuth token, connected-realm index and details, per-realm auctions, commodities,
+item and item media endpoints. Point the scanner at it with BLIZZARD_API_BASE_URL and
+BLIZZARD_OAUTH_TOKEN_URL (see run_benchmarks.py), or run it on its own:
+
+    python benchmarks/mock_blizzard_api.py --port 8080 --realms 20 --auctions-per-realm 20000
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# --- Default dump shape ---
+REALMS = 20
+AUCTIONS_PER_REALM = 20000
+ITEMS = 2000
+ITEM_SKEW = 1.1  # Zipf exponent of item popularity: a few items make up most listings
+COMMODITY_ITEMS = 500
+COMMODITY_AUCTIONS = 100000
+BARGAIN_FRACTION = 0.03  # Listings priced far below the item's usual price, so there are deals to find
+CHURN_FRACTION = 0.1  # Share of a changed realm's auctions replaced in every new generation
+SEED = 42
+# ----------------------
+
+FIRST_REALM_ID = 1000
+FIRST_COMMODITY_ITEM_ID = 200000
+QUALITIES = ["POOR", "COMMON", "UNCOMMON", "RARE", "EPIC", "LEGENDARY"]
+TIME_LEFT = ["SHORT", "MEDIUM", "LONG", "VERY_LONG"]
+POPULATIONS = ["LOW", "MEDIUM", "HIGH", "FULL"]
+REALM_DETAILS_LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class MockDumps:
+    """Generates deterministic auction dumps and keeps the encoded bodies of the current generation.
+
+    Every realm dump has a Last-Modified header. Calling advance() starts a new generation in which
+    `changed_fraction` of the realms (and the commodities) churn part of their auctions and get a new
+    Last-Modified; the others keep answering If-Modified-Since with 304.
+    """
+
+    def __init__(self, realms=REALMS, auctions_per_realm=AUCTIONS_PER_REALM, items=ITEMS, item_skew=ITEM_SKEW,
+                 commodity_items=COMMODITY_ITEMS, commodity_auctions=COMMODITY_AUCTIONS, seed=SEED):
+        self.realm_ids = list(range(FIRST_REALM_ID, FIRST_REALM_ID + realms))
+        self.auctions_per_realm = auctions_per_realm
+        self.items = items
+        self.commodity_items = commodity_items
+        self.commodity_auctions = commodity_auctions
+        self.seed = seed
+        self.generation = 0
+        self.lock = threading.Lock()
+
+        rng = np.random.default_rng(seed)
+        popularity = 1.0 / np.arange(1, items + 1) ** item_skew
+        self.item_weights = popularity / popularity.sum()
+        self.item_ids = rng.permutation(np.arange(1, items + 1) * 7 + 10000)  # Sparse ids, like the real game
+        self.base_prices = np.rint(np.exp(rng.normal(np.log(2000 * 10000), 1.5, items)))  # Copper, median 2000g
+
+        self.realm_dumps = {realm_id: self.generate_realm(realm_id, 0) for realm_id in self.realm_ids}
+        self.commodities = self.generate_commodities(0)
+        self.realm_modified = {realm_id: 0 for realm_id in self.realm_ids}
+        self.commodities_modified = 0
+        self.bodies = {}
+        self.started = time.time()
+
+    def generate_realm(self, realm_id, generation):
+        rng = np.random.default_rng((self.seed, realm_id, generation))
+        count = self.auctions_per_realm
+        items = rng.choice(len(self.item_ids), size=count, p=self.item_weights)
+        realm_factor = rng.lognormal(0, 0.2)
+        prices = self.base_prices[items] * realm_factor * rng.lognormal(0, 0.3, count)
+        bargains = rng.random(count) < BARGAIN_FRACTION
+        prices[bargains] *= rng.uniform(0.05, 0.3, bargains.sum())
+        return {
+            "id": realm_id * 10_000_000 + generation * 1_000_000 + np.arange(count),
+            "item": self.item_ids[items],
+            "buyout": np.maximum(np.rint(prices / 100) * 100, 100).astype(np.int64),
+            "quantity": np.where(rng.random(count) < 0.8, 1, rng.integers(1, 21, count)),
+            "time_left": rng.integers(0, len(TIME_LEFT), count),
+        }
+
+    def churn_realm(self, realm_id, generation):
+        """Replaces CHURN_FRACTION of a realm's auctions with fresh ones, like a real hour of trading."""
+        current = self.realm_dumps[realm_id]
+        fresh = self.generate_realm(realm_id, generation)
+        rng = np.random.default_rng((self.seed, realm_id, generation, 1))
+        replaced = rng.random(len(current["id"])) < CHURN_FRACTION
+        return {name: np.where(replaced, fresh[name], values) for name, values in current.items()}
+
+    def generate_commodities(self, generation):
+        rng = np.random.default_rng((self.seed, 0, generation))
+        count = self.commodity_auctions
+        items = rng.integers(0, self.commodity_items, count)
+        base = np.exp(np.random.default_rng(self.seed).normal(np.log(50 * 10000), 1.0, self.commodity_items))
+        return {
+            "id": 900_000_000 + generation * 10_000_000 + np.arange(count),
+            "item": FIRST_COMMODITY_ITEM_ID + items,
+            "unit_price": np.maximum(np.rint(base[items] * rng.lognormal(0, 0.1, count) / 100) * 100, 1).astype(np.int64),
+            "quantity": rng.integers(1, 201, count),
+            "time_left": rng.integers(0, len(TIME_LEFT), count),
+        }
+
+    def advance(self, changed_fraction=0.25):
+        """Starts a new generation; returns the ids of the realms whose dump changed."""
+        with self.lock:
+            self.generation += 1
+            changed = self.realm_ids[:max(1, int(len(self.realm_ids) * changed_fraction))] if changed_fraction else []
+            for realm_id in changed:
+                self.realm_dumps[realm_id] = self.churn_realm(realm_id, self.generation)
+                self.realm_modified[realm_id] = self.generation
+                self.bodies.pop(realm_id, None)
+            if changed:
+                self.commodities = self.generate_commodities(self.generation)
+                self.commodities_modified = self.generation
+                self.bodies.pop("commodities", None)
+            return changed
+
+    def last_modified(self, generation):
+        # Each generation is stamped one hour after the previous one
+        return formatdate(self.started + generation * 3600, usegmt=True)
+
+    def total_auctions(self):
+        return len(self.realm_ids) * self.auctions_per_realm
+
+    def encode(self, key):
+        """Returns (json bytes, gzip bytes, Last-Modified, auction count) of a realm's dump or of the commodities."""
+        with self.lock:
+            if key not in self.bodies:
+                if key == "commodities":
+                    dump, generation = self.commodities, self.commodities_modified
+                    auctions = [
+                        {"id": int(i), "item": {"id": int(item)}, "quantity": int(quantity),
+                         "unit_price": int(price), "time_left": TIME_LEFT[left]}
+                        for i, item, price, quantity, left in zip(
+                            dump["id"], dump["item"], dump["unit_price"], dump["quantity"], dump["time_left"])
+                    ]
+                else:
+                    dump, generation = self.realm_dumps[key], self.realm_modified[key]
+                    auctions = [
+                        {"id": int(i), "item": {"id": int(item)}, "buyout": int(price),
+                         "quantity": int(quantity), "time_left": TIME_LEFT[left]}
+                        for i, item, price, quantity, left in zip(
+                            dump["id"], dump["item"], dump["buyout"], dump["quantity"], dump["time_left"])
+                    ]
+                body = json.dumps({"auctions": auctions}, separators=(",", ":")).encode()
+                self.bodies[key] = (body, gzip.compress(body, compresslevel=1), self.last_modified(generation), len(auctions))
+            return self.bodies[key]
+
+
+class MockBlizzardServer(ThreadingHTTPServer):
+    """HTTP server for MockDumps with configurable latency and 429 throttling.
+
+    `latency` seconds are added to every response. Every `throttle_every`-th request (0 disables it)
+    is answered with 429 and a Retry-After of 0. Request counts per endpoint are kept in `stats`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, dumps, latency=0.0, throttle_every=0):
+        super().__init__(address, MockBlizzardHandler)
+        self.dumps = dumps
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.request_count = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key, amount=1, request=True):
+        """Adds to a counter in `stats`. For requests, returns True if this one should be throttled."""
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+            if not request:
+                return False
+            self.request_count += 1
+            return bool(self.throttle_every) and self.request_count % self.throttle_every == 0
+
+    def snapshot_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+
+class MockBlizzardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so the client's connection pool is exercised
+
+    ROUTES = [
+        (re.compile(r"^/data/wow/connected-realm/index$"), "realm_index"),
+        (re.compile(r"^/data/wow/connected-realm/(\d+)/auctions$"), "realm_auctions"),
+        (re.compile(r"^/data/wow/connected-realm/(\d+)$"), "realm_details"),
+        (re.compile(r"^/data/wow/auctions/commodities$"), "commodities"),
+        (re.compile(r"^/data/wow/item/(\d+)$"), "item"),
+        (re.compile(r"^/data/wow/media/item/(\d+)$"), "item_media"),
+    ]
+
+    def log_message(self, format, *args):
+        pass  # Far too chatty for a benchmark
+
+    def send_json(self, status, payload=None, body=None, headers=None):
+        if body is None:
+            body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.server.count("token")
+        if self.path.split("?")[0] != "/token":
+            self.send_json(404, {"detail": "Not Found"})
+            return
+        self.send_json(200, {"access_token": "mock-token", "token_type": "bearer", "expires_in": 86399})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        for pattern, endpoint in self.ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            self.server.count("not_found")
+            self.send_json(404, {"detail": "Not Found"})
+            return
+
+        throttled = self.server.count(endpoint)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if throttled:
+            self.send_json(429, {"detail": "Too Many Requests"}, headers={"Retry-After": "0"})
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json(401, {"detail": "Unauthorized"})
+            return
+        getattr(self, endpoint)(*match.groups())
+
+    def realm_index(self):
+        base = self.server.base_url
+        self.send_json(200, {"connected_realms": [
+            {"href": f"{base}/data/wow/connected-realm/{realm_id}?namespace=dynamic-eu"}
+            for realm_id in self.server.dumps.realm_ids
+        ]})
+
+    def realm_details(self, realm_id):
+        realm_id = int(realm_id)
+        if realm_id not in self.server.dumps.realm_ids:
+            self.send_json(404, {"detail": "Not Found"})
+            return
+        # Realm groupings never change in the mock, so every details response has the same Last-Modified
+        if self.headers.get("If-Modified-Since") == REALM_DETAILS_LAST_MODIFIED:
+            self.server.count("realm_details_not_modified", request=False)
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.send_header("Last-Modified", REALM_DETAILS_LAST_MODIFIED)
+            self.end_headers()
+            return
+        self.send_json(200, {
+            "id": realm_id,
+            "population": {"type": POPULATIONS[realm_id % len(POPULATIONS)], "name": {"en_US": "Mock"}},
+            "realms": [{
+                "id": realm_id,
+                "name": {"en_US": f"Mock Realm {realm_id}"},
+                "region": {"id": 3, "name": {"en_US": "Europe"}},
+                "locale": "enGB",
+            }],
+        }, headers={"Last-Modified": REALM_DETAILS_LAST_MODIFIED})
+
+    def send_dump(self, key, counter):
+        body, gzipped, last_modified, auction_count = self.server.dumps.encode(key)
+        if self.headers.get("If-Modified-Since") == last_modified:
+            self.server.count("not_modified", request=False)
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return
+        self.server.count(counter, auction_count, request=False)
+        headers = {"Last-Modified": last_modified}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzipped
+            headers["Content-Encoding"] = "gzip"
+        self.send_json(200, body=body, headers=headers)
+
+    def realm_auctions(self, realm_id):
+        realm_id = int(realm_id)
+        if realm_id not in self.server.dumps.realm_ids:
+            self.send_json(404, {"detail": "Not Found"})
+            return
+        self.send_dump(realm_id, "auctions_served")
+
+    def commodities(self):
+        self.send_dump("commodities", "commodity_auctions_served")
+
+    def item(self, item_id):
+        item_id = int(item_id)
+        self.send_json(200, {
+            "id": item_id,
+            "name": f"Mock Item {item_id}",
+            "quality": {"type": QUALITIES[item_id % len(QUALITIES)], "name": "Mock"},
+        })
+
+    def item_media(self, item_id):
+        self.send_json(200, {"assets": [
+            {"key": "icon", "value": f"https://render.worldofwarcraft.com/eu/icons/56/inv_mock_{item_id}.jpg"}
+        ]})
+
+
+def start_server(dumps, host="127.0.0.1", port=0, latency=0.0, throttle_every=0):
+    """Starts a mock server on a background thread. Port 0 picks a free port, see `server.base_url`."""
+    server = MockBlizzardServer((host, port), dumps, latency, throttle_every)
+    threading.Thread(target=server.serve_forever, name="mock-blizzard-api", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated auction dumps in place of the Blizzard API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--realms", type=int, default=REALMS)
+    parser.add_argument("--auctions-per-realm", type=int, default=AUCTIONS_PER_REALM)
+    parser.add_argument("--items", type=int, default=ITEMS)
+    parser.add_argument("--item-skew", type=float, default=ITEM_SKEW)
+    parser.add_argument("--commodity-auctions", type=int, default=COMMODITY_AUCTIONS)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429")
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    dumps = MockDumps(args.realms, args.auctions_per_realm, args.items, args.item_skew,
+                      commodity_auctions=args.commodity_auctions, seed=args.seed)
+    server = MockBlizzardServer((args.host, args.port), dumps, args.latency_ms / 1000, args.throttle_every)
+    print(f"Mock Blizzard API listening on {server.base_url}")
+    print(f"  BLIZZARD_API_BASE_URL={server.base_url}")
+    print(f"  BLIZZARD_OAUTH_TOKEN_URL={server.base_url}/token")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server.")
+
+
+if __name__ == "__main__":
+    main()
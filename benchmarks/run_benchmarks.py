@@ -0,0 +1,318 @@
+"""Offline benchmarks for the scanner, the deal finder and the price lookup.
+
+Starts the mock Blizzard API on a free local port, runs real scanner sweeps against it in a scratch
+directory and then times the read paths on the database they produced. No credentials needed:
+
+    python benchmarks/run_benchmarks.py --realms 20 --auctions-per-realm 20000
+
+Results are written as JSON (see --output) so runs of different versions can be compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import mock_blizzard_api
+import setup_database
+
+# --- Configuration ---
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+RESULTS_FORMAT_VERSION = 6  # Bumped whenever the shape of the results changes
+DEAL_PAGES = 10  # get_deals_page is timed for pages 1..DEAL_PAGES
+REPEAT = 5  # Timings of the read paths are repeated this many times
+PRICE_LOOKUP_ITEMS = 25
+CHANGED_FRACTION = 0.25  # Share of realms whose dump changes before the incremental sweep
+# ----------------------
+
+
+def summarize(seconds):
+    """Summary of a list of timings, in milliseconds."""
+    ordered = sorted(seconds)
+    if not ordered:
+        return {"count": 0}
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "max_ms": ordered[-1] * 1000,
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def script_env(server, real_rate_limit):
+    env = dict(os.environ)
+    env.update({
+        "BLIZZARD_API_BASE_URL": server.base_url,
+        "BLIZZARD_OAUTH_TOKEN_URL": f"{server.base_url}/token",
+        "CLIENT_ID": "benchmark",
+        "SECRET_KEY": "benchmark",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if not real_rate_limit:
+        # Measure our own throughput, not Blizzard's quota
+        env["BLIZZARD_REQUESTS_PER_SECOND"] = "1000000"
+        env["BLIZZARD_REQUESTS_PER_HOUR"] = "1000000000"
+    return env
+
+
+def run_script(name, args, workdir, env, log_name):
+    """Runs one of the repo's scripts in `workdir`. Returns (wall seconds, peak RSS in MiB, exit status)."""
+    with open(os.path.join(workdir, log_name), "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, name), *args],
+                                   cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return wall, peak_rss, process.returncode
+
+
+def count_rows(db_file, table):
+    with contextlib.closing(sqlite3.connect(db_file)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def benchmark_sweep(label, server, workdir, env, scanner_args=()):
+    """Times one scanner run. Rows/sec counts the realm auctions the mock actually sent."""
+    before = server.snapshot_stats()
+    print(f"Sweep '{label}'...")
+    wall, peak_rss, status = run_script("scanner.py", scanner_args, workdir, env, f"scanner-{label}.log")
+    after = server.snapshot_stats()
+    requests_made = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    auctions = requests_made.get("auctions_served", 0)
+    result = {
+        "wall_seconds": wall,
+        "auctions_downloaded": auctions,
+        "commodity_auctions_downloaded": requests_made.get("commodity_auctions_served", 0),
+        "rows_per_second": auctions / wall if wall else None,
+        "peak_rss_mib": peak_rss,
+        "auction_rows_after": count_rows(os.path.join(workdir, setup_database.DB_FILE_TEMPLATE.format(
+            region=setup_database.DEFAULT_REGION)), "auctions"),
+        "requests": requests_made,
+        "exit_status": status,
+    }
+    print(f"  {wall:.2f}s, {result['rows_per_second'] or 0:,.0f} rows/s, peak RSS {peak_rss:.0f} MiB")
+    if status != 0:
+        print(f"  Scanner exited with {status}, see scanner-{label}.log in {workdir}")
+    return result
+
+
+def benchmark_replay(workdir, env, sweeps):
+    """Times scanner.py --replay of the archived sweeps into an empty directory (without deal reports)."""
+    replay_dir = os.path.join(workdir, "replay")
+    os.makedirs(replay_dir, exist_ok=True)
+    print("Replaying the archived sweeps...")
+    wall, peak_rss, status = run_script("scanner.py", ["--replay"], replay_dir, env, "scanner-replay.log")
+    auctions = sum(sweep["auctions_downloaded"] for sweep in sweeps.values())
+    result = {
+        "wall_seconds": wall,
+        "auctions_replayed": auctions,
+        "rows_per_second": auctions / wall if wall else None,
+        "peak_rss_mib": peak_rss,
+        "archive_bytes": sum(os.path.getsize(os.path.join(root, name))
+                             for root, _, names in os.walk(env["SCANNER_ARCHIVE_DIR"]) for name in names),
+        "exit_status": status,
+    }
+    print(f"  {wall:.2f}s, {result['rows_per_second'] or 0:,.0f} rows/s, peak RSS {peak_rss:.0f} MiB")
+    if status != 0:
+        print(f"  Replay exited with {status}, see scanner-replay.log in {replay_dir}")
+    return result
+
+
+def benchmark_deals(pages, repeat, scoring_workers=1):
+    """Times the deal worker's recompute and get_deals_page, in-process against the database in the current directory."""
+    os.environ["APP_DEAL_WORKER"] = "0"  # The recompute is timed here instead
+    os.environ["APP_WARM_UP"] = "0"  # And so is the warm-up
+    import app
+    import deal_engine
+    import deal_worker
+
+    deal_engine.SCORING_WORKERS = scoring_workers
+    region = setup_database.DEFAULT_REGION
+    with contextlib.redirect_stdout(io.StringIO()):
+        recomputes = [timed(deal_worker.refresh_region, region, True)[0] for _ in range(repeat)]
+        warm_up_seconds = timed(app.warm_up)[0]
+    default_filters = app.parse_deal_filters({})
+
+    def walk(filters, sort):
+        """Follows the cursors page by page; returns per-page timing summaries and the total."""
+        timings = {}
+        cursor = None
+        response = {"total": 0}
+        for page in range(1, pages + 1):
+            samples = []
+            for _ in range(repeat):
+                elapsed, response = timed(app.get_deals_page, filters, sort, cursor, app.PAGE_SIZE)
+                samples.append(elapsed)
+            timings[str(page)] = summarize(samples)
+            cursor = response["nextCursor"]
+            if not cursor:
+                break
+        return {"total": response["total"], "pages": timings}
+
+    def http_deals():
+        """Size of a full and a gzipped /api/deals response, and the latency of a conditional request."""
+        client = app.app.test_client()
+        full = client.get("/api/deals")
+        compressed = client.get("/api/deals", headers={"Accept-Encoding": "gzip"})
+        headers = {"If-None-Match": full.headers["ETag"]}
+        not_modified = [timed(client.get, "/api/deals", headers=headers)[0] for _ in range(repeat)]
+        return {"body_bytes": len(full.data), "gzip_bytes": len(compressed.data), "not_modified": summarize(not_modified)}
+
+    with contextlib.closing(setup_database.connect(setup_database.db_file_for_region(region), read_only=True)) as conn:
+        scored_items = app.get_deal_freshness(conn)["itemCount"]
+    return {
+        "scored_items": scored_items,
+        "deal_worker_recompute": summarize(recomputes),
+        "app_warm_up": summarize([warm_up_seconds]),
+        "get_deals_page": {sort: walk(default_filters, sort) for sort in app.SORT_COLUMNS},
+        "get_deals_page_quality": walk({**default_filters, "quality": "EPIC"}, "ratio"),
+        "api_deals_http": http_deals(),
+        "get_deals_page_loose_thresholds": walk({**default_filters, "min_ratio": 1.5, "min_gold": 10, "min_realms": 2}, "ratio"),
+    }
+
+
+def benchmark_price_lookups(items, repeat, seed):
+    """Times query_prices.analyze_item_prices for the busiest items and a random sample of the rest."""
+    import query_prices
+
+    with contextlib.closing(sqlite3.connect(query_prices.DB_FILE)) as conn:
+        busiest = [row[0] for row in conn.execute(
+            "SELECT item_id FROM auctions GROUP BY item_id ORDER BY COUNT(*) DESC LIMIT 5")]
+        others = [row[0] for row in conn.execute("SELECT DISTINCT item_id FROM auctions")]
+        commodities = [row[0] for row in conn.execute("SELECT DISTINCT item_id FROM commodity_price_levels LIMIT 5")]
+    sample = random.Random(seed).sample(others, min(items, len(others)))
+
+    def lookups(item_ids):
+        timings = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                for item_id in item_ids:
+                    timings.append(timed(query_prices.analyze_item_prices, item_id)[0])
+        return summarize(timings)
+
+    return {
+        "busiest_items": lookups(busiest),
+        "random_items": lookups(sample),
+        "commodity_items": lookups(commodities),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite against a mock Blizzard API.")
+    parser.add_argument("--realms", type=int, default=mock_blizzard_api.REALMS)
+    parser.add_argument("--auctions-per-realm", type=int, default=mock_blizzard_api.AUCTIONS_PER_REALM)
+    parser.add_argument("--items", type=int, default=mock_blizzard_api.ITEMS)
+    parser.add_argument("--item-skew", type=float, default=mock_blizzard_api.ITEM_SKEW)
+    parser.add_argument("--commodity-auctions", type=int, default=mock_blizzard_api.COMMODITY_AUCTIONS)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every mock API response")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth API request with 429")
+    parser.add_argument("--changed-fraction", type=float, default=CHANGED_FRACTION)
+    parser.add_argument("--pages", type=int, default=DEAL_PAGES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--price-lookups", type=int, default=PRICE_LOOKUP_ITEMS)
+    parser.add_argument("--bulk-load", action="store_true", help="Run the first sweep with scanner.py --bulk-load")
+    parser.add_argument("--scoring-workers", type=int, default=1, help="Processes the deal worker scores items in")
+    parser.add_argument("--replay", action="store_true", help="Archive the sweeps' dumps and time replaying them")
+    parser.add_argument("--real-rate-limit", action="store_true", help="Keep the client's production request quota")
+    parser.add_argument("--seed", type=int, default=mock_blizzard_api.SEED)
+    parser.add_argument("--workdir", help="Keep the database and scanner logs here instead of a temp directory")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    print("Generating auction dumps...")
+    dumps = mock_blizzard_api.MockDumps(args.realms, args.auctions_per_realm, args.items, args.item_skew,
+                                        commodity_auctions=args.commodity_auctions, seed=args.seed)
+    server = mock_blizzard_api.start_server(dumps, latency=args.latency_ms / 1000, throttle_every=args.throttle_every)
+    print(f"Mock Blizzard API listening on {server.base_url}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="wow-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    env = script_env(server, args.real_rate_limit)
+    if args.replay:
+        env["SCANNER_ARCHIVE"] = "1"
+        env["SCANNER_ARCHIVE_DIR"] = os.path.join(workdir, "raw_archive")
+
+    results = {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "started_at": started.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+    }
+    try:
+        realms_wall, _, _ = run_script("update_realms_cache.py", [], workdir, env, "update_realms_cache.log")
+        results["update_realms_cache_seconds"] = realms_wall
+
+        sweeps = {"full": benchmark_sweep("full", server, workdir, env, ["--bulk-load"] if args.bulk_load else [])}
+        sweeps["unchanged"] = benchmark_sweep("unchanged", server, workdir, env)
+        changed = dumps.advance(args.changed_fraction)
+        sweeps["incremental"] = benchmark_sweep("incremental", server, workdir, env)
+        sweeps["incremental"]["changed_realms"] = len(changed)
+        results["sweeps"] = sweeps
+        if args.replay:
+            results["replay"] = benchmark_replay(workdir, env, sweeps)
+
+        # The read paths use relative database paths, like the app does when run from the repo
+        original_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            print("Timing the deal worker and get_deals_page...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                results["deals"] = benchmark_deals(args.pages, args.repeat, args.scoring_workers)
+            print("Timing analyze_item_prices...")
+            results["price_lookups"] = benchmark_price_lookups(args.price_lookups, args.repeat, args.seed)
+        finally:
+            os.chdir(original_cwd)
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    output = args.output or os.path.join(RESULTS_DIR, f"{started:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+from dotenv import load_dotenv
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+# --- Configuration ---
+client_id = os.getenv("CLIENT_ID")
+client_secret = os.getenv("SECRET_KEY")
+POOL_SIZE = 32  # Keep-alive connections kept open to the API host
+REQUESTS_PER_SECOND = int(os.getenv("BLIZZARD_REQUESTS_PER_SECOND", "90"))  # Blizzard allows 100/s, keep a little headroom
+REQUESTS_PER_HOUR = int(os.getenv("BLIZZARD_REQUESTS_PER_HOUR", "36000"))
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0  # Doubled on every retry, plus jitter
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+TOKEN_REFRESH_MARGIN_SECONDS = 300  # Refresh the OAuth token this long before it expires
+REQUEST_TIMEOUT = (10, 120)  # (connect, read) seconds
+# Point the client at another server, e.g. the mock API in benchmarks/
+API_BASE_URL = os.getenv("BLIZZARD_API_BASE_URL")
+OAUTH_TOKEN_URL = os.getenv("BLIZZARD_OAUTH_TOKEN_URL")
+# ----------------------
+
+
+class RateLimiter:
+    """Thread-safe limiter enforcing both a per-second and a per-hour request quota."""
+
+    def __init__(self, per_second, per_hour):
+        self.per_second = per_second
+        self.per_hour = per_hour
+        self.lock = threading.Lock()
+        self.tokens = float(per_second)
+        self.last_refill = time.monotonic()
+        self.hour_start = self.last_refill
+        self.hour_count = 0
+        self.wait_seconds = 0.0  # Total time callers spent blocked, i.e. how hard we lean on the quota
+
+    def headroom(self):
+        """Returns the requests left in the current hour and the requests that may be sent right now."""
+        with self.lock:
+            now = time.monotonic()
+            burst = min(self.per_second, self.tokens + (now - self.last_refill) * self.per_second)
+            if now - self.hour_start >= 3600:
+                return self.per_hour, int(burst)
+            return self.per_hour - self.hour_count, int(burst)
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now - self.hour_start >= 3600:
+                    self.hour_start = now
+                    self.hour_count = 0
+                self.tokens = min(self.per_second, self.tokens + (now - self.last_refill) * self.per_second)
+                self.last_refill = now
+
+                if self.hour_count >= self.per_hour:
+                    wait = 3600 - (now - self.hour_start)
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    self.hour_count += 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.per_second
+                self.wait_seconds += wait
+            time.sleep(wait)
+
+
+class BlizzardClient:
+    """Shared client for the Blizzard game data APIs of one region.
+
+    All requests go through one keep-alive connection pool with compressed responses, a rate limiter
+    and retries with backoff. The OAuth token is cached and refreshed shortly before it expires (or
+    when the API rejects it), so long sweeps keep running past token expiry.
+
+    The request quota belongs to the API credentials, not to a region: clients of regions scanned at
+    the same time should be given one shared `rate_limiter`.
+    """
+
+    def __init__(self, region, pool_size=POOL_SIZE, rate_limiter=None):
+        self.region = region
+        self.api_base = API_BASE_URL or f'https://{region}.api.blizzard.com'
+        self.token_url = OAUTH_TOKEN_URL or f'https://{region}.oauth.battle.net/token'
+        self.dynamic_namespace = f'dynamic-{region}'
+        self.static_namespace = f'static-{region}'  # For item data
+        self.rate_limiter = rate_limiter or RateLimiter(REQUESTS_PER_SECOND, REQUESTS_PER_HOUR)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        self.token_lock = threading.Lock()
+        self.access_token = None
+        self.token_expires_at = 0
+
+        # Request counters, see stats()
+        self.stats_lock = threading.Lock()
+        self.response_counts = {}
+        self.retries = 0
+        self.connection_errors = 0
+        self.token_refreshes = 0
+
+    def count(self, counter):
+        with self.stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def count_response(self, status):
+        with self.stats_lock:
+            self.response_counts[status] = self.response_counts.get(status, 0) + 1
+
+    def stats(self):
+        """Returns the request counters and rate-limit headroom of this client so far."""
+        hourly_remaining, burst_available = self.rate_limiter.headroom()
+        with self.stats_lock:
+            return {
+                "http": {
+                    "responses": {str(status): count for status, count in sorted(self.response_counts.items())},
+                    "retries": self.retries,
+                    "connection_errors": self.connection_errors,
+                    "token_refreshes": self.token_refreshes,
+                },
+                "rate_limit": {
+                    "hourly_remaining": hourly_remaining,
+                    "burst_available": burst_available,
+                    "wait_seconds": round(self.rate_limiter.wait_seconds, 3),
+                },
+            }
+
+    def get_token(self):
+        """Returns a valid access token, fetching a new one if needed. Returns None on failure."""
+        with self.token_lock:
+            if self.access_token and time.time() < self.token_expires_at:
+                return self.access_token
+            try:
+                response = self.session.post(
+                    self.token_url, data={'grant_type': 'client_credentials'},
+                    auth=(client_id, client_secret), timeout=REQUEST_TIMEOUT
+                )
+                response.raise_for_status()
+                token_data = response.json()
+            except requests.exceptions.RequestException as err:
+                print(f"Error obtaining token: {err}")
+                return None
+            self.count("token_refreshes")
+            self.access_token = token_data['access_token']
+            lifetime = token_data.get('expires_in', 86400)
+            self.token_expires_at = time.time() + max(lifetime - TOKEN_REFRESH_MARGIN_SECONDS, lifetime / 2)
+            return self.access_token
+
+    def invalidate_token(self, token):
+        """Drops a token the API rejected, unless another thread already replaced it."""
+        with self.token_lock:
+            if self.access_token == token:
+                self.access_token = None
+
+    def url(self, path):
+        return f'{self.api_base}{path}'
+
+    def get(self, url, namespace, params=None, headers=None, stream=False):
+        """Authenticated GET that honours the rate limiter and retries transient failures with backoff.
+
+        `url` may be a full URL (e.g. an href from another response) or a path on the region's API host.
+        """
+        if url.startswith('/'):
+            url = self.url(url)
+        request_headers = {'Battlenet-Namespace': namespace}
+        if headers:
+            request_headers.update(headers)
+
+        token_refreshed = False
+        attempt = 0
+        while True:
+            token = self.get_token()
+            if token is None:
+                raise requests.exceptions.RequestException("No access token available")
+            request_headers['Authorization'] = f'Bearer {token}'
+
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, headers=request_headers, params=params,
+                                            timeout=REQUEST_TIMEOUT, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                self.count("connection_errors")
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, 1)
+                print(f"Request to {url} failed ({err}), retrying in {delay:.1f}s...")
+                self.count("retries")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.count_response(response.status_code)
+            # The token may have been revoked or expired early; get a new one once
+            if response.status_code == 401 and not token_refreshed:
+                response.close()
+                self.invalidate_token(token)
+                token_refreshed = True
+                continue
+
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+            else:
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, 1)
+            print(f"Got status {response.status_code} from {url}, retrying in {delay:.1f}s...")
+            self.count("retries")
+            response.close()
+            time.sleep(delay)
+            attempt += 1
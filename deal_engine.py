@@ -0,0 +1,475 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+# --- Default deal criteria (callers usually pass their own) ---
+MIN_PRICE_RATIO = 3.0
+MIN_GOLD_PRICE = 1000
+MAX_REALISTIC_GOLD_PRICE = 3000000
+MIN_REALM_COUNT = 5
+# ----------------------
+
+# --- Parallel scoring ---
+# With DEAL_SCORING_WORKERS above 1, score_items splits the items into that many shards and scores
+# them in a process pool. Inputs with fewer rows than PARALLEL_MIN_ROWS are scored serially, since
+# starting the shards would cost more than it saves.
+SCORING_WORKERS = int(os.getenv("DEAL_SCORING_WORKERS", "1"))
+PARALLEL_MIN_ROWS = int(os.getenv("DEAL_SCORING_MIN_ROWS", "200000"))
+# ----------------------
+
+COPPER_PER_GOLD = 10000
+
+# Order book arrays are stored as raw little-endian int64 BLOBs
+ORDER_BOOK_DTYPE = np.dtype("<i8")
+
+
+def load_realm_prices(conn):
+    """Loads every realm's cheapest price per unit as three aligned int64 arrays: item ids, realm ids and prices.
+
+    Auction buyouts are for the whole stack, so realms are compared by unit price: a 200-stack and a
+    single unit of the same item are priced alike.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT item_id, connected_realm_id, min_unit_price
+        FROM realm_min_prices
+        WHERE min_unit_price > 0
+        ORDER BY item_id, connected_realm_id
+    """)
+    rows = cursor.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), empty.copy()
+    data = np.array(rows, dtype=np.int64)
+    return data[:, 0].copy(), data[:, 1].copy(), data[:, 2].copy()
+
+
+def segment_percentile(values, starts, lengths, q):
+    """np.percentile(segment, q * 100) for every segment values[start:start + length], which must be sorted.
+
+    Reproduces numpy's default 'linear' method bit for bit, including its two-sided lerp.
+    """
+    virtual = (lengths - 1) * q
+    previous = np.floor(virtual).astype(np.int64)
+    following = np.minimum(previous + 1, lengths - 1)
+    gamma = virtual - previous
+    a = values[starts + previous]
+    b = values[starts + following]
+    diff = b - a
+    result = a + diff * gamma
+    upper = gamma >= 0.5
+    result[upper] = (b - diff * (1 - gamma))[upper]
+    return result
+
+
+def segment_median(values, starts, lengths):
+    """np.median of every sorted segment values[start:start + length]."""
+    middle = starts + lengths // 2
+    upper = values[middle].astype(np.float64)
+    lower = values[np.maximum(middle - 1, starts)].astype(np.float64)
+    return np.where(lengths % 2 == 1, upper, (lower + upper) / 2)
+
+
+def summarize_prices(items, prices, quantities):
+    """Per-item price distribution of listings sorted by item id, then price.
+
+    Returns a dict of aligned arrays with one entry per item: item_id, listings, quantity (units
+    listed), min, p25, median and p75 of the listing prices, total_buyout (for quantity-weighted
+    averages) and min_unit_price (cheapest price per unit, rounded down like SQLite's integer division).
+    There must be at least one listing.
+    """
+    items = np.asarray(items, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.int64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    is_start = np.empty(len(items), dtype=bool)
+    is_start[0] = True
+    np.not_equal(items[1:], items[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(items)))
+    return {
+        "item_id": items[starts],
+        "listings": counts,
+        "quantity": np.add.reduceat(quantities, starts),
+        "min": prices[starts],
+        "p25": segment_percentile(prices, starts, counts, 0.25),
+        "median": segment_median(prices, starts, counts),
+        "p75": segment_percentile(prices, starts, counts, 0.75),
+        "total_buyout": np.add.reduceat(prices, starts),
+        "min_unit_price": np.minimum.reduceat(prices // quantities, starts),
+    }
+
+
+class OrderBook:
+    """Per-unit price ladder of one item on one realm, or on the region's commodity market.
+
+    Listings (or price levels) are sorted by unit price; cumulative_quantity[i] and cumulative_cost[i]
+    are the units and copper of listings 0..i, so every query is a binary search. Realm auctions can
+    only be bought whole; commodities are `divisible` and can be bought by the unit.
+    """
+
+    def __init__(self, unit_prices, cumulative_quantity, cumulative_cost, divisible=False):
+        self.unit_prices = unit_prices
+        self.cumulative_quantity = cumulative_quantity
+        self.cumulative_cost = cumulative_cost
+        self.divisible = divisible
+
+    @classmethod
+    def from_blobs(cls, unit_prices, cumulative_quantity, cumulative_cost):
+        return cls(*(np.frombuffer(blob, dtype=ORDER_BOOK_DTYPE)
+                     for blob in (unit_prices, cumulative_quantity, cumulative_cost)))
+
+    @classmethod
+    def from_levels(cls, unit_prices, quantities, divisible=True):
+        """Builds a ladder from (unit price, quantity) levels already sorted by unit price."""
+        unit_prices = np.asarray(unit_prices, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        return cls(unit_prices, np.cumsum(quantities), np.cumsum(unit_prices * quantities), divisible)
+
+    @property
+    def units(self):
+        """Units listed in total."""
+        return int(self.cumulative_quantity[-1]) if len(self.cumulative_quantity) else 0
+
+    def cost_to_buy(self, units):
+        """Cheapest way to buy at least `units` units: returns (copper, units bought), or None if too few are listed.
+
+        Divisible markets buy exactly `units` from the cheapest levels up. Whole listings may leave
+        more units than asked for, so walking up the ladder can overpay (a 200-stack at 1c/unit for a
+        single unit when one is listed at 5c); their cheapest combination is found by a knapsack
+        over 0..`units` units instead, skipping listings that cost more than the walk up the ladder.
+        """
+        if units <= 0:
+            return 0, 0
+        if units > self.units:
+            return None
+        last = int(np.searchsorted(self.cumulative_quantity, units, side='left'))
+        if not self.divisible:
+            quantities = np.diff(self.cumulative_quantity, prepend=0)
+            prices = np.diff(self.cumulative_cost, prepend=0)
+            ladder_cost = int(self.cumulative_cost[last])
+            # cost[u] and bought[u]: the cheapest listings seen so far that hold at least u units
+            cost = np.full(units + 1, ladder_cost + 1, dtype=np.int64)
+            cost[0] = 0
+            bought = np.zeros(units + 1, dtype=np.int64)
+            wanted = np.arange(units + 1)
+            for index in np.flatnonzero(prices <= ladder_cost).tolist():
+                rest = np.maximum(wanted - int(quantities[index]), 0)
+                taken = cost[rest] + int(prices[index])
+                better = taken < cost
+                bought = np.where(better, bought[rest] + int(quantities[index]), bought)
+                cost = np.where(better, taken, cost)
+            return int(cost[units]), int(bought[units])
+        bought = int(self.cumulative_quantity[last - 1]) if last else 0
+        cost = int(self.cumulative_cost[last - 1]) if last else 0
+        return cost + (units - bought) * int(self.unit_prices[last]), units
+
+    def cost_below(self, unit_price):
+        """Units listed strictly below `unit_price` per unit, and what buying all of them costs."""
+        count = int(np.searchsorted(self.unit_prices, unit_price, side='left'))
+        if not count:
+            return 0, 0
+        return int(self.cumulative_quantity[count - 1]), int(self.cumulative_cost[count - 1])
+
+    def units_below(self, unit_price):
+        """Units listed strictly below `unit_price` per unit."""
+        return self.cost_below(unit_price)[0]
+
+
+def build_order_books(items, prices, quantities):
+    """Per-unit price ladders of listings sorted by item id (any order within an item).
+
+    Returns a dict of aligned arrays with one entry per item (item_id, listings, start) and the
+    flat ladder arrays unit_price, cumulative_quantity and cumulative_cost: the ladder of item i is
+    [start[i]:start[i] + listings[i]], sorted by unit price (rounded down, like min_unit_price), with
+    sums restarting at every item. There must be at least one listing.
+    """
+    items = np.asarray(items, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.int64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    unit_prices = prices // quantities
+    order = np.lexsort((unit_prices, items))
+    items, prices, quantities, unit_prices = items[order], prices[order], quantities[order], unit_prices[order]
+
+    is_start = np.empty(len(items), dtype=bool)
+    is_start[0] = True
+    np.not_equal(items[1:], items[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(items)))
+    group = np.repeat(np.arange(len(counts)), counts)
+
+    def segment_cumsum(values):
+        total = np.cumsum(values)
+        return total - np.append(0, total[starts[1:] - 1])[group]
+
+    return {
+        "item_id": items[starts],
+        "listings": counts,
+        "start": starts,
+        "unit_price": unit_prices,
+        "cumulative_quantity": segment_cumsum(quantities),
+        "cumulative_cost": segment_cumsum(prices),
+    }
+
+
+def load_order_book(conn, item_id, realm_id):
+    """Returns the OrderBook of an item on a realm, or None if it isn't listed there."""
+    row = conn.execute("""
+        SELECT unit_prices, cumulative_quantity, cumulative_cost FROM order_books
+        WHERE item_id = ? AND connected_realm_id = ?
+    """, (item_id, realm_id)).fetchone()
+    return OrderBook.from_blobs(*row) if row else None
+
+
+def load_commodity_order_book(conn, item_id):
+    """Returns the OrderBook of an item on the region's commodity market, or None if it isn't listed."""
+    rows = conn.execute(
+        "SELECT unit_price, quantity FROM commodity_price_levels WHERE item_id = ? ORDER BY unit_price", (item_id,)
+    ).fetchall()
+    if not rows:
+        return None
+    unit_prices, quantities = zip(*rows)
+    return OrderBook.from_levels(unit_prices, quantities)
+
+
+# Integer columns of score_items; "ratio" is the only float one
+SCORE_COLUMNS = ("item_id", "realm_count", "kept_count", "min_price", "min_realm", "max_price", "max_realm", "first_seen")
+
+
+def score_items(item_ids, realm_ids, prices, workers=None):
+    """Runs the outlier filters of find_deals on every item, without applying any deal thresholds.
+
+    Returns a dict of aligned arrays with one entry per item, sorted by item id: item_id, realm_count
+    (realms listing it), kept_count (realms left after the IQR and MAD filters), min_price, min_realm,
+    max_price and max_realm of the kept realms, their ratio, and first_seen (the position of the
+    item's first row in the input, which breaks ties in the deal ranking). None of these depend on
+    the thresholds, so the result can be filtered with any of them afterwards; see find_deals.
+    With `workers` (default SCORING_WORKERS) above 1, large inputs go to score_items_parallel.
+    """
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    realm_ids = np.asarray(realm_ids, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.int64)
+    workers = SCORING_WORKERS if workers is None else workers
+    if workers > 1 and len(item_ids) >= PARALLEL_MIN_ROWS:
+        return score_items_parallel(item_ids, realm_ids, prices, workers)
+    if len(item_ids) == 0:
+        scores = {name: np.empty(0, dtype=np.int64) for name in SCORE_COLUMNS}
+        scores["ratio"] = np.empty(0, dtype=np.float64)
+        return scores
+
+    # Sort by item, then price; equal prices keep their input order, like a stable sort per item would.
+    position = np.arange(len(item_ids))
+    order = np.lexsort((position, prices, item_ids))
+    items = item_ids[order]
+    realms = realm_ids[order]
+    values = prices[order]
+
+    is_start = np.empty(len(items), dtype=bool)
+    is_start[0] = True
+    np.not_equal(items[1:], items[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(items)))
+    first_seen = np.minimum.reduceat(order, starts)
+    group = np.repeat(np.arange(len(counts)), counts)
+    offset_in_group = np.arange(len(items)) - starts[group]
+
+    # IQR filter. Segments are sorted, so the survivors of every item are a prefix of its segment.
+    q1 = segment_percentile(values, starts, counts, 0.25)
+    q3 = segment_percentile(values, starts, counts, 0.75)
+    outlier_threshold = q3 + 1.5 * (q3 - q1)
+    iqr_kept = np.add.reduceat((values <= outlier_threshold[group]).astype(np.int64), starts)
+
+    # Median / MAD filter over each item's IQR survivors.
+    median = segment_median(values, starts, iqr_kept)
+    in_prefix = offset_in_group < iqr_kept[group]
+    deviation = np.abs(values.astype(np.float64) - median[group])
+    prefix_group = group[in_prefix]
+    prefix_deviation = deviation[in_prefix]
+    prefix_deviation = prefix_deviation[np.lexsort((prefix_deviation, prefix_group))]
+    prefix_starts = np.concatenate(([0], np.cumsum(iqr_kept)[:-1]))
+    mad = segment_median(prefix_deviation, prefix_starts, iqr_kept)
+    mad[mad == 0] = 1
+    kept = in_prefix & (deviation <= (5 * mad)[group])
+
+    # Survivors are contiguous within each segment; their ends are the cheapest and dearest realm.
+    kept_count = np.bincount(group[kept], minlength=len(counts))
+    kept_positions = np.flatnonzero(kept)
+    kept_groups = group[kept_positions]
+    scored = np.flatnonzero(kept_count > 0)
+    low = kept_positions[np.searchsorted(kept_groups, scored, side='left')]
+    high = kept_positions[np.searchsorted(kept_groups, scored, side='right') - 1]
+
+    return {
+        "item_id": items[low],
+        "realm_count": counts[scored],
+        "kept_count": kept_count[scored],
+        "min_price": values[low],
+        "min_realm": realms[low],
+        "max_price": values[high],
+        "max_realm": realms[high],
+        "ratio": values[high] / values[low],
+        "first_seen": first_seen[scored],
+    }
+
+
+process_pools = {}  # {workers: ProcessPoolExecutor}, started on first use and kept for the life of the process
+process_pools_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    with process_pools_lock:
+        if workers not in process_pools:
+            # Never fork: the pool is started from a thread (e.g. the app's deal worker), and forking a
+            # threaded process can copy a lock some other thread holds. Workers only import this module
+            # and the calling script, which therefore mustn't start anything on import.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            process_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return process_pools[workers]
+
+
+def discard_process_pool(workers):
+    """Forgets a pool that lost a worker (BrokenProcessPool), so the next call starts a fresh one."""
+    with process_pools_lock:
+        pool = process_pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def score_shard(block_name, row_count, start, end):
+    """Process pool task: score_items of rows [start:end) of the shared (item, realm, price) block."""
+    block = shared_memory.SharedMemory(name=block_name)
+    rows = np.ndarray((3, row_count), dtype=np.int64, buffer=block.buf)
+    try:
+        return score_items(rows[0, start:end], rows[1, start:end], rows[2, start:end], workers=1)
+    finally:
+        del rows  # The block can only be closed once no array uses it
+        block.close()
+
+
+def score_items_parallel(item_ids, realm_ids, prices, workers):
+    """score_items with the items split into `workers` shards that are scored in a process pool.
+
+    The rows are grouped by item into one shared memory block, each item's rows in input order, and
+    every shard is a range of whole items read in place by a worker, so only the block's name and
+    the range are sent to it. Items don't affect each other's scores and the shards are in item
+    order, so concatenating their results gives exactly the serial result.
+    """
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    row_count = len(item_ids)
+    order = np.argsort(item_ids, kind='stable')
+    block = shared_memory.SharedMemory(create=True, size=max(1, 3 * row_count * 8))
+    try:
+        rows = np.ndarray((3, row_count), dtype=np.int64, buffer=block.buf)
+        for row, column in zip(rows, (item_ids, realm_ids, prices)):
+            np.take(np.asarray(column, dtype=np.int64), order, out=row)
+        # About the same number of rows per shard, each cut moved back to the start of its item
+        cuts = np.arange(1, workers) * row_count // workers
+        cuts = np.searchsorted(rows[0], rows[0][cuts], side='left') if row_count else cuts
+        bounds = np.unique(np.concatenate(([0], cuts, [row_count])))
+        del rows
+        pool = get_process_pool(workers)
+        try:
+            shards = [(start, end, pool.submit(score_shard, block.name, row_count, start, end))
+                      for start, end in zip(bounds[:-1], bounds[1:])]
+            parts = []
+            for start, end, future in shards:
+                part = future.result()
+                # Shard positions back to input positions; each item's rows kept their relative order
+                part["first_seen"] = order[start + part["first_seen"]]
+                parts.append(part)
+        except BrokenProcessPool:
+            discard_process_pool(workers)
+            raise
+    finally:
+        block.close()
+        block.unlink()
+    if not parts:
+        return score_items(item_ids, realm_ids, prices, workers=1)
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def deal_mask(scores,
+              min_price_ratio=MIN_PRICE_RATIO,
+              min_gold_price=MIN_GOLD_PRICE,
+              max_realistic_gold_price=MAX_REALISTIC_GOLD_PRICE,
+              min_realm_count=MIN_REALM_COUNT):
+    """Boolean mask of the score_items rows that are deals under the given thresholds."""
+    return (
+        (scores["realm_count"] >= min_realm_count)
+        & (scores["kept_count"] >= min_realm_count)
+        & (scores["min_price"] >= min_gold_price * COPPER_PER_GOLD)
+        & (scores["max_price"] <= max_realistic_gold_price * COPPER_PER_GOLD)
+        & (scores["ratio"] >= min_price_ratio)
+    )
+
+
+def find_deals(item_ids, realm_ids, prices,
+               min_price_ratio=MIN_PRICE_RATIO,
+               min_gold_price=MIN_GOLD_PRICE,
+               max_realistic_gold_price=MAX_REALISTIC_GOLD_PRICE,
+               min_realm_count=MIN_REALM_COUNT,
+               workers=None):
+    """Scores every item at once from its per-realm minimum prices.
+
+    For each item with at least `min_realm_count` realms, prices above Q3 + 1.5 * IQR are dropped,
+    then prices further than 5 MADs from the median of what's left. The cheapest and most expensive
+    remaining realms form the deal. Returns (item_id, ratio, min_price, min_realm, max_price, max_realm)
+    tuples sorted by ratio, best first; ties keep the order in which items first appear in the input.
+    `workers` is passed on to score_items.
+    """
+    scores = score_items(item_ids, realm_ids, prices, workers)
+    selected = np.flatnonzero(deal_mask(scores, min_price_ratio, min_gold_price, max_realistic_gold_price, min_realm_count))
+    ranking = selected[np.lexsort((scores["first_seen"][selected], -scores["ratio"][selected]))]
+    return [
+        (int(scores["item_id"][i]), float(scores["ratio"][i]), int(scores["min_price"][i]), int(scores["min_realm"][i]),
+         int(scores["max_price"][i]), int(scores["max_realm"][i]))
+        for i in ranking
+    ]
+
+
+def load_commodity_prices(conn):
+    """Returns {item_id: (lowest unit price, units listed)} from the region commodity order book."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT item_id, MIN(unit_price), SUM(quantity)
+        FROM commodity_price_levels
+        GROUP BY item_id
+    """)
+    return {item_id: (unit_price, quantity) for item_id, unit_price, quantity in cursor.fetchall()}
+
+
+def find_commodity_spreads(conn, min_price_ratio=MIN_PRICE_RATIO):
+    """Compares every realm's cheapest per-unit listing with the region commodity price of the same item.
+
+    Returns (item_id, realm_id, realm_unit_price, commodity_unit_price, ratio) tuples where one side is
+    at least `min_price_ratio` times the other, sorted by ratio, best first. A ratio above 1 means the
+    commodity market pays more than the realm listing costs.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT r.item_id, r.connected_realm_id, r.min_unit_price, c.min_unit_price
+        FROM realm_min_prices AS r
+        JOIN (
+            SELECT item_id, MIN(unit_price) AS min_unit_price
+            FROM commodity_price_levels
+            GROUP BY item_id
+        ) AS c ON c.item_id = r.item_id
+        WHERE r.min_unit_price > 0
+        ORDER BY r.item_id, r.connected_realm_id
+    """)
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    data = np.array(rows, dtype=np.int64)
+    ratios = data[:, 3] / data[:, 2]
+    spread = np.maximum(ratios, 1 / ratios)
+    selected = np.flatnonzero(spread >= min_price_ratio)
+    selected = selected[np.argsort(-spread[selected], kind='stable')]
+    return [
+        (int(data[i, 0]), int(data[i, 1]), int(data[i, 2]), int(data[i, 3]), float(ratios[i]))
+        for i in selected
+    ]
@@ -0,0 +1,158 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import setup_database
+
+# Scoring every item is far too much work for a web request, so this worker does it once per snapshot
+# and replaces the region's deal_candidates table in a single transaction. The web app only filters
+# and pages that table. It runs inside the app as a thread (see app.RUN_DEAL_WORKER) or on its own:
+# `python deal_worker.py` keeps polling, `--once` brings every region up to date and exits.
+
+# --- Configuration ---
+POLL_INTERVAL_SECONDS = int(os.getenv("DEAL_WORKER_INTERVAL", "30"))  # How often to look for a new snapshot
+# ----------------------
+
+INSERT_DEAL_CANDIDATE_SQL = """
+INSERT INTO deal_candidates (item_id, item_name, icon_url, quality, realm_count, kept_count, min_price, min_realm,
+                             max_price, max_realm, ratio, profit, liquidity, first_seen, depth)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def get_metadata(conn, key, default=None):
+    row = conn.execute("SELECT value FROM scan_metadata WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_metadata(conn, key, value):
+    conn.execute("""
+        INSERT INTO scan_metadata (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+
+def compute_deal_candidates(conn):
+    """Scores every item of the snapshot; returns the rows of deal_candidates.
+
+    Realms are compared by unit price. Outlier filtering doesn't depend on the deal thresholds, so
+    every threshold, quality and realm filter and every sort order of /api/deals can be answered
+    from these rows. The depth of a deal is how many units the cheapest realm lists below the
+    dearest realm's unit price, and its profit what reselling all of them at that price would make,
+    both read from the cheapest realm's order book.
+    """
+    import deal_engine  # Imported here so the app, which imports this module, loads NumPy only to score
+    item_ids, realm_ids, prices = deal_engine.load_realm_prices(conn)
+    scores = deal_engine.score_items(item_ids, realm_ids, prices)
+    liquidity = dict(conn.execute(
+        "SELECT item_id, SUM(auction_count) FROM realm_min_prices GROUP BY item_id"
+    ).fetchall())
+    details = {
+        item_id: (name, icon_url, quality)
+        for item_id, name, icon_url, quality in conn.execute("SELECT item_id, name, icon_url, quality FROM items")
+    }
+
+    rows = []
+    columns = [scores[name].tolist() for name in (
+        "item_id", "realm_count", "kept_count", "min_price", "min_realm", "max_price", "max_realm", "ratio", "first_seen"
+    )]
+    for item_id, realm_count, kept_count, min_price, min_realm, max_price, max_realm, ratio, first_seen in zip(*columns):
+        name, icon_url, quality = details.get(item_id, ("Unknown", "", None))
+        book = deal_engine.load_order_book(conn, item_id, min_realm)
+        depth, cost = book.cost_below(max_price) if book else (0, 0)
+        rows.append((item_id, name, icon_url, quality, realm_count, kept_count, min_price, min_realm,
+                     max_price, max_realm, ratio, depth * max_price - cost, liquidity.get(item_id, 0), first_seen, depth))
+    return rows
+
+
+def write_deal_candidates(conn, rows, snapshot_version, snapshot_at, compute_seconds):
+    """Replaces the deal candidates and their bookkeeping in one transaction.
+
+    Readers (in WAL mode) keep seeing the previous set until the commit, then the complete new one.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM deal_candidates")
+        conn.executemany(INSERT_DEAL_CANDIDATE_SQL, rows)
+        set_metadata(conn, 'deals_snapshot_version', snapshot_version)
+        set_metadata(conn, 'deals_snapshot_at', snapshot_at)
+        set_metadata(conn, 'deals_computed_at', time.time())
+        set_metadata(conn, 'deals_compute_seconds', compute_seconds)
+        set_metadata(conn, 'deals_item_count', len(rows))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def refresh_region(region, force=False, db_file=None):
+    """Recomputes a region's deal candidates if its snapshot changed since the last run. Returns True if it did.
+
+    `db_file` defaults to the region's database.
+    """
+    conn = setup_database.connect(db_file or setup_database.db_file_for_region(region), isolation_level=None)
+    try:
+        setup_database.migrate(conn)
+        # Score from one read transaction, so a sweep committing meanwhile can't mix two snapshots
+        conn.execute("BEGIN")
+        try:
+            snapshot_version = get_metadata(conn, 'snapshot_version', 0)
+            if not force and get_metadata(conn, 'deals_snapshot_version') == snapshot_version:
+                return False
+            snapshot_at = get_metadata(conn, 'snapshot_at')
+            start_time = time.perf_counter()
+            rows = compute_deal_candidates(conn)
+            compute_seconds = time.perf_counter() - start_time
+        finally:
+            conn.execute("COMMIT")
+        write_deal_candidates(conn, rows, snapshot_version, snapshot_at, compute_seconds)
+        print(f"Scored {len(rows)} items for {region} snapshot {snapshot_version} in {compute_seconds:.2f}s.")
+        return True
+    finally:
+        conn.close()
+
+
+def run(regions=None, interval=POLL_INTERVAL_SECONDS, once=False, force=False):
+    """Keeps every region's deal candidates up to date; with `once`, updates them a single time and returns.
+
+    `force` recomputes every region on the first pass even if its snapshot didn't change.
+    """
+    regions = regions or setup_database.REGIONS
+    while True:
+        for region in regions:
+            try:
+                refresh_region(region, force)
+            except sqlite3.Error as e:
+                print(f"Could not recompute deals for {region}. Database error: {e}")
+            except Exception:
+                # Anything else (a broken scoring pool, running out of memory) must not end the thread,
+                # or the app would serve the last deals forever; try again next time
+                print(f"Could not recompute deals for {region}. Unexpected error:\n{traceback.format_exc()}")
+        if once:
+            return
+        force = False
+        time.sleep(interval)
+
+
+def start_thread(regions=None, interval=POLL_INTERVAL_SECONDS):
+    """Runs the worker in a daemon thread of the calling process, e.g. the web app."""
+    thread = threading.Thread(target=run, args=(regions, interval), name="deal-worker", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import deal_engine
+    parser = argparse.ArgumentParser(description="Recomputes deal candidates whenever a new scan lands.")
+    parser.add_argument("--region", action="append",
+                        help="Region to keep up to date, may be repeated (default: every region in WOW_REGIONS)")
+    parser.add_argument("--interval", type=int, default=POLL_INTERVAL_SECONDS, help="Seconds between checks")
+    parser.add_argument("--once", action="store_true", help="Update every region once and exit")
+    parser.add_argument("--force", action="store_true", help="Recompute even if the snapshot didn't change")
+    parser.add_argument("--workers", type=int, default=deal_engine.SCORING_WORKERS,
+                        help="Processes to score items in (default: DEAL_SCORING_WORKERS, or 1)")
+    args = parser.parse_args()
+    deal_engine.SCORING_WORKERS = args.workers
+    run(args.region, args.interval, args.once, args.force)
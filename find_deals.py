@@ -1,15 +1,19 @@
-import sqlite3
+import argparse
 import time
 import numpy as np
-from collections import defaultdict
+import deal_engine
+import setup_database
+import price_history
 
-DB_FILE = "wow_auctions.db"
+DB_FILE = setup_database.DB_FILE  # The default region's database; see --region
+HISTORY_DIR = price_history.history_dir_for_region(setup_database.DEFAULT_REGION)
 
 # --- CONFIGURATION ---
 MIN_PRICE_RATIO = 3.0
 MIN_GOLD_PRICE = 1000
 MIN_REALM_COUNT = 5
 DEAL_REPORT_LIMIT = 25
+HISTORY_DAYS = 7  # Compare the cheapest realm with the item's median minimum unit price over this many days
 MAX_REALISTIC_GOLD_PRICE = 3000000  # Ignore any "max price" above 3 million gold
 # -----------------------------------------------------------------
 
@@ -24,100 +28,47 @@ def format_price(price_in_copper):
     return f"{gold}g {silver}s {copper}c"
 
 
-def analyze_market_optimized():
-    """Optimized version that processes data in-memory to avoid slow lookups."""
+def analyze_market_optimized(now=None):
+    """Optimized version that processes data in-memory to avoid slow lookups.
+
+    `now` dates the history baselines, e.g. to the snapshot being replayed (default: the current time).
+    """
     start_time = time.time()
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    conn = setup_database.connect(DB_FILE, read_only=True)
 
     print("Starting optimized market analysis...")
 
     # Step 1: Fetch all necessary data at once.
-    # We get a list of (item, realm, price) for every realm's minimum.
-    raw_prices_query = """
-        SELECT
-            item_id,
-            connected_realm_id,
-            MIN(buyout_price) as min_realm_price
-        FROM
-            auctions
-        WHERE
-            buyout_price IS NOT NULL
-        GROUP BY
-            item_id, connected_realm_id;
-    """
-    cursor.execute(raw_prices_query)
-    all_realm_min_prices = cursor.fetchall()
+    # We get aligned (item, realm, price) arrays for every realm's minimum, which the
+    # scanner keeps precomputed in realm_min_prices.
+    item_ids, realm_ids, prices = deal_engine.load_realm_prices(conn)
     conn.close()  # We are done with the database now.
 
-    # Step 2: Group the data by item_id in a dictionary for easy processing.
-    # The structure will be: {item_id: [(price, realm_id), (price, realm_id), ...]}
-    item_data = defaultdict(list)
-    for item_id, realm_id, price in all_realm_min_prices:
-        item_data[item_id].append((price, realm_id))
-
-    print(f"Found {len(item_data)} unique items. Applying statistical analysis in-memory...")
-
-    final_deals = []
-    for item_id, price_realm_tuples in item_data.items():
-        # Ensure we have enough data points for meaningful analysis
-        if len(price_realm_tuples) < MIN_REALM_COUNT:
-            continue
-
-        prices_array = np.array([t[0] for t in price_realm_tuples])
-
-        # Step 3: Perform statistical outlier rejection (IQR-based)
-        q1 = np.percentile(prices_array, 25)
-        q3 = np.percentile(prices_array, 75)
-        iqr = q3 - q1
-        outlier_threshold = q3 + (1.5 * iqr)
-
-        # Create a new list of (price, realm) tuples without IQR outliers
-        realistic_data = [t for t in price_realm_tuples if t[0] <= outlier_threshold]
-
-        # Additional median-based filter
-        if realistic_data:
-            median_price = np.median([t[0] for t in realistic_data])
-            mad = np.median(np.abs([t[0] for t in realistic_data] - median_price)) or 1
-            mad_threshold = 5 * mad
-            realistic_data = [
-                t for t in realistic_data
-                if abs(t[0] - median_price) <= mad_threshold
-            ]
-
-        if len(realistic_data) < MIN_REALM_COUNT:
-            continue
-
-        # Step 4: Find the min and max from the CLEANED data
-        realistic_data.sort(key=lambda x: x[0])
-        min_price, min_realm = realistic_data[0]
-        max_price, max_realm = realistic_data[-1]
-
-        # Apply final filters
-        if min_price < (MIN_GOLD_PRICE * 10000):
-            continue
-
-        ratio = max_price / min_price if min_price > 0 else 0
-
-        # Final hard cap to filter extreme outliers
-        if max_price > (MAX_REALISTIC_GOLD_PRICE * 10000):
-            continue
-
-        if ratio >= MIN_PRICE_RATIO:
-            final_deals.append({
-                "item_id": item_id,
-                "min_price": min_price,
-                "max_price": max_price,
-                "min_realm": min_realm,
-                "max_realm": max_realm,
-                "ratio": ratio,
-            })
-
-    # Sort the final list by the most profitable ratio
-    final_deals.sort(key=lambda x: x['ratio'], reverse=True)
+    print(f"Found {len(np.unique(item_ids))} unique items. Applying statistical analysis in-memory...")
+
+    # Step 2: IQR and median/MAD outlier rejection, then min/max/ratio, for all items at once.
+    final_deals = [
+        {
+            "item_id": item_id,
+            "min_price": min_price,
+            "max_price": max_price,
+            "min_realm": min_realm,
+            "max_realm": max_realm,
+            "ratio": ratio,
+        }
+        for item_id, ratio, min_price, min_realm, max_price, max_realm in deal_engine.find_deals(
+            item_ids, realm_ids, prices,
+            min_price_ratio=MIN_PRICE_RATIO,
+            min_gold_price=MIN_GOLD_PRICE,
+            max_realistic_gold_price=MAX_REALISTIC_GOLD_PRICE,
+            min_realm_count=MIN_REALM_COUNT,
+        )
+    ]
+
+    # deal_engine already returns the deals sorted by the most profitable ratio
     end_time = time.time()
 
-    # Step 5: Print the final report
+    # Step 3: Print the final report
     print(f"\nAnalysis complete in {end_time - start_time:.2f} seconds.")
     print("-" * 70)
     print(f"Top {min(len(final_deals), DEAL_REPORT_LIMIT)} Statistically Significant Market Opportunities")
@@ -126,12 +77,48 @@ def analyze_market_optimized():
     if not final_deals:
         print("No deals found matching your criteria. Try adjusting the CONFIG settings.")
 
+    # The item's own recent history, if the scanner has been recording it
+    baselines = price_history.item_baselines(HISTORY_DAYS, now, history_dir=HISTORY_DIR)
+
     for deal in final_deals[:DEAL_REPORT_LIMIT]:
         print(f"Item ID: {deal['item_id']:<8} | Ratio: {deal['ratio']:.2f}x")
-        print(f"  -> Cheapest Realm Low: {format_price(deal['min_price']):<18} (Realm {deal['min_realm']})")
-        print(f"  -> Realistic High Low: {format_price(deal['max_price']):<18} (Realm {deal['max_realm']})")
+        print(f"  -> Cheapest Realm Unit Low: {format_price(deal['min_price']):<18} (Realm {deal['min_realm']})")
+        print(f"  -> Realistic High Unit Low: {format_price(deal['max_price']):<18} (Realm {deal['max_realm']})")
+        baseline = baselines.get(deal['item_id'])
+        if baseline:
+            label = f"{HISTORY_DAYS}-Day Median Unit Low:"
+            print(f"  -> {label:<24} {format_price(baseline):<18} "
+                  f"(cheapest is {deal['min_price'] / baseline:.2f}x of it)")
+        print("-" * 70)
+
+
+def report_commodity_spreads():
+    """Lists realm listings priced far from the region-wide commodity price of the same item."""
+    conn = setup_database.connect(DB_FILE, read_only=True)
+    spreads = deal_engine.find_commodity_spreads(conn, MIN_PRICE_RATIO)
+    conn.close()
+
+    print(f"\nTop {min(len(spreads), DEAL_REPORT_LIMIT)} Realm vs. Region Commodity Price Gaps (per unit)")
+    print("-" * 70)
+    if not spreads:
+        print("No realm listing is priced far enough from the commodity market.")
+
+    for item_id, realm_id, realm_unit_price, commodity_unit_price, ratio in spreads[:DEAL_REPORT_LIMIT]:
+        print(f"Item ID: {item_id:<8} | Commodity / Realm: {ratio:.2f}x")
+        print(f"  -> Realm Unit Low:     {format_price(realm_unit_price):<18} (Realm {realm_id})")
+        print(f"  -> Commodity Unit Low: {format_price(commodity_unit_price):<18}")
         print("-" * 70)
 
 
 if __name__ == "__main__":
-    analyze_market_optimized()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Reports cross-realm deals and commodity price gaps of a region.")
+    parser.add_argument("--region", default=setup_database.DEFAULT_REGION, help="Region whose database to read")
+    parser.add_argument("--workers", type=int, default=deal_engine.SCORING_WORKERS,
+                        help="Processes to score items in (default: DEAL_SCORING_WORKERS, or 1)")
+    args = parser.parse_args()
+    deal_engine.SCORING_WORKERS = args.workers
+    DB_FILE = setup_database.db_file_for_region(args.region)
+    HISTORY_DIR = price_history.history_dir_for_region(args.region)
+
+    analyze_market_optimized()
+    report_commodity_spreads()
\ No newline at end of file
@@ -0,0 +1,224 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Upper bounds in seconds, from a cached page to a full deal recompute on a large region
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def log_event(event, **fields):
+    """Prints one structured log line: a JSON object with a timestamp, the event name and its fields."""
+    record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event}
+    record.update(fields)
+    print(json.dumps(record, default=str), flush=True)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types: a name, help text and one value per label set."""
+
+    type_name = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def samples(self):
+        """Yields (sample name, labels, value) for the exposition format."""
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            yield self.name, dict(labels), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for sample_name, labels, value in self.samples():
+            lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(labels, (list(counts), total)) for labels, (counts, total) in self.values.items()]
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**dict(labels), "le": format_value(float(bound))}, cumulative
+            yield f"{self.name}_sum", dict(labels), total
+            yield f"{self.name}_count", dict(labels), cumulative
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def deal_metrics_registry(deals):
+    """Builds gauges from the deal worker's bookkeeping in each region's scan_metadata.
+
+    `deals` maps region -> app.get_deal_freshness() (None if the region's database can't be read).
+    """
+    registry = Registry()
+    computed = registry.gauge("wow_deals_computed_timestamp_seconds", "Unix time the deal candidates were last computed.")
+    compute_seconds = registry.gauge("wow_deals_compute_seconds", "Time the deal worker took to score the last snapshot.")
+    items = registry.gauge("wow_deal_candidates_items", "Items scored in the deal candidates.")
+    snapshot_age = registry.gauge("wow_deals_snapshot_age_seconds",
+                                  "Age of the snapshot the deal candidates were computed from.")
+    pending = registry.gauge("wow_deals_snapshots_behind",
+                             "Snapshots committed by the scanner that the deal candidates don't include yet.")
+    now = time.time()
+    for region, freshness in deals.items():
+        if not freshness or freshness["snapshotVersion"] is None:
+            continue
+        computed.set(freshness["computedAt"], region=region)
+        compute_seconds.set(freshness["computeSeconds"], region=region)
+        items.set(freshness["itemCount"], region=region)
+        if freshness["snapshotAt"] is not None:
+            snapshot_age.set(now - freshness["snapshotAt"], region=region)
+        pending.set(freshness["latestSnapshotVersion"] - freshness["snapshotVersion"], region=region)
+    return registry
+
+
+def sweep_metrics_registry(sweeps):
+    """Builds gauges from the last sweep summary the scanner stored in each region's scan_metadata.
+
+    `sweeps` maps region -> summary (None for regions without an instrumented sweep yet).
+    """
+    registry = Registry()
+    sweeps = {region: sweep for region, sweep in sweeps.items() if sweep}
+    if not sweeps:
+        return registry
+
+    finished = registry.gauge("wow_scanner_last_sweep_timestamp_seconds", "Unix time the last scanner sweep finished.")
+    duration = registry.gauge("wow_scanner_last_sweep_duration_seconds", "Wall time of the last scanner sweep.")
+    stages = registry.gauge("wow_scanner_last_sweep_stage_seconds",
+                            "Seconds spent per pipeline stage in the last sweep, summed over realms.")
+    realms = registry.gauge("wow_scanner_last_sweep_realms", "Realms of the last sweep by outcome.")
+    download_bytes = registry.gauge("wow_scanner_last_sweep_download_bytes",
+                                    "Bytes of auction dumps downloaded in the last sweep.")
+    auctions = registry.gauge("wow_scanner_last_sweep_auctions", "Auctions parsed in the last sweep.")
+    realm_stages = registry.gauge("wow_scanner_last_sweep_realm_stage_seconds",
+                                  "Seconds spent per pipeline stage for each realm in the last sweep.")
+    realm_bytes = registry.gauge("wow_scanner_last_sweep_realm_download_bytes",
+                                 "Bytes downloaded for each realm in the last sweep.")
+    responses = registry.gauge("wow_scanner_last_sweep_http_responses",
+                               "Blizzard API responses in the last sweep by HTTP status.")
+    retries = registry.gauge("wow_scanner_last_sweep_http_retries", "Blizzard API requests retried in the last sweep.")
+    connection_errors = registry.gauge("wow_scanner_last_sweep_http_connection_errors",
+                                       "Blizzard API connection errors and timeouts in the last sweep.")
+    token_refreshes = registry.gauge("wow_scanner_last_sweep_token_refreshes", "OAuth tokens fetched in the last sweep.")
+    hourly_remaining = registry.gauge("wow_scanner_rate_limit_hourly_remaining",
+                                      "Requests left in the client's hourly quota when the last sweep finished.")
+    wait_seconds = registry.gauge("wow_scanner_rate_limit_wait_seconds",
+                                  "Seconds requests spent waiting on the rate limiter in the last sweep.")
+
+    for region, sweep in sweeps.items():
+        finished.set(sweep["finished_at"], region=region)
+        duration.set(sweep["duration_seconds"], region=region)
+        for stage, seconds in sweep["stages"].items():
+            stages.set(seconds, region=region, stage=stage)
+        for outcome, count in sweep["realm_outcomes"].items():
+            realms.set(count, region=region, outcome=outcome)
+        download_bytes.set(sweep["download_bytes"], region=region)
+        auctions.set(sweep["auctions"], region=region)
+        for realm_id, realm in sweep["realms"].items():
+            for stage, seconds in realm["stages"].items():
+                realm_stages.set(seconds, region=region, realm=realm_id, stage=stage)
+            realm_bytes.set(realm["download_bytes"], region=region, realm=realm_id)
+
+        http = sweep["http"]
+        for status, count in http["responses"].items():
+            responses.set(count, region=region, status=status)
+        retries.set(http["retries"], region=region)
+        connection_errors.set(http["connection_errors"], region=region)
+        token_refreshes.set(http["token_refreshes"], region=region)
+
+        rate_limit = sweep["rate_limit"]
+        hourly_remaining.set(rate_limit["hourly_remaining"], region=region)
+        wait_seconds.set(rate_limit["wait_seconds"], region=region)
+    return registry
@@ -0,0 +1,226 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+import numpy as np
+import deal_engine
+import setup_database
+
+# --- Configuration ---
+HISTORY_DIR = "price_history"
+HOURLY_RETENTION_DAYS = 7  # Hourly buckets older than this are rolled up into daily ones
+# ----------------------
+
+HOURLY = "hourly"
+DAILY = "daily"
+BUCKET_FORMATS = {HOURLY: "%Y-%m-%dT%H", DAILY: "%Y-%m-%d"}
+
+# Every bucket is a directory with one .npy file per column, rows sorted by (item_id, realm_id)
+COLUMNS = {
+    "item_id": np.int32,
+    "realm_id": np.int32,
+    "min": np.int64,
+    "p25": np.float64,
+    "median": np.float64,
+    "quantity": np.int64,
+    "listings": np.int32,
+    "min_unit_price": np.int64,
+    "samples": np.int32,  # Hourly snapshots averaged into the row: 1 in hourly buckets
+}
+# Stands in for min_unit_price in buckets written before it was recorded; np.minimum ignores it
+MISSING_UNIT_PRICE = np.iinfo(np.int64).max
+# Values of the columns that buckets written before them don't have
+MISSING_COLUMNS = {"min_unit_price": MISSING_UNIT_PRICE, "samples": 1}
+
+
+def history_dir_for_region(region):
+    """Returns the history directory of a region. EU history from before regions were configurable
+    sits directly in HISTORY_DIR and keeps being used."""
+    if region == setup_database.LEGACY_REGION and any(os.path.isdir(os.path.join(HISTORY_DIR, resolution)) for resolution in BUCKET_FORMATS):
+        return HISTORY_DIR
+    return os.path.join(HISTORY_DIR, region)
+
+
+def bucket_path(resolution, bucket_time, history_dir=HISTORY_DIR):
+    return os.path.join(history_dir, resolution, bucket_time.strftime(BUCKET_FORMATS[resolution]))
+
+
+def list_buckets(resolution, history_dir=HISTORY_DIR):
+    """Returns [(bucket_time, path)] for one resolution, oldest first."""
+    root = os.path.join(history_dir, resolution)
+    if not os.path.isdir(root):
+        return []
+    buckets = []
+    for name in os.listdir(root):
+        try:
+            bucket_time = datetime.strptime(name, BUCKET_FORMATS[resolution])
+        except ValueError:
+            continue  # Half-written or leftover directories
+        buckets.append((bucket_time, os.path.join(root, name)))
+    return sorted(buckets)
+
+
+def write_bucket(path, columns):
+    """Writes a bucket next to its final location, then swaps it in so readers never see it half-written."""
+    temp_path = path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(temp_path, f"{name}.npy"), np.asarray(columns[name], dtype=dtype))
+    if os.path.isdir(path):
+        old_path = path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.rename(path, old_path)
+        os.rename(temp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(temp_path, path)
+
+
+def read_bucket(path):
+    """Memory-maps every column of a bucket. Columns it predates are filled from MISSING_COLUMNS."""
+    bucket = {}
+    for name, dtype in COLUMNS.items():
+        column_path = os.path.join(path, f"{name}.npy")
+        if name in MISSING_COLUMNS and not os.path.exists(column_path):
+            bucket[name] = np.full(len(bucket["item_id"]), MISSING_COLUMNS[name], dtype=dtype)
+        else:
+            bucket[name] = np.load(column_path, mmap_mode='r')
+    return bucket
+
+
+def concat_columns(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+
+
+def sort_columns(columns):
+    order = np.lexsort((columns["realm_id"], columns["item_id"]))
+    return {name: np.asarray(values)[order] for name, values in columns.items()}
+
+
+def append_snapshot(conn, snapshot_time, history_dir=HISTORY_DIR):
+    """Stores per-(item, realm) aggregates of the current auctions as the hourly bucket of `snapshot_time`.
+
+    The aggregates are copied from realm_min_prices, which the scanner keeps up to date per realm, so
+    this reads one row per (item, realm) instead of every auction. Several scans in the same hour
+    overwrite that hour's bucket.
+    """
+    rows = conn.execute("""
+        SELECT item_id, connected_realm_id, min_buyout, p25_buyout, median_buyout, total_quantity, auction_count,
+               min_unit_price
+        FROM realm_min_prices
+        ORDER BY item_id, connected_realm_id
+    """).fetchall()
+    if not rows:
+        return 0
+    data = np.array(rows, dtype=np.float64)
+    columns = {name: data[:, index] for index, name in enumerate(
+        ("item_id", "realm_id", "min", "p25", "median", "quantity", "listings", "min_unit_price"))}
+    columns["samples"] = np.ones(len(rows))
+    write_bucket(bucket_path(HOURLY, snapshot_time, history_dir), columns)
+    return len(rows)
+
+
+def roll_up(now=None, retention_days=HOURLY_RETENTION_DAYS, history_dir=HISTORY_DIR):
+    """Merges hourly buckets older than `retention_days` into one daily bucket per day.
+
+    A daily bucket keeps the lowest min and min_unit_price of the day and the average of the hourly
+    p25, median, quantity and listing counts, with the number of hours averaged in `samples`. The
+    scanner rolls up after every sweep, so each hour that passes the cutoff is merged into its day's
+    existing bucket, weighted by those samples. Returns the number of days rolled up.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    days = {}
+    for bucket_time, path in list_buckets(HOURLY, history_dir):
+        if bucket_time < cutoff:
+            days.setdefault(bucket_time.replace(hour=0), []).append(path)
+
+    for day, paths in days.items():
+        daily_path = bucket_path(DAILY, day, history_dir)
+        parts = [read_bucket(path) for path in paths]
+        if os.path.isdir(daily_path):
+            # The hours of this day that passed the cutoff earlier
+            parts.append(read_bucket(daily_path))
+        columns = sort_columns(concat_columns(parts))
+
+        keys = columns["item_id"].astype(np.int64) << 32 | columns["realm_id"].astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        weights = columns["samples"].astype(np.float64)
+        samples = np.add.reduceat(weights, starts)
+        daily = {
+            "item_id": columns["item_id"][starts],
+            "realm_id": columns["realm_id"][starts],
+            "min": np.minimum.reduceat(columns["min"], starts),
+            "min_unit_price": np.minimum.reduceat(columns["min_unit_price"], starts),
+        }
+        for name in ("p25", "median", "quantity", "listings"):
+            daily[name] = np.add.reduceat(columns[name] * weights, starts) / samples
+        daily["quantity"] = np.rint(daily["quantity"])
+        daily["listings"] = np.rint(daily["listings"])
+        daily["samples"] = samples
+        write_bucket(daily_path, daily)
+        for path in paths:
+            shutil.rmtree(path)
+    return len(days)
+
+
+def read_item_history(item_id, start=None, end=None, realm_id=None, history_dir=HISTORY_DIR):
+    """Returns one item's aggregates between `start` and `end` from daily and hourly buckets.
+
+    The result maps "time" and every column name to an array, ordered by time then realm. Each bucket
+    is memory-mapped and the item's rows are found by binary search on its sorted item_id column.
+    """
+    parts = []
+    for resolution in (DAILY, HOURLY):
+        for bucket_time, path in list_buckets(resolution, history_dir):
+            if (start and bucket_time < start) or (end and bucket_time > end):
+                continue
+            bucket = read_bucket(path)
+            low = np.searchsorted(bucket["item_id"], item_id, side='left')
+            high = np.searchsorted(bucket["item_id"], item_id, side='right')
+            if low == high:
+                continue
+            rows = {name: np.array(values[low:high]) for name, values in bucket.items()}
+            if realm_id is not None:
+                mask = rows["realm_id"] == realm_id
+                rows = {name: values[mask] for name, values in rows.items()}
+            rows["time"] = np.full(len(rows["item_id"]), np.datetime64(bucket_time, 's'))
+            parts.append(rows)
+    if not parts:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in {**COLUMNS, "time": "datetime64[s]"}.items()}
+    history = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    order = np.lexsort((history["realm_id"], history["time"]))
+    return {name: values[order] for name, values in history.items()}
+
+
+def item_baselines(days=HOURLY_RETENTION_DAYS, now=None, history_dir=HISTORY_DIR):
+    """Returns {item_id: median of its per-realm minimum unit prices over the last `days` days}.
+
+    Rows from buckets written before unit prices were recorded are left out, and so are hours after
+    `now` and days that end after it, so a backtest of an older snapshot only sees the history that
+    existed at the time.
+    """
+    now = now or datetime.now()
+    start = now - timedelta(days=days)
+    items = []
+    prices = []
+    for resolution, length in ((DAILY, timedelta(days=1)), (HOURLY, timedelta(0))):
+        for bucket_time, path in list_buckets(resolution, history_dir):
+            if bucket_time < start or bucket_time + length > now:
+                continue
+            bucket = read_bucket(path)
+            items.append(np.array(bucket["item_id"]))
+            prices.append(np.array(bucket["min_unit_price"]))
+    if not items:
+        return {}
+    items = np.concatenate(items)
+    prices = np.concatenate(prices)
+    recorded = prices != MISSING_UNIT_PRICE
+    items, prices = items[recorded], prices[recorded]
+    if not len(items):
+        return {}
+    order = np.lexsort((prices, items))
+    items, prices = items[order], prices[order]
+    starts = np.flatnonzero(np.r_[True, items[1:] != items[:-1]])
+    counts = np.diff(np.append(starts, len(items)))
+    medians = deal_engine.segment_median(prices, starts, counts)
+    return dict(zip(items[starts].tolist(), medians.tolist()))
@@ -1,74 +1,233 @@
+import argparse
+import json
 import sqlite3
-import statistics
+import sys
+import deal_engine
+import setup_database
 
-DB_FILE = "wow_auctions.db"
+DB_FILE = setup_database.DB_FILE  # The default region's database; see --region
 
 def format_price(price_in_copper):
     """Converts a copper value into a readable gold, silver, copper string."""
     if not isinstance(price_in_copper, (int, float)):
         return "N/A"
-    
+
     gold = int(price_in_copper / 10000)
     silver = int((price_in_copper % 10000) / 100)
     copper = int(price_in_copper % 100)
     return f"{gold}g {silver}s {copper}c"
 
-def analyze_item_prices(item_id):
-    """Queries the database for a specific item and prints a price analysis."""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        print(f"\nSearching for Item ID: {item_id}...")
-
-        # Securely query the database using a parameterized query to prevent SQL injection
-        query = """
-            SELECT
-                connected_realm_id,
-                buyout_price
-            FROM
-                auctions
-            WHERE
-                item_id = ? AND buyout_price IS NOT NULL
-            ORDER BY
-                buyout_price ASC;
-        """
-        cursor.execute(query, (item_id,))
-        results = cursor.fetchall()
-
-        if not results:
-            print(f"-> No active buyout auctions found for Item ID {item_id}.")
-            return
-
-        print(f"-> Found {len(results)} active auctions for this item across all realms.")
-        print("-" * 40)
-        
-        # Print each realm and its lowest price
-        # (Note: A realm might appear multiple times if there are multiple auctions)
-        for realm_id, price in results:
-            print(f"  Realm ID: {realm_id:<6} | Price: {format_price(price)}")
-
-        # Perform price analysis
-        prices = [row[1] for row in results]
-        min_price = min(prices)
-        max_price = max(prices)
-        avg_price = statistics.mean(prices)
-        
-        print("-" * 40)
+def median(values):
+    """Median of an already sorted list."""
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+def order_book_depth(book, units=None, below=None):
+    """What buying `units` units costs and how many units are listed below `below` copper per unit."""
+    depth = {}
+    if units:
+        cost = book.cost_to_buy(units)
+        depth["costToBuy"] = {"units": cost[1], "cost": cost[0]} if cost else None
+    if below is not None:
+        depth["unitsBelow"] = book.units_below(below)
+    return depth
+
+def item_price_summary(conn, item_id, units=None, below=None):
+    """Returns the price distribution of one item from the per-(item, realm) summary the scanner keeps.
+
+    Only the item's realm_min_prices rows, commodity price levels and, when `units` (cost to buy
+    that many) or `below` (units listed under that unit price, in copper) is given, its order books
+    are read, all keyed by item id, however many auctions it has. Returns None if the item isn't
+    listed anywhere.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT p.connected_realm_id, r.name, p.min_buyout, p.p25_buyout, p.median_buyout, p.p75_buyout,
+               p.total_buyout, p.total_quantity, p.auction_count, p.min_unit_price
+        FROM realm_min_prices AS p
+        LEFT JOIN realms AS r ON r.connected_realm_id = p.connected_realm_id
+        WHERE p.item_id = ?
+        ORDER BY p.min_buyout
+    """, (item_id,))
+    realm_rows = cursor.fetchall()
+
+    # Stackable goods are traded region-wide; their order book is stored as price levels
+    cursor.execute(
+        "SELECT unit_price, quantity FROM commodity_price_levels WHERE item_id = ? ORDER BY unit_price",
+        (item_id,)
+    )
+    commodity_levels = cursor.fetchall()
+
+    if not realm_rows and not commodity_levels:
+        return None
+
+    cursor.execute("SELECT name, quality FROM items WHERE item_id = ?", (item_id,))
+    item = cursor.fetchone()
+    summary = {
+        "itemId": item_id,
+        "itemName": item[0] if item else None,
+        "quality": item[1] if item else None,
+        "realms": [],
+        "overall": None,
+        "commodity": None,
+    }
+
+    for (realm_id, realm_name, min_buyout, p25, median_buyout, p75,
+         total_buyout, quantity, listings, min_unit_price) in realm_rows:
+        summary["realms"].append({
+            "realmId": realm_id,
+            "realmName": realm_name,
+            "min": min_buyout,
+            "p25": p25,
+            "median": median_buyout,
+            "p75": p75,
+            "weightedUnitAverage": total_buyout / quantity if total_buyout is not None and quantity else None,
+            "minUnitPrice": min_unit_price,
+            "listings": listings,
+            "quantity": quantity,
+        })
+        if units or below is not None:
+            book = deal_engine.load_order_book(conn, item_id, realm_id)
+            if book:
+                summary["realms"][-1].update(order_book_depth(book, units, below))
+
+    if realm_rows:
+        realm_minimums = [row[2] for row in realm_rows]  # Already sorted
+        total_buyout = sum(row[6] or 0 for row in realm_rows)
+        total_quantity = sum(row[7] for row in realm_rows)
+        summary["overall"] = {
+            "realmCount": len(realm_rows),
+            "listings": sum(row[8] for row in realm_rows),
+            "quantity": total_quantity,
+            "min": realm_minimums[0],
+            "max": realm_minimums[-1],
+            "medianOfRealmMinimums": median(realm_minimums),
+            "weightedUnitAverage": total_buyout / total_quantity if total_quantity else None,
+        }
+
+    if commodity_levels:
+        commodity_low = commodity_levels[0][0]
+        units_listed = sum(quantity for _, quantity in commodity_levels)
+        summary["commodity"] = {
+            "minUnitPrice": commodity_low,
+            "unitsListed": units_listed,
+            "priceLevels": len(commodity_levels),
+            "weightedUnitAverage": sum(price * quantity for price, quantity in commodity_levels) / units_listed,
+        }
+        if units or below is not None:
+            prices, quantities = zip(*commodity_levels)
+            summary["commodity"].update(order_book_depth(deal_engine.OrderBook.from_levels(prices, quantities), units, below))
+        unit_prices = [row for row in summary["realms"] if row["minUnitPrice"]]
+        if unit_prices:
+            cheapest = min(unit_prices, key=lambda row: row["minUnitPrice"])
+            summary["commodity"]["cheapestRealmUnitPrice"] = cheapest["minUnitPrice"]
+            summary["commodity"]["cheapestRealmId"] = cheapest["realmId"]
+    return summary
+
+def format_depth(entry):
+    """One line of order book depth (see order_book_depth), or '' if none was asked for."""
+    parts = []
+    if "costToBuy" in entry:
+        cost = entry["costToBuy"]
+        parts.append(f"{cost['units']} units for {format_price(cost['cost'])} ({format_price(cost['cost'] / cost['units'])}/unit)"
+                     if cost else "not enough units listed")
+    if "unitsBelow" in entry:
+        parts.append(f"{entry['unitsBelow']} units below the price")
+    return ", ".join(parts)
+
+def print_price_summary(item_id, summary):
+    print(f"\nSearching for Item ID: {item_id}...")
+    if summary is None:
+        print(f"-> No active buyout auctions found for Item ID {item_id}.")
+        return
+    if summary["itemName"]:
+        print(f"-> {summary['itemName']} ({summary['quality']})")
+
+    overall = summary["overall"]
+    if overall:
+        print(f"-> Found {overall['listings']} active auctions for this item across {overall['realmCount']} realms.")
+        print("-" * 120)
+        print(f"  {'Realm':<24} | {'Lowest':>16} | {'25th pct':>16} | {'Median':>16} | {'75th pct':>16} | {'Avg/unit':>16} | {'Listed':>6}")
+        for realm in summary["realms"]:
+            realm_label = (realm["realmName"] or f"Realm ID {realm['realmId']}")[:24]
+            print(f"  {realm_label:<24} | {format_price(realm['min']):>16} | {format_price(realm['p25']):>16} | "
+                  f"{format_price(realm['median']):>16} | {format_price(realm['p75']):>16} | "
+                  f"{format_price(realm['weightedUnitAverage']):>16} | "
+                  f"{realm['listings']:>6}")
+            if format_depth(realm):
+                print(f"  {'':<24}   -> {format_depth(realm)}")
+
+        print("-" * 120)
         print("Price Analysis:")
-        print(f"  Lowest Price:  {format_price(min_price)}")
-        print(f"  Highest Price: {format_price(max_price)}")
-        print(f"  Average Price: {format_price(avg_price)}")
+        print(f"  Lowest Price:  {format_price(overall['min'])}")
+        print(f"  Highest Realm Minimum: {format_price(overall['max'])}")
+        print(f"  Median Realm Minimum:  {format_price(overall['medianOfRealmMinimums'])}")
+        print(f"  Average Price per Unit (quantity-weighted): {format_price(overall['weightedUnitAverage'])}")
         print("-" * 40)
 
+    commodity = summary["commodity"]
+    if commodity:
+        print("Region Commodity Market:")
+        print(f"  Lowest Unit Price: {format_price(commodity['minUnitPrice'])}")
+        print(f"  Units Listed:      {commodity['unitsListed']} across {commodity['priceLevels']} price levels")
+        if format_depth(commodity):
+            print(f"  Order Book:        {format_depth(commodity)}")
+        if commodity.get("cheapestRealmUnitPrice"):
+            print(f"  Cheapest Realm Unit Price: {format_price(commodity['cheapestRealmUnitPrice'])} "
+                  f"(Realm {commodity['cheapestRealmId']}), "
+                  f"commodity is {commodity['minUnitPrice'] / commodity['cheapestRealmUnitPrice']:.2f}x that")
+        print("-" * 40)
 
+def analyze_item_prices(item_id):
+    """Queries the database for a specific item and prints a price analysis."""
+    conn = None
+    try:
+        conn = setup_database.connect(DB_FILE, read_only=True)
+        print_price_summary(item_id, item_price_summary(conn, item_id))
     except sqlite3.Error as e:
         print(f"Database error: {e}")
     finally:
         if conn:
             conn.close()
 
-if __name__ == "__main__":
+def read_item_ids(values, file_path=None):
+    """Item ids from the command line and/or a file (whitespace or comma separated, '-' for stdin)."""
+    tokens = list(values)
+    if file_path:
+        with (sys.stdin if file_path == "-" else open(file_path)) as f:
+            tokens.extend(f.read().replace(",", " ").split())
+    item_ids = []
+    for token in tokens:
+        if not token.isdigit():
+            raise ValueError(f"Invalid item ID: {token}")
+        item_ids.append(int(token))
+    return item_ids
+
+def analyze_items_batch(item_ids, as_json=False, units=None, below=None):
+    """Looks up many items over one connection; prints a report per item or a single JSON array."""
+    conn = None
+    try:
+        conn = setup_database.connect(DB_FILE, read_only=True)
+        summaries = [(item_id, item_price_summary(conn, item_id, units, below)) for item_id in item_ids]
+    except sqlite3.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+    if as_json:
+        json.dump([summary or {"itemId": item_id, "realms": [], "overall": None, "commodity": None}
+                   for item_id, summary in summaries], sys.stdout, indent=2)
+        print()
+    else:
+        for item_id, summary in summaries:
+            print_price_summary(item_id, summary)
+    return True
+
+def interactive():
     try:
         while True:
             user_input = input("Enter the Item ID to search for (or type 'exit' to quit): ")
@@ -79,4 +238,28 @@ if __name__ == "__main__":
             else:
                 print("Invalid input. Please enter a number.")
     except KeyboardInterrupt:
-        print("\nExiting program.")
\ No newline at end of file
+        print("\nExiting program.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Price distribution of items across realms and the commodity market.")
+    parser.add_argument("item_ids", nargs="*", help="Item IDs to look up; prompts for them when none are given")
+    parser.add_argument("--file", help="Read item IDs from this file ('-' for stdin)")
+    parser.add_argument("--json", action="store_true", help="Print one JSON array instead of reports")
+    parser.add_argument("--region", default=setup_database.DEFAULT_REGION, help="Region whose database to read")
+    parser.add_argument("--units", type=int, help="Also show what buying this many units costs on every market")
+    parser.add_argument("--below", type=float, help="Also show how many units are listed below this price per unit (gold)")
+    args = parser.parse_args()
+    DB_FILE = setup_database.db_file_for_region(args.region)
+
+    if args.units is not None and args.units < 1:
+        parser.error("--units must be at least 1")
+    if not args.item_ids and not args.file:
+        interactive()
+    else:
+        try:
+            item_ids = read_item_ids(args.item_ids, args.file)
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        below = round(args.below * 10000) if args.below is not None else None
+        if not analyze_items_batch(item_ids, args.json, args.units, below):
+            sys.exit(1)
@@ -1,40 +1,115 @@
-from dotenv import load_dotenv
+import argparse
 import os
 import requests
 import sqlite3
-from datetime import datetime
+import setup_database
+import price_history
+import ijson
+import json
+import metrics
+import deal_worker
+import snapshot_archive
+from blizzard_api import REQUESTS_PER_HOUR, REQUESTS_PER_SECOND, BlizzardClient, RateLimiter
+from datetime import datetime, timedelta
 import time
-
-load_dotenv()
+import queue
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("SECRET_KEY")
-region = 'eu'
-namespace = f'dynamic-{region}'
-STATIC_NAMESPACE = f'static-{region}' # For item data
 locale = 'en_US'
-DB_FILE = "wow_auctions.db"
+# Regions come from the command line (default: setup_database.REGIONS); each has its own database
 
-def get_access_token():
-    """Gets an access token from the Blizzard API."""
-    token_url = f'https://{region}.oauth.battle.net/token'
-    payload = {'grant_type': 'client_credentials'}
-    try:
-        response = requests.post(token_url, data=payload, auth=(client_id, client_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
-    except requests.exceptions.RequestException as err:
-        print(f"Error obtaining token: {err}")
-        return None
+# --- Fetch engine settings ---
+# Rate limiting, retries and token refresh are handled by blizzard_api.BlizzardClient
+MAX_WORKERS = int(os.getenv("SCANNER_WORKERS", "8"))  # Parallel realm downloads
+
+# Auctions are streamed from the response and handed to the DB writer in batches of this size,
+# so scanner memory is bounded by batch size rather than by the size of the largest realm.
+BATCH_SIZE = 5000
+
+# Region-wide commodities (stackable goods) are fetched alongside the realms
+SCAN_COMMODITIES = os.getenv("SCANNER_COMMODITIES", "1") != "0"
+COMMODITIES = 'commodities'  # Stands in for a realm id in worker messages
+
+# Append per-(item, realm) aggregates of every sweep to the columnar price history
+RECORD_HISTORY = os.getenv("SCANNER_HISTORY", "1") != "0"
+
+# Keep a gzipped, content-addressed copy of every downloaded dump (see snapshot_archive.py), so
+# sweeps can be re-ingested offline with --replay
+ARCHIVE_RAW = os.getenv("SCANNER_ARCHIVE", "0") != "0"
+
+# Item metadata lookups run as a separate stage after all realms are stored
+ITEM_WORKERS = int(os.getenv("SCANNER_ITEM_WORKERS", "16"))
+ITEM_COMMIT_INTERVAL = 500  # Items written per transaction while resolving
+ITEM_FAILURE_TTL_HOURS = 24  # Failed lookups are retried after this long
+
+# Diff each new realm snapshot against the stored one instead of deleting and re-inserting it
+INCREMENTAL_UPDATES = os.getenv("SCANNER_INCREMENTAL", "1") != "0"
+
+# A realm whose download keeps failing keeps its last snapshot this long after it was last saved or
+# found unchanged, then its auctions are dropped like those of a realm that left the index
+STALE_REALM_HOURS = float(os.getenv("SCANNER_STALE_REALM_HOURS", "24"))
+
+# Print a JSON line with per-stage timings for every realm and for the sweep, next to the usual output.
+# The sweep summary is also stored in scan_metadata for the web app's /metrics route.
+STRUCTURED_LOGS = os.getenv("SCANNER_STRUCTURED_LOGS", "1") != "0"
+
+# Each realm's fresh snapshot is loaded here first, then merged into `auctions`
+CREATE_STAGING_TABLE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS auctions_staging (
+    id INTEGER PRIMARY KEY,
+    item_id INTEGER NOT NULL,
+    connected_realm_id INTEGER NOT NULL,
+    buyout_price INTEGER,
+    quantity INTEGER NOT NULL,
+    time_left TEXT NOT NULL,
+    scan_timestamp DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS temp.idx_auctions_staging_realm ON auctions_staging (connected_realm_id);
+"""
+
+
+def log_event(event, **fields):
+    if STRUCTURED_LOGS:
+        metrics.log_event(event, **fields)
+
+def add_timing(timings, stage, start):
+    """Adds the time since `start` (a perf_counter value) to `timings[stage]`, if timings are being kept."""
+    if timings is not None:
+        timings[stage] += time.perf_counter() - start
 
-def get_all_realm_ids(token):
+class TimedReader:
+    """File-like wrapper around a streamed response body that measures the time spent waiting for data.
+
+    If an `archive` (a snapshot_archive.DumpWriter) is given, every byte read is also written to it.
+    """
+
+    def __init__(self, raw, archive=None):
+        self.raw = raw
+        self.archive = archive
+        self.seconds = 0.0
+        self.archive_seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.raw.read(size)
+        self.seconds += time.perf_counter() - start
+        if self.archive is not None and data:
+            start = time.perf_counter()
+            self.archive.write(data)
+            self.archive_seconds += time.perf_counter() - start
+        return data
+
+    def read_rest(self):
+        """Reads whatever the parser left of the body, so the archived copy is complete."""
+        while self.read(1 << 16):
+            pass
+
+def get_all_realm_ids(client):
     """Gets a list of all connected realm IDs."""
-    realms_url = f'https://{region}.api.blizzard.com/data/wow/connected-realm/index'
-    headers = {'Authorization': f'Bearer {token}', 'Battlenet-Namespace': namespace}
-    params = {'locale': locale}
     try:
-        response = requests.get(realms_url, headers=headers, params=params)
+        response = client.get('/data/wow/connected-realm/index', client.dynamic_namespace, {'locale': locale})
         response.raise_for_status()
         realms_data = response.json().get('connected_realms', [])
         # Extract the ID from the href URL for each realm
@@ -43,169 +118,841 @@ def get_all_realm_ids(token):
         print(f"Error fetching realms: {err}")
         return []
 
-def get_item_details(item_id, access_token):
-    """Fetches item name, quality, and icon URL from Blizzard API."""
-    item_info_url = f'https://{region}.api.blizzard.com/data/wow/item/{item_id}'
-    item_media_url = f'https://{region}.api.blizzard.com/data/wow/media/item/{item_id}'
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Battlenet-Namespace': STATIC_NAMESPACE # Use static namespace for item data
-    }
-    params = {'locale': locale}
-
-    item_name = "Unknown Item"
-    item_quality = "COMMON" # Default quality
-    icon_url = ""
-
+def fetch_item_info(item_id, client):
+    """Fetches item name and quality. Returns None if the lookup failed."""
     try:
-        # Get item name and quality
-        response_info = requests.get(item_info_url, headers=headers, params=params)
-        if response_info.status_code == 200:
-            data_info = response_info.json()
-            item_name = data_info.get('name', item_name)
-            item_quality_data = data_info.get('quality', {})
-            item_quality = item_quality_data.get('type', item_quality).upper()
-        else:
+        # Use static namespace for item data
+        response_info = client.get(f'/data/wow/item/{item_id}', client.static_namespace, {'locale': locale})
+        if response_info.status_code != 200:
             print(f"Warning: Could not fetch item info for {item_id}. Status: {response_info.status_code}, Response: {response_info.text[:200]}")
+            return None
+        data_info = response_info.json()
+        item_quality = data_info.get('quality', {}).get('type', "COMMON").upper()
+        return data_info.get('name', "Unknown Item"), item_quality
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching details for item {item_id}: {e}")
+        return None
 
-        # Get item icon
-        response_media = requests.get(item_media_url, headers=headers, params=params)
-        if response_media.status_code == 200:
-            data_media = response_media.json()
-            if 'assets' in data_media and data_media['assets']:
-                for asset in data_media['assets']:
-                    if asset.get('key') == 'icon':
-                        icon_url = asset.get('value', '')
-                        break
-            # Fallback for some items that might have icon directly (less common with current API)
-            elif 'icon' in data_media:
-                 icon_url = data_media.get('icon', '')
-        else:
+def fetch_item_icon(item_id, client):
+    """Fetches an item's icon URL. Returns "" if the item has no icon or the lookup failed."""
+    try:
+        response_media = client.get(f'/data/wow/media/item/{item_id}', client.static_namespace, {'locale': locale})
+        if response_media.status_code != 200:
             print(f"Warning: Could not fetch item media for {item_id}. Status: {response_media.status_code}, Response: {response_media.text[:200]}")
-            
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching details for item {item_id}: {e}")
-    except Exception as e: # Catch other potential errors like JSONDecodeError
-        print(f"Unexpected error processing item {item_id}: {e}")
-        # You might want to see the response text if JSON decoding fails
-        if 'response_info' in locals() and response_info.status_code != 200:
-            print(f"Item info response text: {response_info.text[:200]}")
-        if 'response_media' in locals() and response_media.status_code != 200:
-            print(f"Item media response text: {response_media.text[:200]}")
-
-    return item_name, item_quality, icon_url
-
-def main():
-    print("Starting the WoW Auction House Scanner...")
-    
-    access_token = get_access_token()
-    if not access_token:
-        return
+            return ""
+        data_media = response_media.json()
+        if data_media.get('assets'):
+            for asset in data_media['assets']:
+                if asset.get('key') == 'icon':
+                    return asset.get('value', '')
+        # Fallback for some items that might have icon directly (less common with current API)
+        return data_media.get('icon', '')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching media for item {item_id}: {e}")
+        return ""
+
+def auction_buyout(auction):
+    """Buyout of the whole listing. Stackable goods only carry a per-unit price."""
+    buyout = auction.get('buyout')
+    if buyout is None and auction.get('unit_price') is not None:
+        buyout = auction['unit_price'] * auction['quantity']
+    return buyout
 
-    print("Successfully obtained access token.")
+def aggregate_commodities(body):
+    """Aggregates a commodities dump into a compact order book. Returns ({(item_id, unit_price): quantity}, auction_count)."""
+    price_levels = defaultdict(int)
+    auction_count = 0
+    for auction in ijson.items(body, 'auctions.item'):
+        price_levels[(auction['item']['id'], auction['unit_price'])] += auction['quantity']
+        auction_count += 1
+    return price_levels, auction_count
 
-    realm_ids = get_all_realm_ids(access_token)
-    if not realm_ids:
-        print("Could not retrieve realm list. Exiting.")
+def stream_realm_auctions(realm_id, body, scan_time, results):
+    """Parses a realm dump and puts ('batch', realm_id, rows) on `results` for every BATCH_SIZE auctions.
+
+    Returns (auction_count, item_ids, seconds spent waiting for the writer to take batches).
+    """
+    queue_wait = 0.0
+    batch = []
+    item_ids = set()
+    auction_count = 0
+    for auction in ijson.items(body, 'auctions.item'):
+        item_id = auction['item']['id']
+        item_ids.add(item_id)
+        batch.append((
+            auction['id'],
+            item_id,
+            realm_id,
+            auction_buyout(auction),
+            auction['quantity'],
+            auction['time_left'],
+            scan_time
+        ))
+        if len(batch) >= BATCH_SIZE:
+            auction_count += len(batch)
+            put_start = time.perf_counter()
+            results.put(('batch', realm_id, batch))
+            queue_wait += time.perf_counter() - put_start
+            batch = []
+    if batch:
+        auction_count += len(batch)
+        put_start = time.perf_counter()
+        results.put(('batch', realm_id, batch))
+        queue_wait += time.perf_counter() - put_start
+    return auction_count, item_ids, queue_wait
+
+def finish_archived_dump(body, stats, last_modified, fetched_at):
+    """Completes the archived copy of a parsed dump and records it in `stats['archived']`."""
+    if body.archive is None:
         return
-    
-    total_realms = len(realm_ids)
-    print(f"Found {total_realms} connected realms to scan.")
+    body.read_rest()
+    start = time.perf_counter()
+    stats['archived'] = {
+        'sha256': body.archive.commit(),
+        'last_modified': last_modified,
+        'fetched_at': fetched_at.isoformat(),
+    }
+    stats['stages']['archive'] = body.archive_seconds + time.perf_counter() - start
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    print("Connected to database. Clearing old auction data...")
-    cursor.execute("DELETE FROM auctions")
-    conn.commit()
-    print("Old data cleared.")
+def fetch_commodities_worker(client, last_modified, results, archive_dir=None):
+    """Pool worker: streams the region-wide commodities dump into a compact order book.
+
+    Commodity auctions are aggregated on the fly into {(item_id, unit_price): quantity}, which is a
+    small fraction of the size of the dump. Puts exactly one of ('commodities', COMMODITIES,
+    (price_levels, auction_count, last_modified, stats)), ('unchanged', COMMODITIES, last_modified)
+    or ('failed', COMMODITIES, error). `stats` is described in fetch_realm_worker.
+    """
+    archive = None
+    try:
+        request_start = time.perf_counter()
+        headers_commodities = {'If-Modified-Since': last_modified} if last_modified else None
+        commodities_response = client.get('/data/wow/auctions/commodities', client.dynamic_namespace,
+                                          headers=headers_commodities, stream=True)
+        request_seconds = time.perf_counter() - request_start
+        with commodities_response:
+            if commodities_response.status_code == 304:
+                results.put(('unchanged', COMMODITIES, last_modified))
+                return
+            commodities_response.raise_for_status()
+            commodities_response.raw.decode_content = True
+            archive = snapshot_archive.DumpWriter(archive_dir) if archive_dir else None
+            body = TimedReader(commodities_response.raw, archive)
+
+            stream_start = time.perf_counter()
+            fetched_at = datetime.now()
+            price_levels, auction_count = aggregate_commodities(body)
+            stats = {
+                'download_bytes': commodities_response.raw.tell(),
+                'stages': {
+                    'request': request_seconds,
+                    'download': body.seconds,
+                    'parse': time.perf_counter() - stream_start - body.seconds - body.archive_seconds,
+                },
+            }
+            new_last_modified = commodities_response.headers.get('Last-Modified')
+            finish_archived_dump(body, stats, new_last_modified, fetched_at)
+
+        results.put(('commodities', COMMODITIES, (price_levels, auction_count, new_last_modified, stats)))
+    except Exception as err:
+        if archive is not None:
+            archive.abort()
+        results.put(('failed', COMMODITIES, err))
+
+def fetch_realm_worker(realm_id, client, last_modified, results, archive_dir=None):
+    """Pool worker: streams one realm's auction dump to the DB writer.
+
+    Puts ('batch', realm_id, rows) for every BATCH_SIZE auctions parsed, then exactly one of
+    ('done', realm_id, (auction_count, item_ids, last_modified, stats)), ('unchanged', realm_id, last_modified)
+    or ('failed', realm_id, error). `stats` holds the compressed bytes downloaded and the seconds spent
+    waiting for the response headers ("request", including rate limiting and retries), waiting for the
+    body ("download"), decoding it ("parse") and waiting for the writer to take batches ("queue_wait").
+    With an `archive_dir`, the dump is also archived there ("archive"), and `stats['archived']`
+    describes it for the sweep manifest.
+    """
+    archive = None
+    try:
+        request_start = time.perf_counter()
+        headers_auctions = {'If-Modified-Since': last_modified} if last_modified else None
+        # Ensure correct namespace for auction calls
+        auctions_response = client.get(f'/data/wow/connected-realm/{realm_id}/auctions', client.dynamic_namespace,
+                                       headers=headers_auctions, stream=True)
+        request_seconds = time.perf_counter() - request_start
+        with auctions_response:
+            if auctions_response.status_code == 304:
+                results.put(('unchanged', realm_id, last_modified))
+                return
+            auctions_response.raise_for_status()
+            # Let urllib3 undo any gzip transfer encoding before ijson sees the bytes
+            auctions_response.raw.decode_content = True
+            archive = snapshot_archive.DumpWriter(archive_dir) if archive_dir else None
+            body = TimedReader(auctions_response.raw, archive)
+
+            stream_start = time.perf_counter()
+            scan_time = datetime.now()
+            auction_count, item_ids, queue_wait = stream_realm_auctions(realm_id, body, scan_time, results)
+            stats = {
+                # urllib3 counts the bytes read off the wire, before gzip decoding
+                'download_bytes': auctions_response.raw.tell(),
+                'stages': {
+                    'request': request_seconds,
+                    'download': body.seconds,
+                    'parse': time.perf_counter() - stream_start - body.seconds - body.archive_seconds - queue_wait,
+                    'queue_wait': queue_wait,
+                },
+            }
+            new_last_modified = auctions_response.headers.get('Last-Modified')
+            finish_archived_dump(body, stats, new_last_modified, scan_time)
+
+        results.put(('done', realm_id, (auction_count, item_ids, new_last_modified, stats)))
+    except Exception as err:
+        if archive is not None:
+            archive.abort()
+        results.put(('failed', realm_id, err))
+
+def replay_commodities_worker(archive_dir, dump, results):
+    """Pool worker for replays: like fetch_commodities_worker, but reads an archived dump."""
+    try:
+        with snapshot_archive.open_dump(archive_dir, dump['sha256']) as raw:
+            body = TimedReader(raw)
+            stream_start = time.perf_counter()
+            price_levels, auction_count = aggregate_commodities(body)
+            stats = {
+                'download_bytes': 0,
+                'stages': {'read': body.seconds, 'parse': time.perf_counter() - stream_start - body.seconds},
+            }
+        results.put(('commodities', COMMODITIES, (price_levels, auction_count, dump['last_modified'], stats)))
+    except Exception as err:
+        results.put(('failed', COMMODITIES, err))
+
+def replay_realm_worker(realm_id, archive_dir, dump, results):
+    """Pool worker for replays: like fetch_realm_worker, but reads an archived dump ("read" is the
+    time spent reading and decompressing it). Auctions keep the time they were originally fetched."""
+    try:
+        with snapshot_archive.open_dump(archive_dir, dump['sha256']) as raw:
+            body = TimedReader(raw)
+            stream_start = time.perf_counter()
+            auction_count, item_ids, queue_wait = stream_realm_auctions(
+                realm_id, body, datetime.fromisoformat(dump['fetched_at']), results)
+            stats = {
+                'download_bytes': 0,
+                'stages': {
+                    'read': body.seconds,
+                    'parse': time.perf_counter() - stream_start - body.seconds - queue_wait,
+                    'queue_wait': queue_wait,
+                },
+            }
+        results.put(('done', realm_id, (auction_count, item_ids, dump['last_modified'], stats)))
+    except Exception as err:
+        results.put(('failed', realm_id, err))
+
+def load_realm_last_modified(cursor):
+    """Returns {realm_id: Last-Modified header} for every realm ingested so far."""
+    try:
+        cursor.execute("SELECT connected_realm_id, last_modified FROM realm_snapshots")
+        return dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        print(f"Could not load realm snapshot times, will download every realm: {e}")
+        return {}
+
+def stage_auction_batch(cursor, rows, timings=None):
+    """Appends a batch of parsed auctions to the staging table in its own small transaction.
+
+    If a `timings` dict is given, the seconds spent are added to its "insert" and "commit" entries.
+    """
+    start = time.perf_counter()
+    cursor.execute("BEGIN")
+    cursor.executemany(
+        "INSERT OR REPLACE INTO auctions_staging (id, item_id, connected_realm_id, buyout_price, quantity, time_left, scan_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    add_timing(timings, 'insert', start)
+    start = time.perf_counter()
+    cursor.execute("COMMIT")
+    add_timing(timings, 'commit', start)
+
+def discard_staged_realm(cursor, realm_id):
+    """Drops whatever was staged for a realm whose download failed part-way."""
+    cursor.execute("DELETE FROM auctions_staging WHERE connected_realm_id = ?", (realm_id,))
+
+def apply_realm_snapshot(cursor, realm_id, incremental=INCREMENTAL_UPDATES):
+    """Merges the staged snapshot for `realm_id` into `auctions`. Returns (inserted, updated, deleted).
+
+    In incremental mode only vanished auctions are deleted, new ones inserted and changed ones
+    updated; auctions that are identical to the stored row aren't written at all.
+    """
+    if not incremental:
+        cursor.execute("DELETE FROM auctions WHERE connected_realm_id = ?", (realm_id,))
+        deleted = cursor.rowcount
+        cursor.execute("INSERT INTO auctions SELECT * FROM auctions_staging WHERE connected_realm_id = ?", (realm_id,))
+        return cursor.rowcount, 0, deleted
+
+    cursor.execute("""
+        DELETE FROM auctions
+        WHERE connected_realm_id = ?
+          AND id NOT IN (SELECT id FROM auctions_staging WHERE connected_realm_id = ?)
+    """, (realm_id, realm_id))
+    deleted = cursor.rowcount
+
+    cursor.execute("SELECT COUNT(*) FROM auctions WHERE connected_realm_id = ?", (realm_id,))
+    surviving = cursor.fetchone()[0]
+
+    # "WHERE" on the SELECT is also required by SQLite to parse an upsert on top of INSERT ... SELECT
+    cursor.execute("""
+        INSERT INTO auctions (id, item_id, connected_realm_id, buyout_price, quantity, time_left, scan_timestamp)
+        SELECT id, item_id, connected_realm_id, buyout_price, quantity, time_left, scan_timestamp
+        FROM auctions_staging WHERE connected_realm_id = ?
+        ON CONFLICT (id) DO UPDATE SET
+            item_id = excluded.item_id,
+            connected_realm_id = excluded.connected_realm_id,
+            buyout_price = excluded.buyout_price,
+            quantity = excluded.quantity,
+            time_left = excluded.time_left,
+            scan_timestamp = excluded.scan_timestamp
+        WHERE auctions.buyout_price IS NOT excluded.buyout_price
+           OR auctions.quantity != excluded.quantity
+           OR auctions.time_left != excluded.time_left
+           OR auctions.item_id != excluded.item_id
+           OR auctions.connected_realm_id != excluded.connected_realm_id
+    """, (realm_id,))
+    written = cursor.rowcount
 
-    # Load existing item IDs from the items table to avoid re-fetching known items
-    processed_item_ids = set()
+    cursor.execute("SELECT COUNT(*) FROM auctions WHERE connected_realm_id = ?", (realm_id,))
+    inserted = cursor.fetchone()[0] - surviving
+    return inserted, written - inserted, deleted
+
+def confirm_realm_snapshot(cursor, realm_id):
+    """Records that a realm's stored snapshot is still current (the API answered 304)."""
+    cursor.execute("UPDATE realm_snapshots SET scan_timestamp = ? WHERE connected_realm_id = ?", (datetime.now(), realm_id))
+
+def remove_realms(cursor, realm_ids, stale_before):
+    """Deletes everything stored for realms that left the index `realm_ids`, and for realms whose
+    snapshot wasn't saved or confirmed since `stale_before`, in one transaction. Returns their ids.
+
+    Realms are found through their price summary and Last-Modified, which every stored realm has.
+    """
+    cursor.execute("BEGIN")
+    try:
+        stored = {realm_id for (realm_id,) in cursor.execute(
+            "SELECT connected_realm_id FROM realm_snapshots UNION SELECT connected_realm_id FROM realm_min_prices"
+        )}
+        stale = {realm_id for (realm_id,) in cursor.execute(
+            "SELECT connected_realm_id FROM realm_snapshots WHERE scan_timestamp < ?", (stale_before,)
+        )}
+        removed = sorted((stored - set(realm_ids)) | stale)
+        for table in ("auctions", "realm_min_prices", "order_books", "realm_snapshots"):
+            cursor.executemany(f"DELETE FROM {table} WHERE connected_realm_id = ?", ((realm_id,) for realm_id in removed))
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return removed
+
+def load_resolved_item_ids(cursor):
+    """Returns (resolved, retry): ids that don't need a lookup (known items and failures still within
+    their TTL) and ids whose failed lookup has expired and should be retried this sweep.
+    """
+    resolved = set()
+    retry = set()
     try:
-        cursor.execute("SELECT item_id FROM items")
-        for row in cursor.fetchall():
-            processed_item_ids.add(row[0])
-        print(f"Loaded {len(processed_item_ids)} existing item IDs from item cache.")
+        # "Unknown Item" rows are left over from failed lookups of older versions; retry them
+        cursor.execute("SELECT item_id FROM items WHERE name != 'Unknown Item'")
+        resolved.update(row[0] for row in cursor.fetchall())
+        print(f"Loaded {len(resolved)} existing item IDs from item cache.")
+        retry_after = datetime.now() - timedelta(hours=ITEM_FAILURE_TTL_HOURS)
+        cursor.execute("SELECT item_id FROM item_lookup_failures WHERE last_attempt > ?", (retry_after,))
+        recent_failures = [row[0] for row in cursor.fetchall()]
+        resolved.update(recent_failures)
+        print(f"Skipping {len(recent_failures)} items whose lookup failed in the last {ITEM_FAILURE_TTL_HOURS} hours.")
+        # Retried even if no realm listing them changed since the last sweep
+        cursor.execute("SELECT item_id FROM item_lookup_failures WHERE last_attempt <= ?", (retry_after,))
+        retry.update(row[0] for row in cursor.fetchall())
     except sqlite3.Error as e:
         print(f"Could not load existing items, will fetch all: {e}")
+    return resolved, retry
+
+def resolve_item_details(cursor, item_ids, client):
+    """Looks up every item in `item_ids` concurrently and stores the results.
+
+    The item and media requests of all items are queued on the pool together, so both run in
+    parallel. Failed lookups are recorded in `item_lookup_failures` and retried once
+    ITEM_FAILURE_TTL_HOURS have passed, instead of being cached as "Unknown Item" forever.
+    Returns (resolved, failed) counts.
+    """
+    if not item_ids:
+        return 0, 0
+    print(f"\nResolving details for {len(item_ids)} new items...")
+    resolved = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=ITEM_WORKERS) as executor:
+        lookups = [
+            (item_id, executor.submit(fetch_item_info, item_id, client), executor.submit(fetch_item_icon, item_id, client))
+            for item_id in sorted(item_ids)
+        ]
+        for start in range(0, len(lookups), ITEM_COMMIT_INTERVAL):
+            items_to_cache = []
+            failures = []
+            for item_id, info_future, icon_future in lookups[start:start + ITEM_COMMIT_INTERVAL]:
+                info = info_future.result()
+                icon_url = icon_future.result()
+                if info is None:
+                    failures.append((item_id, datetime.now()))
+                else:
+                    items_to_cache.append((item_id, info[0], info[1], icon_url))
+
+            cursor.execute("BEGIN")
+            cursor.executemany(
+                "INSERT OR REPLACE INTO items (item_id, name, quality, icon_url) VALUES (?, ?, ?, ?)",
+                items_to_cache
+            )
+            cursor.executemany("DELETE FROM item_lookup_failures WHERE item_id = ?", [(row[0],) for row in items_to_cache])
+            cursor.executemany("""
+                INSERT INTO item_lookup_failures (item_id, attempts, last_attempt) VALUES (?, 1, ?)
+                ON CONFLICT (item_id) DO UPDATE SET attempts = attempts + 1, last_attempt = excluded.last_attempt
+            """, failures)
+            cursor.execute("COMMIT")
+            resolved += len(items_to_cache)
+            failed += len(failures)
+            print(f"Resolved {resolved + failed}/{len(lookups)} items ({failed} failed).")
+    return resolved, failed
+
+def save_realm_snapshot(cursor, realm_id, last_modified, timings=None):
+    """Merges a fully staged realm into `auctions`. Must only run on the writer thread.
+
+    The merge, the realm's price summary and its new Last-Modified are written in a single
+    transaction, so readers never see a half-written realm and a realm is only marked as up to
+    date once its auctions are actually stored. Timings are kept as in stage_auction_batch.
+    """
+    start = time.perf_counter()
+    cursor.execute("BEGIN")
+    try:
+        inserted, updated, deleted = apply_realm_snapshot(cursor, realm_id)
+        setup_database.refresh_realm_summaries(cursor, realm_id)
+        if last_modified:
+            cursor.execute(
+                "INSERT OR REPLACE INTO realm_snapshots (connected_realm_id, last_modified, scan_timestamp) VALUES (?, ?, ?)",
+                (realm_id, last_modified, datetime.now())
+            )
+        add_timing(timings, 'insert', start)
+        start = time.perf_counter()
+        cursor.execute("COMMIT")
+        add_timing(timings, 'commit', start)
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return inserted, updated, deleted
+
+def save_commodity_order_book(cursor, price_levels, last_modified, timings=None):
+    """Replaces the region's commodity order book in one transaction. Must only run on the writer thread."""
+    start = time.perf_counter()
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute("DELETE FROM commodity_price_levels")
+        cursor.executemany(
+            "INSERT INTO commodity_price_levels (item_id, unit_price, quantity) VALUES (?, ?, ?)",
+            ((item_id, unit_price, quantity) for (item_id, unit_price), quantity in sorted(price_levels.items()))
+        )
+        if last_modified:
+            cursor.execute("""
+                INSERT INTO scan_metadata (key, value) VALUES ('commodities_last_modified', ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            """, (last_modified,))
+        add_timing(timings, 'insert', start)
+        start = time.perf_counter()
+        cursor.execute("COMMIT")
+        add_timing(timings, 'commit', start)
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+def load_commodities_last_modified(cursor):
+    try:
+        row = cursor.execute("SELECT value FROM scan_metadata WHERE key = 'commodities_last_modified'").fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+def bump_snapshot_version(cursor, snapshot_at=None, replayed_sweep=None):
+    """Tells readers (e.g. deal_worker.py) that a new snapshot has been committed, and when (default: now).
+
+    `replayed_sweep` is the start time of the archived sweep a replay ingested; a live scan clears it,
+    so replays can tell a database they built from one the scanner keeps up to date.
+    """
+    cursor.execute("""
+        INSERT INTO scan_metadata (key, value) VALUES ('snapshot_version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    """)
+    cursor.execute("""
+        INSERT INTO scan_metadata (key, value) VALUES ('snapshot_at', ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (snapshot_at or time.time(),))
+    if replayed_sweep:
+        cursor.execute("""
+            INSERT INTO scan_metadata (key, value) VALUES ('replayed_sweep', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """, (replayed_sweep,))
+    else:
+        cursor.execute("DELETE FROM scan_metadata WHERE key = 'replayed_sweep'")
+
+def holds_live_scan(db_file):
+    """True if the database's current snapshot came from a live scan rather than a replay."""
+    if not os.path.exists(db_file):
+        return False
+    conn = setup_database.connect(db_file, read_only=True)
+    try:
+        rows = dict(conn.execute(
+            "SELECT key, value FROM scan_metadata WHERE key IN ('snapshot_version', 'replayed_sweep')"
+        ).fetchall())
+    except sqlite3.Error:
+        return False  # No scan_metadata yet, so nothing was scanned into it
+    finally:
+        conn.close()
+    return 'snapshot_version' in rows and 'replayed_sweep' not in rows
+
+def save_sweep_metrics(cursor, sweep):
+    """Stores the summary of the finished sweep for the web app's /metrics route."""
+    cursor.execute("""
+        INSERT INTO scan_metadata (key, value) VALUES ('last_sweep_metrics', ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (json.dumps(sweep),))
+
+def realm_metrics(stats, timings, auction_count):
+    """Combines a worker's download stats with the writer's timings of one realm (or the commodities)."""
+    stages = dict(stats['stages'])
+    stages.update(timings)
+    return {
+        'auctions': auction_count,
+        'download_bytes': stats['download_bytes'],
+        'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+    }
+
+def scan_region(region, bulk_load=False, rate_limiter=None, replay=None, db_file=None, history_dir=None):
+    """Runs one sweep of a region into its database.
+
+    With `replay`, a sweep manifest from snapshot_archive.load_sweep, the sweep's archived dumps are
+    ingested instead of downloading anything, as if they had just been fetched. `db_file` and
+    `history_dir` default to the region's.
+    """
+    archive_dir = snapshot_archive.archive_dir_for_region(region)
+    if replay:
+        print(f"Replaying the {region} sweep of {replay['started_at']:%Y-%m-%d %H:%M:%S} from {archive_dir}...")
+        client = None
+        realm_ids = [realm_id for realm_id in replay['dumps'] if realm_id != COMMODITIES]
+    else:
+        print(f"Starting the WoW Auction House Scanner for region {region}...")
+
+        client = BlizzardClient(region, pool_size=max(MAX_WORKERS, ITEM_WORKERS), rate_limiter=rate_limiter)
+        if not client.get_token():
+            return
+
+        print("Successfully obtained access token.")
+
+        realm_ids = get_all_realm_ids(client)
+        if not realm_ids:
+            print("Could not retrieve realm list. Exiting.")
+            return
+
+    total_realms = len(realm_ids)
+    print(f"Found {total_realms} connected realms to scan.")
+
+    # Transactions are managed explicitly: staged batches of one realm must survive
+    # a rollback caused by another realm.
+    db_file = db_file or setup_database.db_file_for_region(region)
+    conn = setup_database.connect(db_file, isolation_level=None)
+    for migration in setup_database.migrate(conn):
+        print(f"Applied {migration.__name__}: {migration.__doc__}")
+    cursor = conn.cursor()
+    cursor.executescript(CREATE_STAGING_TABLE_SQL)
+    print("Connected to database.")
+    if bulk_load:
+        setup_database.drop_bulk_load_indexes(conn)
+        print("Bulk load: dropped reader-only indexes, they are rebuilt after the sweep.")
 
+    realm_last_modified = load_realm_last_modified(cursor)
+    commodities_last_modified = load_commodities_last_modified(cursor)
 
-    for i, realm_id in enumerate(realm_ids):
-        print(f"\n[{i+1}/{total_realms}] Scanning Realm ID: {realm_id}...")
-        
+    # Item ids we already have details for (or recently failed to get), to avoid re-fetching them
+    resolved_item_ids, unknown_item_ids = load_resolved_item_ids(cursor)
+
+    # Realms are streamed by a pool of workers and handed to this thread in batches; it is
+    # the only one touching the database. The queue is bounded so parsed batches can't pile
+    # up in memory faster than we can write them.
+    results = queue.Queue(maxsize=MAX_WORKERS * 2)
+    sweep_start = time.time()
+    sweep_started_at = datetime.now()
+    archived_dumps = {}  # Manifest entries of the dumps archived this sweep
+    # Per-realm writer timings ("insert", "commit"), merged with the worker's stats once a realm is saved
+    writer_timings = defaultdict(lambda: defaultdict(float))
+    realms_metrics = {}
+    realm_outcomes = defaultdict(int)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # The commodities dump is by far the largest download, so start it first
+        if replay:
+            commodities_pending = COMMODITIES in replay['dumps']
+            if commodities_pending:
+                executor.submit(replay_commodities_worker, archive_dir, replay['dumps'][COMMODITIES], results)
+            for realm_id in realm_ids:
+                executor.submit(replay_realm_worker, realm_id, archive_dir, replay['dumps'][realm_id], results)
+        else:
+            commodities_pending = SCAN_COMMODITIES
+            worker_archive_dir = archive_dir if ARCHIVE_RAW else None
+            if SCAN_COMMODITIES:
+                executor.submit(fetch_commodities_worker, client, commodities_last_modified, results, worker_archive_dir)
+            for realm_id in realm_ids:
+                executor.submit(fetch_realm_worker, realm_id, client, realm_last_modified.get(realm_id), results,
+                                worker_archive_dir)
+
+        finished_realms = 0
+        unchanged_realms = 0
+        saved_snapshots = 0
+        broken_realms = set()  # Realms with a batch we failed to stage; never apply them partially
+        while finished_realms < total_realms or commodities_pending:
+            kind, realm_id, payload = results.get()
+            try:
+                if kind == 'batch':
+                    if realm_id not in broken_realms:
+                        stage_auction_batch(cursor, payload, writer_timings[realm_id])
+                    continue
+
+                if realm_id == COMMODITIES:
+                    commodities_pending = False
+                    print("\nProcessing region commodities...")
+                    if kind == 'failed':
+                        print(f"Could not fetch commodities. Error: {payload}")
+                        log_event('commodities_failed', region=region, error=str(payload))
+                    elif kind == 'unchanged':
+                        print(f"Commodities unchanged since {payload}, skipping.")
+                    else:
+                        price_levels, auction_count, last_modified, stats = payload
+                        if 'archived' in stats:
+                            archived_dumps[COMMODITIES] = stats.pop('archived')
+                        save_commodity_order_book(cursor, price_levels, last_modified, writer_timings[COMMODITIES])
+                        unknown_item_ids.update({item_id for item_id, _ in price_levels} - resolved_item_ids)
+                        saved_snapshots += 1
+                        print(f"Saved {auction_count} commodity auctions as {len(price_levels)} price levels.")
+                        realms_metrics[COMMODITIES] = realm_metrics(stats, writer_timings.pop(COMMODITIES), auction_count)
+                        log_event('commodities_saved', region=region, price_levels=len(price_levels), **realms_metrics[COMMODITIES])
+                    continue
+
+                finished_realms += 1
+                print(f"\n[{finished_realms}/{total_realms}] Processing Realm ID: {realm_id}...")
+                if realm_id in broken_realms:
+                    discard_staged_realm(cursor, realm_id)
+                    realm_outcomes['failed'] += 1
+                    print(f"Skipping realm {realm_id}, its auctions could not be staged.")
+                    log_event('realm_failed', region=region, realm=realm_id, error="staging failed")
+                elif kind == 'failed':
+                    discard_staged_realm(cursor, realm_id)
+                    realm_outcomes['failed'] += 1
+                    print(f"Could not fetch data for realm {realm_id}. Error: {payload}")
+                    log_event('realm_failed', region=region, realm=realm_id, error=str(payload))
+                elif kind == 'unchanged':
+                    print(f"Realm unchanged since {payload}, skipping.")
+                    confirm_realm_snapshot(cursor, realm_id)
+                    unchanged_realms += 1
+                    realm_outcomes['unchanged'] += 1
+                else:
+                    auction_count, item_ids, last_modified, stats = payload
+                    if 'archived' in stats:
+                        archived_dumps[realm_id] = stats.pop('archived')
+                    print(f"Found {auction_count} auctions.")
+                    unknown_item_ids.update(item_ids - resolved_item_ids)
+                    timings = writer_timings[realm_id]
+                    inserted, updated, deleted = save_realm_snapshot(cursor, realm_id, last_modified, timings)
+                    discard_staged_realm(cursor, realm_id)
+                    saved_snapshots += 1
+                    realm_outcomes['saved'] += 1
+                    print(f"Saved {auction_count} auctions: {inserted} new, {updated} changed, {deleted} removed.")
+                    realms_metrics[realm_id] = realm_metrics(stats, timings, auction_count)
+                    log_event('realm_saved', region=region, realm=realm_id, inserted=inserted, updated=updated, deleted=deleted,
+                              **realms_metrics[realm_id])
+                writer_timings.pop(realm_id, None)
+            except sqlite3.Error as err:
+                if kind == 'batch':
+                    broken_realms.add(realm_id)
+                    if conn.in_transaction:
+                        cursor.execute("ROLLBACK")
+                print(f"Database error for realm {realm_id}. Error: {err}")
+            except Exception as e:
+                print(f"An unexpected error occurred processing realm {realm_id}: {e}")
+
+    print(f"\nSweep of {total_realms} realms took {time.time() - sweep_start:.1f} seconds "
+          f"({unchanged_realms} unchanged since the last scan).")
+
+    # Replayed sweeps only hold the realms that changed, so only a live sweep knows which realms are gone
+    removed_realms = []
+    if not replay:
         try:
-            auctions_url = f'https://{region}.api.blizzard.com/data/wow/connected-realm/{realm_id}/auctions'
-            # Ensure correct namespace for auction calls
-            headers_auctions = {'Authorization': f'Bearer {access_token}', 'Battlenet-Namespace': namespace}
-            auctions_response = requests.get(auctions_url, headers=headers_auctions)
-            auctions_response.raise_for_status()
-            
-            auctions_data = auctions_response.json().get('auctions', [])
-            print(f"Found {len(auctions_data)} auctions.")
-            
-            if not auctions_data:
-                print("No auctions found for this realm, skipping.")
-                continue
+            removed_realms = remove_realms(cursor, realm_ids, datetime.now() - timedelta(hours=STALE_REALM_HOURS))
+        except sqlite3.Error as err:
+            print(f"Could not remove realms that left the index. Error: {err}")
+        if removed_realms:
+            print(f"Removed {len(removed_realms)} realms that left the index or failed for {STALE_REALM_HOURS:g} hours: "
+                  f"{', '.join(map(str, removed_realms))}.")
+            log_event('realms_removed', region=region, realms=removed_realms)
 
-            scan_time = datetime.now()
-            auctions_to_insert = []
-            items_to_cache_in_this_batch = [] # Items to add/update in the items table
-
-            unique_item_ids_in_batch = set()
-            for auction in auctions_data:
-                unique_item_ids_in_batch.add(auction['item']['id'])
-
-            for item_id_from_auction in unique_item_ids_in_batch:
-                if item_id_from_auction not in processed_item_ids:
-                    print(f"New item ID {item_id_from_auction} found. Fetching details...")
-                    name, quality, icon = get_item_details(item_id_from_auction, access_token)
-                    items_to_cache_in_this_batch.append((item_id_from_auction, name, quality, icon))
-                    processed_item_ids.add(item_id_from_auction) # Mark as processed (attempted to fetch)
-
-            # Bulk insert/update item details (IGNORE if item_id already exists)
-            if items_to_cache_in_this_batch:
-                cursor.executemany(
-                    "INSERT OR IGNORE INTO items (item_id, name, quality, icon_url) VALUES (?, ?, ?, ?)",
-                    items_to_cache_in_this_batch
-                )
-                conn.commit() 
-                print(f"Cached/updated details for {len(items_to_cache_in_this_batch)} items.")
-            
-            # Prepare auction data for insertion
-            for auction in auctions_data:
-                auctions_to_insert.append((
-                    auction['id'],
-                    auction['item']['id'],
-                    realm_id,
-                    auction.get('buyout'), 
-                    auction['quantity'],
-                    auction['time_left'],
-                    scan_time
-                ))
-
-            # Bulk insert the auction data for this realm
-            if auctions_to_insert:
-                cursor.executemany(
-                    "INSERT INTO auctions (id, item_id, connected_realm_id, buyout_price, quantity, time_left, scan_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    auctions_to_insert
-                )
-                conn.commit()
-                print(f"Successfully saved {len(auctions_to_insert)} auctions to the database.")
-
-        except requests.exceptions.RequestException as err:
-            print(f"Could not fetch data for realm {realm_id}. Error: {err}")
-            time.sleep(2)
+    if archived_dumps:
+        try:
+            snapshot_archive.write_sweep_manifest(archive_dir, sweep_started_at, archived_dumps)
+            print(f"Archived {len(archived_dumps)} dumps in {archive_dir}.")
+        except OSError as err:
+            print(f"Could not write the sweep manifest. Error: {err}")
+
+    stage_seconds = defaultdict(float)
+    for realm in realms_metrics.values():
+        for stage, seconds in realm['stages'].items():
+            stage_seconds[stage] += seconds
+
+    if client:
+        items_start = time.perf_counter()
+        resolved_items = failed_items = 0
+        try:
+            resolved_items, failed_items = resolve_item_details(cursor, unknown_item_ids, client)
+        except sqlite3.Error as err:
+            print(f"Database error while storing item details. Error: {err}")
+        stage_seconds['item_resolution'] = time.perf_counter() - items_start
+        log_event('items_resolved', region=region, requested=len(unknown_item_ids), resolved=resolved_items, failed=failed_items,
+                  seconds=round(stage_seconds['item_resolution'], 4))
+    elif unknown_item_ids:
+        print(f"{len(unknown_item_ids)} items have no details yet; replays don't call the API, a regular scan will resolve them.")
+
+    # A replayed snapshot is dated when it was originally fetched
+    snapshot_time = replay['started_at'] if replay else datetime.now()
+    if saved_snapshots or removed_realms:
+        try:
+            bump_snapshot_version(cursor, snapshot_time.timestamp(), replay['started_at'].isoformat() if replay else None)
         except sqlite3.Error as err:
-            print(f"Database error for realm {realm_id}. Error: {err}")
-        except Exception as e:
-            print(f"An unexpected error occurred processing realm {realm_id}: {e}")
+            print(f"Could not bump the snapshot version. Error: {err}")
+
+    if (saved_snapshots or removed_realms) and RECORD_HISTORY:
+        history_start = time.perf_counter()
+        try:
+            history_dir = history_dir or price_history.history_dir_for_region(region)
+            history_rows = price_history.append_snapshot(conn, snapshot_time, history_dir)
+            rolled_up_days = price_history.roll_up(snapshot_time, history_dir=history_dir)
+            print(f"Recorded {history_rows} item/realm aggregates in the price history"
+                  f"{f', rolled up {rolled_up_days} days' if rolled_up_days else ''}.")
+        except (sqlite3.Error, OSError) as err:
+            print(f"Could not record price history. Error: {err}")
+        stage_seconds['history'] = time.perf_counter() - history_start
+
+    if bulk_load:
+        print("Rebuilding reader-only indexes...")
+        index_start = time.perf_counter()
+        setup_database.create_bulk_load_indexes(conn)
+        stage_seconds['index_rebuild'] = time.perf_counter() - index_start
+
+    sweep = {
+        'finished_at': time.time(),
+        'duration_seconds': round(time.time() - sweep_start, 3),
+        'realm_outcomes': dict(realm_outcomes),
+        'auctions': sum(realm['auctions'] for realm in realms_metrics.values()),
+        'download_bytes': sum(realm['download_bytes'] for realm in realms_metrics.values()),
+        'stages': {stage: round(seconds, 4) for stage, seconds in stage_seconds.items()},
+        'realms': {str(realm_id): realm for realm_id, realm in realms_metrics.items()},
+    }
+    if replay:
+        # /metrics describes the live scanner, so replays only log their summary
+        log_event('replay_finished', region=region, replayed_sweep=replay['started_at'].isoformat(),
+                  **{key: value for key, value in sweep.items() if key != 'realms'})
+        conn.close()
+        print(f"Replayed {saved_snapshots} dumps into '{db_file}'.")
+        return
 
+    sweep.update(client.stats())
+    log_event('sweep_finished', region=region, **{key: value for key, value in sweep.items() if key != 'realms'})
+    try:
+        save_sweep_metrics(cursor, sweep)
+    except sqlite3.Error as err:
+        print(f"Could not store sweep metrics. Error: {err}")
 
     conn.close()
     print("\n---------------------------------")
-    print("Scanner finished. All realms have been processed.")
-    print("Your database 'wow_auctions.db' is now populated with fresh data, including item details.")
+    print(f"Scanner finished. All realms of region {region} have been processed.")
+    print(f"Your database '{db_file}' is now populated with fresh data, including item details.")
+
+def replay_paths(region, workdir=None):
+    """Returns the (database, history directory) a replay of `region` writes: the region's own, or
+    fresh ones under `workdir`."""
+    if workdir is None:
+        return setup_database.db_file_for_region(region), price_history.history_dir_for_region(region)
+    return (os.path.join(workdir, setup_database.DB_FILE_TEMPLATE.format(region=region)),
+            os.path.join(workdir, price_history.HISTORY_DIR, region))
+
+def replay_region(region, since=None, until=None, bulk_load=False, after_sweep=None, workdir=None, force=False):
+    """Re-ingests a region's archived sweeps between `since` and `until`, oldest first, at disk speed.
+
+    After every sweep the deal candidates are recomputed (see deal_worker.py) and `after_sweep(sweep)`
+    is called, so deal settings can be backtested against each snapshot in turn. The database and
+    price history are written under `workdir` (default: the region's own); a database kept up to
+    date by the live scanner is only replayed into with `force`. Replaying into an empty directory
+    rebuilds the database from the archive; `bulk_load` applies to the first sweep.
+    Returns the number of sweeps replayed.
+    """
+    db_file, history_dir = replay_paths(region, workdir)
+    if holds_live_scan(db_file) and not force:
+        print(f"'{db_file}' holds a live scan of region {region}; replay into another directory with --workdir, "
+              f"or pass --force to overwrite it.")
+        return 0
+    sweeps = snapshot_archive.list_sweeps(snapshot_archive.archive_dir_for_region(region), since, until)
+    if not sweeps:
+        print(f"No archived sweeps of region {region} to replay.")
+        return 0
+    if workdir is not None:
+        os.makedirs(workdir, exist_ok=True)
+    print(f"Replaying {len(sweeps)} archived sweeps of region {region} into '{db_file}'...")
+    for index, (_, path) in enumerate(sweeps):
+        sweep = snapshot_archive.load_sweep(path)
+        scan_region(region, bulk_load and index == 0, replay=sweep, db_file=db_file, history_dir=history_dir)
+        deal_worker.refresh_region(region, db_file=db_file)
+        if after_sweep:
+            after_sweep(sweep)
+    return len(sweeps)
+
+def main(regions=None, bulk_load=False):
+    """Scans every region in `regions`, concurrently when there are several.
+
+    Each region has its own client, worker pool and database writer; only the API request quota,
+    which belongs to our credentials, is shared.
+    """
+    regions = regions or setup_database.REGIONS
+    if len(regions) == 1:
+        scan_region(regions[0], bulk_load)
+        return
+
+    rate_limiter = RateLimiter(REQUESTS_PER_SECOND, REQUESTS_PER_HOUR)
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        futures = {executor.submit(scan_region, region, bulk_load, rate_limiter): region for region in regions}
+        for future, region in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Scan of region {region} failed: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scans every connected realm's auction house into the database.")
+    parser.add_argument("--region", action="append",
+                        help="region to scan, may be repeated to scan several at once (default: WOW_REGIONS, or eu)")
+    parser.add_argument("--bulk-load", action="store_true",
+                        help="drop reader-only indexes before the sweep and rebuild them afterwards (faster full loads)")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-ingest archived sweeps (see SCANNER_ARCHIVE) instead of calling the API")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="with --replay: skip sweeps before this time")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="with --replay: skip sweeps after this time")
+    parser.add_argument("--find-deals", action="store_true",
+                        help="with --replay: print the find_deals.py report after every replayed sweep")
+    parser.add_argument("--workdir",
+                        help="with --replay: write the database and price history to this directory instead of the live ones")
+    parser.add_argument("--force", action="store_true",
+                        help="with --replay: replay into a database that holds a live scan")
+    args = parser.parse_args()
+    if not args.replay:
+        main(regions=args.region, bulk_load=args.bulk_load)
+    else:
+        import find_deals
+        for region in args.region or setup_database.REGIONS:
+            after_sweep = None
+            if args.find_deals:
+                find_deals.DB_FILE, find_deals.HISTORY_DIR = replay_paths(region, args.workdir)
+                after_sweep = lambda sweep: find_deals.analyze_market_optimized(now=sweep['started_at'])
+            replay_region(region, args.since, args.until, args.bulk_load, after_sweep, args.workdir, args.force)
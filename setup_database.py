@@ -1,6 +1,28 @@
+import argparse
+import os
 import sqlite3
+# numpy and deal_engine are imported by the functions that summarize auctions, so that importing
+# this module (as the web app does, to connect and migrate) doesn't load NumPy
 
-DB_FILE = "wow_auctions.db"
+# --- Regions ---
+# Every region is scanned into its own database. WOW_REGIONS lists the regions the scanner scans
+# and the web app serves by default; scripts take --region to pick one.
+REGIONS = [region.strip() for region in os.getenv("WOW_REGIONS", "eu").split(",") if region.strip()]
+DEFAULT_REGION = REGIONS[0]
+DB_FILE_TEMPLATE = "wow_auctions_{region}.db"
+# Before regions were configurable everything was EU and lived here; it is kept in use if it exists
+LEGACY_DB_FILE = "wow_auctions.db"
+LEGACY_REGION = "eu"
+
+
+def db_file_for_region(region):
+    """Returns the database file of a region's shard."""
+    if region == LEGACY_REGION and os.path.exists(LEGACY_DB_FILE):
+        return LEGACY_DB_FILE
+    return DB_FILE_TEMPLATE.format(region=region)
+
+
+DB_FILE = db_file_for_region(DEFAULT_REGION)
 
 # SQL command for the main auctions table (unchanged)
 CREATE_AUCTIONS_TABLE_SQL = """
@@ -15,6 +37,90 @@ CREATE TABLE IF NOT EXISTS auctions (
 );
 """
 
+# Index used to replace or diff a single realm's auctions (superseded by idx_auctions_realm_item)
+CREATE_AUCTIONS_REALM_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_auctions_realm ON auctions (connected_realm_id);
+"""
+
+# Covering index for the scanner's per-realm diff and price summary
+CREATE_AUCTIONS_REALM_ITEM_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_auctions_realm_item ON auctions (connected_realm_id, item_id, buyout_price, quantity);
+"""
+
+# Covering index for per-item price lookups (query_prices.py). The scanner never reads it,
+# so bulk loads drop it before a sweep and rebuild it afterwards.
+CREATE_AUCTIONS_ITEM_PRICE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_auctions_item_price ON auctions (item_id, buyout_price, connected_realm_id);
+"""
+
+CREATE_ITEMS_QUALITY_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_items_quality ON items (quality);
+"""
+
+# SQL command for the per-realm snapshot table (Last-Modified of the last ingested dump, and when it
+# was last saved or found unchanged)
+CREATE_REALM_SNAPSHOTS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS realm_snapshots (
+    connected_realm_id INTEGER PRIMARY KEY,
+    last_modified TEXT NOT NULL,
+    scan_timestamp DATETIME NOT NULL
+);
+"""
+
+# SQL command for the per-(item, realm) price summary the scanner maintains for the deal finders
+CREATE_REALM_MIN_PRICES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS realm_min_prices (
+    item_id INTEGER NOT NULL,
+    connected_realm_id INTEGER NOT NULL,
+    min_buyout INTEGER NOT NULL,
+    auction_count INTEGER NOT NULL,
+    total_quantity INTEGER NOT NULL,
+    PRIMARY KEY (item_id, connected_realm_id)
+) WITHOUT ROWID;
+"""
+
+# Fills the summary from auctions already in the database (only used when it's empty)
+BACKFILL_REALM_MIN_PRICES_SQL = """
+INSERT INTO realm_min_prices (item_id, connected_realm_id, min_buyout, auction_count, total_quantity)
+SELECT item_id, connected_realm_id, MIN(buyout_price), COUNT(*), SUM(quantity)
+FROM auctions
+WHERE buyout_price IS NOT NULL
+GROUP BY item_id, connected_realm_id;
+"""
+
+# SQL command for the per-(item, realm) order books: the realm's listings of the item as a per-unit
+# price ladder, stored as int64 arrays (see deal_engine.OrderBook)
+CREATE_ORDER_BOOKS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS order_books (
+    item_id INTEGER NOT NULL,
+    connected_realm_id INTEGER NOT NULL,
+    listings INTEGER NOT NULL,
+    unit_prices BLOB NOT NULL,
+    cumulative_quantity BLOB NOT NULL,
+    cumulative_cost BLOB NOT NULL,
+    PRIMARY KEY (item_id, connected_realm_id)
+) WITHOUT ROWID;
+"""
+
+# SQL command for the region-wide commodity order book: one row per (item, unit price) level
+# with the summed quantity, instead of one row per commodity auction
+CREATE_COMMODITY_PRICE_LEVELS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS commodity_price_levels (
+    item_id INTEGER NOT NULL,
+    unit_price INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (item_id, unit_price)
+) WITHOUT ROWID;
+"""
+
+# SQL command for scanner bookkeeping, e.g. the snapshot version readers key their caches on
+CREATE_SCAN_METADATA_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS scan_metadata (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
 # SQL command for items cache table
 CREATE_ITEMS_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS items (
@@ -25,6 +131,45 @@ CREATE TABLE IF NOT EXISTS items (
 );
 """
 
+# SQL command for the negative cache of item lookups that failed (retried after a TTL)
+CREATE_ITEM_LOOKUP_FAILURES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS item_lookup_failures (
+    item_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    last_attempt DATETIME NOT NULL
+);
+"""
+
+# SQL command for the deals deal_worker.py precomputes from each snapshot: every scored item, so the
+# web app only has to filter, sort and page. first_seen is unique and breaks ties exactly like
+# deal_engine.find_deals, so it completes every keyset.
+CREATE_DEAL_CANDIDATES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS deal_candidates (
+    item_id INTEGER PRIMARY KEY,
+    item_name TEXT NOT NULL,
+    icon_url TEXT NOT NULL,
+    quality TEXT,
+    realm_count INTEGER NOT NULL,
+    kept_count INTEGER NOT NULL,
+    min_price INTEGER NOT NULL,
+    min_realm INTEGER NOT NULL,
+    max_price INTEGER NOT NULL,
+    max_realm INTEGER NOT NULL,
+    ratio REAL NOT NULL,
+    profit INTEGER NOT NULL,
+    liquidity INTEGER NOT NULL,
+    first_seen INTEGER NOT NULL
+);
+"""
+
+# One per /api/deals sort key, plus the quality filter
+CREATE_DEAL_CANDIDATES_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_deal_candidates_ratio ON deal_candidates (ratio DESC, first_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_deal_candidates_profit ON deal_candidates (profit DESC, first_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_deal_candidates_liquidity ON deal_candidates (liquidity DESC, first_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_deal_candidates_quality ON deal_candidates (quality, ratio DESC, first_seen)",
+]
+
 # SQL command for realms cache table
 CREATE_REALMS_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS realms (
@@ -34,24 +179,260 @@ CREATE TABLE IF NOT EXISTS realms (
 """
 
 
-try:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    print(f"Successfully connected to database file: {DB_FILE}")
+# --- Connection profiles ---
+# Readers (the web app, find_deals.py, query_prices.py) get a large page cache and mmap.
+READER_PRAGMAS = {
+    "cache_size": -65536,  # Negative means KiB: 64 MiB
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+# The scanner and cache updaters write in WAL mode, so readers are never blocked by a sweep.
+WRITER_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL: a power loss can only drop the latest commits
+    "cache_size": -262144,  # 256 MiB
+    "mmap_size": 268435456,
+    "busy_timeout": 30000,
+}
+# ----------------------
 
-    # Execute the SQL commands to create the tables
+# Secondary indexes only readers need; dropped during bulk loads and rebuilt afterwards
+BULK_LOAD_INDEXES = {
+    "idx_auctions_item_price": CREATE_AUCTIONS_ITEM_PRICE_INDEX_SQL,
+}
+
+
+def connect(db_file=DB_FILE, read_only=False, **kwargs):
+    """Opens the database with the reader or writer pragma profile applied."""
+    if read_only:
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, **kwargs)
+        pragmas = READER_PRAGMAS
+    else:
+        conn = sqlite3.connect(db_file, **kwargs)
+        pragmas = WRITER_PRAGMAS
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def migration_1_base_schema(cursor):
+    """Base schema: auctions, realm snapshots and price summary, item and realm caches."""
     cursor.execute(CREATE_AUCTIONS_TABLE_SQL)
-    print("'auctions' table checked.")
+    cursor.execute(CREATE_AUCTIONS_REALM_INDEX_SQL)
+    cursor.execute(CREATE_REALM_SNAPSHOTS_TABLE_SQL)
+    cursor.execute(CREATE_REALM_MIN_PRICES_TABLE_SQL)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM realm_min_prices)")
+    if not cursor.fetchone()[0]:
+        cursor.execute(BACKFILL_REALM_MIN_PRICES_SQL)
+    cursor.execute(CREATE_SCAN_METADATA_TABLE_SQL)
     cursor.execute(CREATE_ITEMS_TABLE_SQL)
-    print("'items' table created or already exists.")
+    cursor.execute(CREATE_ITEM_LOOKUP_FAILURES_TABLE_SQL)
     cursor.execute(CREATE_REALMS_TABLE_SQL)
-    print("'realms' table created or already exists.")
-    
-    conn.commit()
-    conn.close()
 
-    print("Database setup complete.")
 
-except sqlite3.Error as e:
-    print(f"Database error: {e}")
\ No newline at end of file
+def migration_2_covering_indexes(cursor):
+    """Covering indexes for the scanner's per-realm writes, per-item price lookups and quality filters."""
+    cursor.execute(CREATE_AUCTIONS_REALM_ITEM_INDEX_SQL)
+    cursor.execute("DROP INDEX IF EXISTS idx_auctions_realm")
+    cursor.execute(CREATE_AUCTIONS_ITEM_PRICE_INDEX_SQL)
+    cursor.execute(CREATE_ITEMS_QUALITY_INDEX_SQL)
+
+
+def migration_3_commodities(cursor):
+    """Commodity order book and per-unit realm minimums to compare realm listings against it."""
+    cursor.execute(CREATE_COMMODITY_PRICE_LEVELS_TABLE_SQL)
+    cursor.execute("ALTER TABLE realm_min_prices ADD COLUMN min_unit_price INTEGER")
+    cursor.execute("""
+        UPDATE realm_min_prices SET min_unit_price = (
+            SELECT MIN(buyout_price / quantity) FROM auctions
+            WHERE auctions.connected_realm_id = realm_min_prices.connected_realm_id
+              AND auctions.item_id = realm_min_prices.item_id
+              AND buyout_price IS NOT NULL
+        )
+    """)
+
+
+def migration_4_price_distribution(cursor):
+    """Per-(item, realm) price quartiles and total buyout, so price lookups don't scan every auction."""
+    cursor.execute("ALTER TABLE realm_min_prices ADD COLUMN p25_buyout REAL")
+    cursor.execute("ALTER TABLE realm_min_prices ADD COLUMN median_buyout REAL")
+    cursor.execute("ALTER TABLE realm_min_prices ADD COLUMN p75_buyout REAL")
+    cursor.execute("ALTER TABLE realm_min_prices ADD COLUMN total_buyout INTEGER")
+    cursor.execute("SELECT DISTINCT connected_realm_id FROM auctions")
+    for (realm_id,) in cursor.fetchall():
+        refresh_realm_min_prices(cursor, realm_id)
+
+
+def migration_5_realm_metadata(cursor):
+    """Connected-realm population, region and locale, plus what's needed to refresh realms conditionally."""
+    cursor.execute("ALTER TABLE realms ADD COLUMN population TEXT")
+    cursor.execute("ALTER TABLE realms ADD COLUMN region TEXT")
+    cursor.execute("ALTER TABLE realms ADD COLUMN locale TEXT")
+    cursor.execute("ALTER TABLE realms ADD COLUMN last_modified TEXT")
+    cursor.execute("ALTER TABLE realms ADD COLUMN content_hash TEXT")
+
+
+def migration_6_deal_candidates(cursor):
+    """Precomputed deal candidates, written by deal_worker.py and only read by the web app."""
+    cursor.execute(CREATE_DEAL_CANDIDATES_TABLE_SQL)
+    for create_sql in CREATE_DEAL_CANDIDATES_INDEXES_SQL:
+        cursor.execute(create_sql)
+
+
+def migration_7_order_books(cursor):
+    """Per-unit order books of every (item, realm), and the depth of each deal candidate."""
+    cursor.execute(CREATE_ORDER_BOOKS_TABLE_SQL)
+    cursor.execute("SELECT DISTINCT connected_realm_id FROM auctions")
+    for (realm_id,) in cursor.fetchall():
+        write_realm_order_books(cursor, realm_id, load_realm_listings(cursor, realm_id))
+    cursor.execute("ALTER TABLE deal_candidates ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+    # Deals are now scored by unit price; have deal_worker.py recompute them
+    cursor.execute("DELETE FROM scan_metadata WHERE key = 'deals_snapshot_version'")
+
+
+# Applied in order; PRAGMA user_version holds the number of the last one applied.
+# Never edit a released migration, append a new one instead.
+MIGRATIONS = [
+    migration_1_base_schema,
+    migration_2_covering_indexes,
+    migration_3_commodities,
+    migration_4_price_distribution,
+    migration_5_realm_metadata,
+    migration_6_deal_candidates,
+    migration_7_order_books,
+]
+
+
+def migrate(conn):
+    """Brings the schema up to date and enables WAL. Returns the migrations that were applied."""
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # Transactions are managed explicitly below
+    try:
+        # journal_mode is persistent, but can't be changed inside a transaction
+        conn.execute("PRAGMA journal_mode = WAL")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        applied = []
+        for number, migration in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            applied.append(migration)
+        return applied
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def load_realm_listings(cursor, realm_id):
+    """Returns a realm's buyout listings as an (item_id, buyout_price, quantity) int64 array, or None if it has none.
+
+    Reads the realm through the (realm, item, buyout, quantity) index, already in the order the
+    per-item price distribution needs.
+    """
+    cursor.execute("""
+        SELECT item_id, buyout_price, quantity FROM auctions
+        WHERE connected_realm_id = ? AND buyout_price IS NOT NULL
+        ORDER BY item_id, buyout_price
+    """, (realm_id,))
+    rows = cursor.fetchall()
+    import numpy as np
+    return np.array(rows, dtype=np.int64) if rows else None
+
+
+def refresh_realm_min_prices(cursor, realm_id):
+    """Rebuilds the `realm_min_prices` rows of one realm from its stored auctions."""
+    write_realm_min_prices(cursor, realm_id, load_realm_listings(cursor, realm_id))
+
+
+def refresh_realm_summaries(cursor, realm_id):
+    """Rebuilds the price summary and the order books of one realm, reading its auctions once."""
+    data = load_realm_listings(cursor, realm_id)
+    write_realm_min_prices(cursor, realm_id, data)
+    write_realm_order_books(cursor, realm_id, data)
+
+
+def write_realm_min_prices(cursor, realm_id, data):
+    cursor.execute("DELETE FROM realm_min_prices WHERE connected_realm_id = ?", (realm_id,))
+    if data is None:
+        return
+    import deal_engine
+    summary = deal_engine.summarize_prices(data[:, 0], data[:, 1], data[:, 2])
+    columns = [summary[name].tolist() for name in (
+        "item_id", "min", "listings", "quantity", "min_unit_price", "p25", "median", "p75", "total_buyout"
+    )]
+    cursor.executemany("""
+        INSERT INTO realm_min_prices (item_id, connected_realm_id, min_buyout, auction_count, total_quantity,
+                                      min_unit_price, p25_buyout, median_buyout, p75_buyout, total_buyout)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, ((item_id, realm_id, *rest) for item_id, *rest in zip(*columns)))
+
+
+def write_realm_order_books(cursor, realm_id, data):
+    cursor.execute("DELETE FROM order_books WHERE connected_realm_id = ?", (realm_id,))
+    if data is None:
+        return
+    import deal_engine
+    books = deal_engine.build_order_books(data[:, 0], data[:, 1], data[:, 2])
+    ladders = [books[name].astype(deal_engine.ORDER_BOOK_DTYPE)
+               for name in ("unit_price", "cumulative_quantity", "cumulative_cost")]
+
+    def rows():
+        for item_id, start, listings in zip(books["item_id"].tolist(), books["start"].tolist(), books["listings"].tolist()):
+            end = start + listings
+            yield (item_id, realm_id, listings, *(ladder[start:end].tobytes() for ladder in ladders))
+
+    cursor.executemany("""
+        INSERT INTO order_books (item_id, connected_realm_id, listings, unit_prices, cumulative_quantity, cumulative_cost)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows())
+
+
+def drop_bulk_load_indexes(conn):
+    """Drops reader-only indexes so a large sweep doesn't have to maintain them row by row."""
+    for name in BULK_LOAD_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_bulk_load_indexes(conn):
+    """Rebuilds the indexes dropped by drop_bulk_load_indexes and refreshes planner statistics."""
+    for create_sql in BULK_LOAD_INDEXES.values():
+        conn.execute(create_sql)
+    conn.execute("PRAGMA optimize")
+
+
+def main(region=DEFAULT_REGION):
+    db_file = db_file_for_region(region)
+    try:
+        conn = connect(db_file)
+        print(f"Successfully connected to database file: {db_file}")
+
+        applied = migrate(conn)
+        for migration in applied:
+            print(f"Applied {migration.__name__}: {migration.__doc__}")
+        if not applied:
+            print("Schema is already up to date.")
+        # Indexes may be missing if a bulk-load scan was interrupted
+        create_bulk_load_indexes(conn)
+        conn.close()
+
+        print("Database setup complete.")
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates or migrates the database of one or more regions.")
+    parser.add_argument("--region", action="append",
+                        help="Region to set up, may be repeated (default: every region in WOW_REGIONS)")
+    args = parser.parse_args()
+    for region in args.region or REGIONS:
+        main(region)
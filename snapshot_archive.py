@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+# --- Configuration ---
+ARCHIVE_DIR = os.getenv("SCANNER_ARCHIVE_DIR", "raw_archive")
+COMPRESSION_LEVEL = 6  # gzip level of archived dumps; 1 is fastest, 9 smallest
+# ----------------------
+
+# Every region has its own directory. Dumps are stored gzipped in objects/, named by the SHA-256 of
+# their JSON, so a dump that is served twice is only stored once. Each sweep writes a manifest to
+# sweeps/ that maps every realm (and "commodities") it downloaded to its dump, Last-Modified and
+# fetch time; replaying the manifests in order rebuilds the database (see scanner.py --replay).
+SWEEP_FORMAT = "%Y-%m-%dT%H-%M-%S"
+
+
+def archive_dir_for_region(region, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, region)
+
+
+def object_path(region_dir, digest):
+    return os.path.join(region_dir, "objects", digest[:2], f"{digest}.json.gz")
+
+
+class DumpWriter:
+    """Compresses a dump into the archive while the scanner reads it, hashing it on the way.
+
+    The dump is written to a temporary file first and only moved to its content address by
+    commit(), so a failed download never leaves a truncated dump behind.
+    """
+
+    def __init__(self, region_dir):
+        self.region_dir = region_dir
+        objects_dir = os.path.join(region_dir, "objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(suffix=".tmp", dir=objects_dir)
+        self.raw = os.fdopen(fd, "wb")
+        # mtime=0 keeps the compressed bytes of identical dumps identical
+        self.file = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=COMPRESSION_LEVEL, mtime=0)
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()  # Doesn't close the file object it was given
+        self.raw.close()
+
+    def commit(self):
+        """Moves the finished dump to its content address. Returns its SHA-256."""
+        self.close()
+        digest = self.sha256.hexdigest()
+        path = object_path(self.region_dir, digest)
+        if os.path.exists(path):
+            os.remove(self.temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temp_path, path)
+        self.temp_path = None
+        return digest
+
+    def abort(self):
+        """Throws away a dump that wasn't committed; does nothing after commit()."""
+        if self.temp_path is None:
+            return
+        self.close()
+        os.remove(self.temp_path)
+        self.temp_path = None
+
+
+def open_dump(region_dir, digest):
+    """Opens an archived dump for reading; yields the uncompressed JSON."""
+    return gzip.open(object_path(region_dir, digest), "rb")
+
+
+def write_sweep_manifest(region_dir, started_at, dumps):
+    """Records the dumps of one sweep. `dumps` maps realm ids (or "commodities") to
+    {"sha256", "last_modified", "fetched_at"}."""
+    sweeps_dir = os.path.join(region_dir, "sweeps")
+    os.makedirs(sweeps_dir, exist_ok=True)
+    path = os.path.join(sweeps_dir, f"{started_at.strftime(SWEEP_FORMAT)}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"started_at": started_at.isoformat(), "dumps": {str(key): dump for key, dump in dumps.items()}}, f)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def list_sweeps(region_dir, since=None, until=None):
+    """Returns [(started_at, manifest path)] of the archived sweeps between `since` and `until`, oldest first."""
+    sweeps_dir = os.path.join(region_dir, "sweeps")
+    if not os.path.isdir(sweeps_dir):
+        return []
+    sweeps = []
+    for name in os.listdir(sweeps_dir):
+        try:
+            started_at = datetime.strptime(name, f"{SWEEP_FORMAT}.json")
+        except ValueError:
+            continue  # Half-written manifests
+        if (since is None or started_at >= since) and (until is None or started_at <= until):
+            sweeps.append((started_at, os.path.join(sweeps_dir, name)))
+    return sorted(sweeps)
+
+
+def load_sweep(path):
+    """Reads a sweep manifest. Realm ids are turned back into ints."""
+    with open(path) as f:
+        sweep = json.load(f)
+    return {
+        "started_at": datetime.fromisoformat(sweep["started_at"]),
+        "dumps": {int(key) if key.isdigit() else key: dump for key, dump in sweep["dumps"].items()},
+    }
@@ -0,0 +1,133 @@
+import os
+import sys
+import random
+import sqlite3
+import numpy as np
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import deal_engine
+
+# --- Configuration ---
+MIN_PRICE_RATIO = 3.0
+MIN_GOLD_PRICE = 1000
+MAX_REALISTIC_GOLD_PRICE = 3000000
+MIN_REALM_COUNT = 5
+RANDOM_SEED = 1234
+SYNTHETIC_ITEMS = 5000
+SHARD_COUNTS = (2, 3, 16)  # Process pool sizes compared with serial scoring
+
+
+def legacy_find_deals(all_realm_min_prices):
+    """The per-item loop the Flask app and find_deals.py used before deal_engine existed."""
+    item_data = defaultdict(list)
+    for item_id, realm_id, price in all_realm_min_prices:
+        item_data[item_id].append((price, realm_id))
+
+    deals = []
+    for item_id, price_realm_tuples in item_data.items():
+        if len(price_realm_tuples) < MIN_REALM_COUNT:
+            continue
+
+        prices_array = np.array([p for p, _ in price_realm_tuples])
+        q1 = np.percentile(prices_array, 25)
+        q3 = np.percentile(prices_array, 75)
+        iqr = q3 - q1
+        outlier_threshold = q3 + (1.5 * iqr)
+
+        realistic_data = [t for t in price_realm_tuples if t[0] <= outlier_threshold]
+        if realistic_data:
+            median_price = np.median([t[0] for t in realistic_data])
+            mad = np.median(np.abs([t[0] - median_price for t in realistic_data])) or 1
+            mad_threshold = 5 * mad
+            realistic_data = [
+                t for t in realistic_data
+                if abs(t[0] - median_price) <= mad_threshold
+            ]
+
+        if len(realistic_data) < MIN_REALM_COUNT:
+            continue
+
+        realistic_data.sort(key=lambda x: x[0])
+        min_price, min_realm = realistic_data[0]
+        max_price, max_realm = realistic_data[-1]
+
+        if min_price < (MIN_GOLD_PRICE * 10000) or max_price > (MAX_REALISTIC_GOLD_PRICE * 10000):
+            continue
+
+        ratio = max_price / min_price
+        if ratio < MIN_PRICE_RATIO:
+            continue
+
+        deals.append((item_id, ratio, min_price, min_realm, max_price, max_realm))
+
+    deals.sort(key=lambda x: x[1], reverse=True)
+    return deals
+
+
+def synthetic_rows():
+    """Skewed (item, realm, price) rows with ties, constant prices and extreme outliers."""
+    rng = random.Random(RANDOM_SEED)
+    rows = []
+    for item_id in range(1, SYNTHETIC_ITEMS + 1):
+        realm_count = rng.choice([1, 3, 4, 5, 6, 8, 12, 40, 90])
+        base = rng.choice([5000, 2000000, 10000000, 50000000, 200000000])
+        for realm_id in sorted(rng.sample(range(1000, 1200), realm_count)):
+            shape = rng.random()
+            if shape < 0.2:
+                price = base  # ties
+            elif shape < 0.3:
+                price = base * rng.randint(3, 50)  # outliers
+            else:
+                price = int(base * rng.uniform(0.3, 4.0))
+            rows.append((item_id, realm_id, price))
+    return rows
+
+
+def check(rows, label):
+    expected = legacy_find_deals(rows)
+    items, realms, prices = (np.array(column, dtype=np.int64) for column in zip(*rows)) if rows else ([], [], [])
+    actual = deal_engine.find_deals(items, realms, prices, MIN_PRICE_RATIO, MIN_GOLD_PRICE,
+                                    MAX_REALISTIC_GOLD_PRICE, MIN_REALM_COUNT)
+    if actual == expected:
+        print(f"{label}: OK, {len(actual)} identical deals from {len(rows)} rows.")
+        return True
+    print(f"{label}: MISMATCH ({len(actual)} deals from deal_engine, {len(expected)} from the legacy loop)")
+    for index, (new, old) in enumerate(zip(actual, expected)):
+        if new != old:
+            print(f"  First difference at rank {index}: {new} != {old}")
+            break
+    return False
+
+
+def check_parallel(rows, label):
+    """Sharded scoring in a process pool must give exactly the serial scores, on sorted and shuffled rows."""
+    items, realms, prices = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    shuffled = np.random.default_rng(RANDOM_SEED).permutation(len(items))
+    ok = True
+    for order_label, order in (("sorted", np.arange(len(items))), ("shuffled", shuffled)):
+        serial = deal_engine.score_items(items[order], realms[order], prices[order], workers=1)
+        for workers in SHARD_COUNTS:
+            sharded = deal_engine.score_items_parallel(items[order], realms[order], prices[order], workers)
+            different = [name for name in serial if not np.array_equal(serial[name], sharded[name])]
+            if different:
+                print(f"{label} ({order_label}, {workers} workers): MISMATCH in {', '.join(different)}")
+                ok = False
+    if ok:
+        print(f"{label}: OK, {len(SHARD_COUNTS)} shard counts score {len(rows)} rows exactly like the serial path.")
+    return ok
+
+
+if __name__ == "__main__":
+    ok = check(synthetic_rows(), "Synthetic data")
+    ok = check_parallel(synthetic_rows(), "Synthetic data, sharded") and ok
+    if len(sys.argv) > 1:
+        conn = sqlite3.connect(f"file:{sys.argv[1]}?mode=ro", uri=True)
+        rows = conn.execute(
+            "SELECT item_id, connected_realm_id, min_buyout FROM realm_min_prices ORDER BY item_id, connected_realm_id"
+        ).fetchall()
+        conn.close()
+        ok = check(rows, sys.argv[1]) and ok
+        if rows:
+            ok = check_parallel(rows, f"{sys.argv[1]}, sharded") and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import price_history
+
+# --- Configuration ---
+DAY = datetime(2024, 5, 1)
+REALMS = (1, 2, 3)
+
+
+def hourly_columns(hour):
+    """One item on every realm, with every averaged column equal to the hour (so the day's mean is 11.5)."""
+    count = len(REALMS)
+    return {
+        "item_id": np.full(count, 19019),
+        "realm_id": np.array(REALMS),
+        "min": np.full(count, 100 + hour),
+        "p25": np.full(count, hour),
+        "median": np.full(count, hour),
+        "quantity": np.full(count, hour),
+        "listings": np.full(count, hour),
+        "min_unit_price": np.full(count, 10 + hour),
+        "samples": np.ones(count),
+    }
+
+
+def roll_up_day(hourly):
+    """Writes the 24 hours of DAY and returns its daily bucket. With `hourly`, rolls up after every
+    hour like the scanner does after every sweep; otherwise once, after the whole day passed the cutoff."""
+    with tempfile.TemporaryDirectory() as history_dir:
+        for hour in range(24):
+            bucket_time = DAY + timedelta(hours=hour)
+            price_history.write_bucket(price_history.bucket_path(price_history.HOURLY, bucket_time, history_dir),
+                                       hourly_columns(hour))
+            if hourly:
+                price_history.roll_up(bucket_time + timedelta(days=price_history.HOURLY_RETENTION_DAYS, minutes=1),
+                                      history_dir=history_dir)
+        if not hourly:
+            price_history.roll_up(DAY + timedelta(days=price_history.HOURLY_RETENTION_DAYS + 1, minutes=1),
+                                  history_dir=history_dir)
+        (_, path), = price_history.list_buckets(price_history.DAILY, history_dir)
+        leftover = price_history.list_buckets(price_history.HOURLY, history_dir)
+        return {name: np.array(values) for name, values in price_history.read_bucket(path).items()}, leftover
+
+
+def check(hourly, label):
+    daily, leftover = roll_up_day(hourly)
+    expected = {"min": 100, "min_unit_price": 10, "p25": 11.5, "median": 11.5, "quantity": 12, "listings": 12, "samples": 24}
+    wrong = {name: daily[name][0] for name, value in expected.items() if not np.all(daily[name] == value)}
+    if wrong or leftover:
+        print(f"{label}: MISMATCH, got {wrong} (expected {expected}), {len(leftover)} hourly buckets left")
+        return False
+    print(f"{label}: OK, the day's {expected['samples']} hours average to a median of {daily['median'][0]}.")
+    return True
+
+
+def check_baselines(label):
+    """A backtest at 05:30 must only see the hours up to 05:00 (min unit prices 10..15)."""
+    with tempfile.TemporaryDirectory() as history_dir:
+        for hour in range(24):
+            bucket_time = DAY + timedelta(hours=hour)
+            price_history.write_bucket(price_history.bucket_path(price_history.HOURLY, bucket_time, history_dir),
+                                       hourly_columns(hour))
+        baseline = price_history.item_baselines(1, DAY + timedelta(hours=5, minutes=30), history_dir)[19019]
+    if baseline != 12.5:
+        print(f"{label}: MISMATCH, baseline {baseline} (expected 12.5)")
+        return False
+    print(f"{label}: OK, the baseline only uses the hours before the backtested snapshot.")
+    return True
+
+
+if __name__ == "__main__":
+    ok = check(False, "One roll-up per day")
+    ok = check(True, "One roll-up per hour") and ok
+    ok = check_baselines("Backtest baseline") and ok
+    sys.exit(0 if ok else 1)
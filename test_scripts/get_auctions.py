@@ -7,7 +7,7 @@ load_dotenv()
 # --- Configuration ---
 client_id = os.getenv("CLIENT_ID")
 client_secret = os.getenv("SECRET_KEY")
-region = 'eu'
+region = os.getenv("WOW_REGIONS", "eu").split(",")[0].strip()  # The first configured region
 namespace = f'dynamic-{region}'
 locale = 'en_US'
 
@@ -7,7 +7,7 @@ load_dotenv()
 # --- Configuration ---
 client_id = os.getenv("CLIENT_ID")
 client_secret = os.getenv("SECRET_KEY")
-region = 'eu'
+region = os.getenv("WOW_REGIONS", "eu").split(",")[0].strip()  # The first configured region
 namespace = f'dynamic-{region}'
 locale = 'en_US'
 
@@ -45,7 +45,7 @@ api_params = {
 }
 
 try:
-    print("Fetching connected realms for EU region...")
+    print(f"Fetching connected realms for {region.upper()} region...")
     realms_response = requests.get(realms_url, headers=api_headers, params=api_params)
     realms_response.raise_for_status()
     
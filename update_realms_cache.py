@@ -1,73 +1,144 @@
-from dotenv import load_dotenv
+import argparse
+import hashlib
+import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-import sqlite3
-
-load_dotenv()
+import setup_database
+from blizzard_api import BlizzardClient
 
 # --- Configuration ---
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("SECRET_KEY")
-region = 'eu'
-namespace = f'dynamic-{region}'
-DB_FILE = "wow_auctions.db"
-
-def get_access_token():
-    """Gets an access token from the Blizzard API."""
-    token_url = f'https://{region}.oauth.battle.net/token'
-    payload = {'grant_type': 'client_credentials'}
-    try:
-        response = requests.post(token_url, data=payload, auth=(client_id, client_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
-    except requests.exceptions.RequestException as err:
-        print(f"Error obtaining token: {err}")
-        return None
-
-def main():
-    print("Starting realm cache update...")
-    access_token = get_access_token()
-    if not access_token:
+REALM_WORKERS = int(os.getenv("REALMS_WORKERS", "8"))  # Parallel connected-realm detail requests
+# Set REALMS_FULL_REFRESH=1 to ignore the stored Last-Modified headers and re-fetch every realm
+FULL_REFRESH = os.getenv("REALMS_FULL_REFRESH", "0") != "0"
+# ----------------------
+
+REALM_ID_PATTERN = re.compile(r"/connected-realm/(\d+)")
+
+
+def realm_metadata(details, region):
+    """Name, population, region and locale of a connected realm from its details response."""
+    realms = details['realms']
+    # Join the names of the realms in the connection, e.g., "Khadgar / Bloodhoof"
+    name = " / ".join(sorted([realm['name']['en_US'] for realm in realms]))
+    population = (details.get('population') or {}).get('type')
+    realm_region = next((realm['region']['name']['en_US'] for realm in realms
+                         if isinstance(realm.get('region'), dict)), None)
+    locales = sorted({realm['locale'] for realm in realms if realm.get('locale')})
+    return {
+        "name": name,
+        "population": population,
+        "region": realm_region or region.upper(),
+        "locale": ",".join(locales) or None,
+    }
+
+
+def content_hash(metadata):
+    """Hash of the fields we store, so a re-fetched realm that didn't change isn't rewritten."""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+
+def fetch_realm_details(client, href, last_modified):
+    """Fetches one connected realm. Returns (details, Last-Modified), or (None, last_modified) on 304."""
+    headers = {'If-Modified-Since': last_modified} if last_modified else None
+    response = client.get(href, client.dynamic_namespace, headers=headers)
+    if response.status_code == 304:
+        return None, last_modified
+    response.raise_for_status()
+    return response.json(), response.headers.get('Last-Modified')
+
+
+def load_known_realms(cursor):
+    """Returns {connected_realm_id: (Last-Modified, content hash)} of the realms stored so far."""
+    cursor.execute("SELECT connected_realm_id, last_modified, content_hash FROM realms")
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def main(region=setup_database.DEFAULT_REGION):
+    print(f"Starting realm cache update for region {region}...")
+    client = BlizzardClient(region, pool_size=REALM_WORKERS)
+    if not client.get_token():
         return
 
-    headers = {'Authorization': f'Bearer {access_token}', 'Battlenet-Namespace': namespace}
-    
+    conn = setup_database.connect(setup_database.db_file_for_region(region))
+    setup_database.migrate(conn)
+    cursor = conn.cursor()
+    known = load_known_realms(cursor)
+
     # 1. Get the index of all connected realms
-    index_url = f"https://{region}.api.blizzard.com/data/wow/connected-realm/index"
-    response = requests.get(index_url, headers=headers)
+    response = client.get('/data/wow/connected-realm/index', client.dynamic_namespace)
     response.raise_for_status()
     connected_realms_index = response.json().get('connected_realms', [])
-    
+
     print(f"Found {len(connected_realms_index)} connected realms. Fetching details...")
 
-    realms_to_insert = []
-    for realm_ref in connected_realms_index:
-        try:
-            # 2. For each connected realm, fetch its detailed information
-            details_url = realm_ref['href']
-            details_response = requests.get(details_url, headers=headers)
-            details_response.raise_for_status()
-            details = details_response.json()
-            
+    # 2. Fetch the details of every connected realm concurrently. Realms we already have are
+    # requested with If-Modified-Since (except on a full refresh), so unchanged ones come back as an
+    # empty 304. Re-fetched realms whose stored fields didn't change still aren't rewritten.
+    index_ids = set()
+    changed = []
+    unchanged = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=REALM_WORKERS) as executor:
+        futures = {}
+        for realm_ref in connected_realms_index:
+            match = REALM_ID_PATTERN.search(realm_ref['href'])
+            realm_id = int(match.group(1)) if match else None
+            if realm_id is not None:
+                index_ids.add(realm_id)
+            last_modified = None if FULL_REFRESH else known.get(realm_id, (None, None))[0]
+            futures[executor.submit(fetch_realm_details, client, realm_ref['href'], last_modified)] = realm_id
+
+        for future in as_completed(futures):
+            try:
+                details, last_modified = future.result()
+            except (requests.exceptions.RequestException, KeyError, ValueError) as err:
+                failed += 1
+                print(f"Could not fetch details for a realm. Error: {err}")
+                continue
+            if details is None:
+                unchanged += 1
+                continue
+
             connected_realm_id = details['id']
-            # Join the names of the realms in the connection, e.g., "Khadgar / Bloodhoof"
-            realm_names = " / ".join(sorted([realm['name']['en_US'] for realm in details['realms']]))
-            
-            realms_to_insert.append((connected_realm_id, realm_names))
-            print(f"Fetched: {realm_names} (ID: {connected_realm_id})")
-
-        except requests.exceptions.RequestException as err:
-            print(f"Could not fetch details for a realm. Error: {err}")
-
-    # 3. Insert all fetched realm names into the database
-    if realms_to_insert:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        # Use "INSERT OR REPLACE" to update existing entries if the script is run again
-        cursor.executemany("INSERT OR REPLACE INTO realms (connected_realm_id, name) VALUES (?, ?)", realms_to_insert)
-        conn.commit()
-        conn.close()
-        print(f"\nSuccessfully saved {len(realms_to_insert)} realm names to the database.")
+            index_ids.add(connected_realm_id)
+            metadata = realm_metadata(details, region)
+            digest = content_hash(metadata)
+            if known.get(connected_realm_id, (None, None))[1] == digest:
+                unchanged += 1
+                # Remember the new Last-Modified so the next run gets a 304
+                cursor.execute("UPDATE realms SET last_modified = ? WHERE connected_realm_id = ?",
+                               (last_modified, connected_realm_id))
+                continue
+            changed.append((connected_realm_id, metadata["name"], metadata["population"], metadata["region"],
+                            metadata["locale"], last_modified, digest))
+            print(f"Fetched: {metadata['name']} (ID: {connected_realm_id})")
+
+    # 3. Save new and changed realms; drop the ones that left the index (only after a complete pass)
+    removed = []
+    if connected_realms_index and not failed:
+        removed = [(realm_id,) for realm_id in known if realm_id not in index_ids]
+        cursor.executemany("DELETE FROM realms WHERE connected_realm_id = ?", removed)
+    cursor.executemany("""
+        INSERT OR REPLACE INTO realms (connected_realm_id, name, population, region, locale, last_modified, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, changed)
+    if changed or removed:
+        # Tells the Flask app to reload its in-memory realm names
+        cursor.execute("""
+            INSERT INTO scan_metadata (key, value) VALUES ('realms_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1
+        """)
+    conn.commit()
+    conn.close()
+    print(f"\nSaved {len(changed)} new or changed realms; {unchanged} unchanged, "
+          f"{len(removed)} removed, {failed} failed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Caches the connected realms of one or more regions.")
+    parser.add_argument("--region", action="append",
+                        help="Region to update, may be repeated (default: every region in WOW_REGIONS)")
+    args = parser.parse_args()
+    for region in args.region or setup_database.REGIONS:
+        main(region)